@@ -1,6 +1,6 @@
-import asyncio
 import json
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Optional
 
 from aidial_client import AsyncDial
 from aidial_client.types.chat.legacy.chat_completion import CustomContent, ToolCall
@@ -8,9 +8,26 @@ from aidial_sdk.chat_completion import Message, Role, Choice, Request, Response
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
-from task.utils.constants import TOOL_CALL_HISTORY_KEY
+from task.utils.constants import TOOL_CALL_HISTORY_KEY, CUSTOM_CONTENT
+from task.utils.dial_clients import DialClientRegistry
 from task.utils.history import unpack_messages
 from task.utils.stage import StageProcessor
+from task.utils.stream_writer import StreamWriter, StreamWriterConfig
+from task.utils.tool_call_dispatcher import ToolCallDispatcher
+
+
+@dataclass(frozen=True)
+class ToolSet:
+    """
+    Tools together with their serialized schemas. When tools change, application replaces the whole set at once,
+    so each request works with consistent tools and schemas.
+    """
+    tools: list[BaseTool]
+    schemas: list[dict[str, Any]]
+
+    @classmethod
+    def create(cls, tools: list[BaseTool]) -> 'ToolSet':
+        return cls(tools=list(tools), schemas=GeneralPurposeAgent.serialize_tool_schemas(tools))
 
 
 class GeneralPurposeAgent:
@@ -20,18 +37,32 @@ class GeneralPurposeAgent:
             endpoint: str,
             system_prompt: str,
             tools: list[BaseTool],
+            client_registry: DialClientRegistry,
+            tool_schemas: Optional[list[dict[str, Any]]] = None,
+            max_iterations: int = 10,
+            stream_config: Optional[StreamWriterConfig] = None,
     ):
         #TODO:
         # 1. Set variables: endpoint, system_prompt, tools
         self.endpoint = endpoint
         self.system_prompt = system_prompt
         self.tools = tools
+        self.client_registry = client_registry
         # 2. Prepare tools_dict where key will be tool name and vale tool itself. It will help us to find tool faster
         #    on the tool call step
         self._tools_dict: dict[str, BaseTool] = {tool.name: tool for tool in tools}
         # 3. Create dict with `state` name. Inside this dict we need to add `TOOL_CALL_HISTORY_KEY` with empty array.
         #    Here, in state, we will 'hide' tool call history. We need it since we need to preserve full conversation history.
         self.state: dict[str, Any] = {TOOL_CALL_HISTORY_KEY: []}
+        # 4. Tool schemas are the same for each request, so application serializes them once and shares with agents
+        self.tool_schemas = tool_schemas if tool_schemas is not None else self.serialize_tool_schemas(tools)
+        # 5. Limit of orchestration model calls per request. The last call doesn't allow tool calls, so model has to
+        #    provide final answer instead of looping through tool calls forever
+        if max_iterations < 1:
+            raise ValueError("max_iterations must be at least 1")
+        self.max_iterations = max_iterations
+        # 6. Streamed content is coalesced into bigger frames according to deployment stream settings
+        self.stream_config = stream_config or StreamWriterConfig()
 
     @staticmethod
     def _json_safe(obj: Any) -> Any:
@@ -45,101 +76,122 @@ class GeneralPurposeAgent:
 
         return json.loads(json.dumps(obj, default=default))
 
+    @classmethod
+    def serialize_tool_schemas(cls, tools: list[BaseTool]) -> list[dict[str, Any]]:
+        """Provides JSON-safe tool schemas that can be reused between requests."""
+        return cls._json_safe([
+            tool.schema.model_dump(mode="json") if hasattr(tool.schema, "model_dump") else tool.schema
+            for tool in tools
+        ])
+
     async def handle_request(self, deployment_name: str, choice: Choice, request: Request, response: Response) -> Message:
         #TODO:
-        # 1. Create AsyncDial, don't forget to provide endpoint as base_url and api_key. Api_key you can take from `request` as well as api_version
+        # 1. Get AsyncDial from `client_registry` (it reuses keep-alive connections between requests), don't forget to
+        #    provide endpoint and api_key. Api_key you can take from `request` as well as api_version (it is passed with
+        #    each completion request)
         #    JFI: while request you will get Per-request API key (not `dial_api_key` configured in Core config). Read
         #    more about it -> https://docs.dialx.ai/platform/core/per-request-keys
-        dial_client = AsyncDial(
-            base_url=self.endpoint,
+        dial_client = self.client_registry.async_client(
+            endpoint=self.endpoint,
             api_key=request.api_key,
-            api_version=request.api_version
+        )
+        # 2. Prepare messages once: get messages from `request` and unpack them with `_prepare_messages` method. Each
+        #    iteration below only appends new assistant and tool messages to this list.
+        messages = self._json_safe(self._prepare_messages(request.messages))
+        conversation_id = request.headers.get('x-conversation-id')
+        # 3. Run orchestration loop:
+        #   - stream completion (tool calls are not allowed on the last iteration)
+        #   - if there are no tool calls then it is 'final result' from orchestration model
+        #   - otherwise wait for tool calls, append `assistant_message` and tool messages to the `state`
+        #     `TOOL_CALL_HISTORY_KEY` and to `messages` and go to the next iteration
+        content = ""
+        for iteration in range(1, self.max_iterations + 1):
+            tool_call_dispatcher = ToolCallDispatcher(
+                launch=lambda tool_call: self._process_tool_call(
+                    tool_call=tool_call,
+                    choice=choice,
+                    api_key=request.api_key,
+                    conversation_id=conversation_id,
+                )
             )
-        # 2. Create `chunks` with created AsyncDial client (chat -> completions -> create). Provide it with:
-        #    - messages: get messages from `request` and unpack them with `_prepare_messages` method
-        #    - tools: provide list with tool schemas
-        #    - deployment_name
-        #    - make it stream
-        raw_messages = self._prepare_messages(request.messages)
-        payload_messages = self._json_safe(raw_messages)
-        payload_tools = self._json_safe([
-            tool.schema.model_dump(mode="json") if hasattr(tool.schema, "model_dump") else tool.schema
-            for tool in self.tools
-        ])
+            use_tools = iteration < self.max_iterations
+            content = await self._stream_completion(
+                dial_client=dial_client,
+                deployment_name=deployment_name,
+                api_version=request.api_version,
+                messages=messages,
+                choice=choice,
+                tool_call_dispatcher=tool_call_dispatcher if use_tools else None,
+            )
+            if not tool_call_dispatcher.has_tool_calls:
+                break
+
+            tool_calls, tool_messages = await tool_call_dispatcher.finish()
+            assistant_message = Message(role=Role.ASSISTANT, content=content, tool_calls=tool_calls)
+            new_messages = self._json_safe([
+                {k: v for k, v in assistant_message.dict().items() if v is not None},
+                *tool_messages,
+            ])
+            for new_message in new_messages:
+                new_message.pop(CUSTOM_CONTENT, None)
+            self.state[TOOL_CALL_HISTORY_KEY].extend(new_messages)
+            messages.extend(new_messages)
+        # 4. We don't have any tool calls and reasy to finish user request. Set choice with `state` and return `assistant_message`
+        assistant_message = Message(role=Role.ASSISTANT, content=content)
+        choice.set_state(self.state)
+        return assistant_message
 
+    async def _stream_completion(
+            self,
+            dial_client: AsyncDial,
+            deployment_name: str,
+            api_version: Optional[str],
+            messages: list[dict[str, Any]],
+            choice: Choice,
+            tool_call_dispatcher: Optional[ToolCallDispatcher],
+    ) -> str:
+        # 1. Create `chunks` with AsyncDial client (chat -> completions -> create). Provide it with:
+        #    - messages
+        #    - tools: provide list with tool schemas. They are sent on the last iteration too (history contains tool
+        #      calls and some deployments, e.g. Anthropic ones, reject tool messages without declared tools), there
+        #      `tool_choice` is 'none', so model has to answer
+        #    - deployment_name and api_version
+        #    - make it stream
         chunks = await dial_client.chat.completions.create(
-            messages=payload_messages,
-            tools=payload_tools,
+            messages=messages,
+            tools=self.tool_schemas or None,
+            tool_choice="none" if self.tool_schemas and not tool_call_dispatcher else None,
             deployment_name=deployment_name,
+            api_version=api_version,
             stream=True,
         )
-        # 3. Create:
-        #   - `tool_call_index_map` (it is empty dict), here we will collect tool calls by their indexes.
-        #      Take a look how tool call streaming output is looks like, it is important! -> https://platform.openai.com/docs/guides/function-calling#streaming
-        #   - `content`, here we will collect the content from streaming
-        tool_call_index_map: dict[int, ToolCall] = {}
-        content = ""
-        # 4. Make async loop through `chunks` and then we need to collect content, tool calls and attachments:
+        # 2. Make async loop through `chunks` and then we need to collect content and tool calls:
         #   - If chunk has `choices` then:
         #       - Get 1st choice `delta`
         #       - if delta is present:
-        #           - if delta content is present then append this content to `choice` (it will be shown in DIAL Chat
-        #             choice), concat delta content to `content` variable
-        #           - if delta has tool_calls then:
-        #               - iterate through tool_calls:
-        #                   - if tool call has `id` (first chunk of tool call) then add to `tool_call_index_map` new
-        #                     tool_call_delta, key will be index and value tool call delta itself
-        #                   - otherwise: get by tool call delta `index` from the `tool_call_index_map` the tool call and
-        #                     then check if provided tool_call_delta contains `function`, if yes then you need to get from
-        #                     `function` `arguments` (if not present set them as empty string to not attach haphazardly None)
-        #                     as `argument_chunk` and add it to the extracted from map tool_call function arguments
-        async for chunk in chunks:
-            if chunk.choices:
-                delta = chunk.choices[0].delta
-                if delta:
-                    if delta.content:
-                        choice.append_content(delta.content)
-                        content += delta.content
-                    if delta.tool_calls:
-                        for tool_call_delta in delta.tool_calls:
-                            if tool_call_delta.id:
-                                tool_call_index_map[tool_call_delta.index] = tool_call_delta
-                            else:
-                                tool_call = tool_call_index_map.get(tool_call_delta.index)
-                                if tool_call and tool_call_delta.function:
-                                    argument_chunk = tool_call_delta.function.arguments or ""
-                                    tool_call.function.arguments += argument_chunk
-        # 5. Create `assistant_message`, with role, content and tool_calls. `tool_calls` should be a list with ToolCall
-        #    objects generated from `tool_call_index_map` dict values. to create ToolCall use `validate` method (it
-        #    will show you the notification that it is deprecated but we need to use it because DIAL SDK is built on top of pydentic.v1)
-        assistant_message = Message(
-            role=Role.ASSISTANT,
-            content=content,
-            tool_calls=[ToolCall.validate(tool_call) for tool_call in tool_call_index_map.values()]
-        )
-        # 6. Now we at the point where we need to understand if its 'final result' from orchestration model or not:
-        #    check if `assistant_message` contains `tool_calls`, if yes then we need:
-        #       - create `tasks` list. Iterate through `tool_calls` and call `_process_tool_call` method (do not use
-        #         `await` since we will run tool calls execution asynchronously), also you need to provide `conversation_id`
-        #         you can get it in `request` headers, its name is `x-conversation-id`
-        #       - now `gather` tasks with `asyncio` (here you need to await)
-        #       - to the `state` to `TOOL_CALL_HISTORY_KEY` append `assistant_message` as dict and exclude none from this dict
-        #       - extend the `state` `TOOL_CALL_HISTORY_KEY` with tool_messages that we executed above
-        #       - finally make recursive call
-        if assistant_message.tool_calls:
-            tasks = [self._process_tool_call(
-                tool_call=tool_call,
-                choice=choice,
-                api_key=request.api_key,
-                conversation_id=request.headers.get('x-conversation-id'),
-            ) for tool_call in assistant_message.tool_calls]
-            tool_messages = await asyncio.gather(*tasks)
-            self.state[TOOL_CALL_HISTORY_KEY].append({k: v for k, v in assistant_message.dict().items() if v is not None})
-            self.state[TOOL_CALL_HISTORY_KEY].extend(tool_messages)
-            return await self.handle_request(deployment_name, choice, request, response)
-        # 7. We don't have any tool calls and reasy to finish user request. Set choice with `state` and return `assistant_message`
-        choice.set_state(self.state)
-        return assistant_message
+        #           - if delta content is present then append this content to `content_writer`, it buffers content
+        #             and sends it to `choice` in bigger frames (it will be shown in DIAL Chat choice)
+        #           - if delta has tool_calls then pass each tool_call_delta to `tool_call_dispatcher`. It launches
+        #             each tool call as soon as its arguments are complete, so tools run while the model is still
+        #             streaming. Take a look how tool call streaming output is looks like, it is important!
+        #             -> https://platform.openai.com/docs/guides/function-calling#streaming
+        content_writer = StreamWriter(choice, self.stream_config)
+        try:
+            with content_writer:
+                async for chunk in chunks:
+                    if chunk.choices:
+                        delta = chunk.choices[0].delta
+                        if delta:
+                            if delta.content:
+                                content_writer.append_content(delta.content)
+                            if delta.tool_calls and tool_call_dispatcher:
+                                for tool_call_delta in delta.tool_calls:
+                                    tool_call_dispatcher.add_delta(tool_call_delta)
+        except BaseException:
+            if tool_call_dispatcher:
+                await tool_call_dispatcher.cancel()
+            raise
+        return content_writer.content
 
     def _prepare_messages(self, messages: list[Message]) -> list[dict[str, Any]]:
         #TODO:
@@ -149,13 +201,10 @@ class GeneralPurposeAgent:
         #    call system prompt, the reason is simple - security, if people will know our system prompt then it will be
         #    easier to manipulate LLM, so, best practices are to hide system prompt)
         unpucked_messages.insert(0, {"role": "system", "content": self.system_prompt})
-        # 3. Print history: iterate through unpacked messages and print as json (json.dumps)
-        for message in unpucked_messages:
-            print(json.dumps(message, indent=2))
-        # 4. Return unpacked messages
+        # 3. Return unpacked messages
         return unpucked_messages
 
-    async def _process_tool_call(self, tool_call: ToolCall, choice: Choice, api_key: str, conversation_id: str) -> dict[str, Any]:
+    async def _process_tool_call(self, tool_call: ToolCall, choice: Choice, api_key: str, conversation_id: Optional[str]) -> dict[str, Any]:
         #TODO:
         # 1. Get tool name from tool_call function name
         tool_name = tool_call.function.name
@@ -180,6 +229,7 @@ class GeneralPurposeAgent:
             conversation_id=conversation_id,
             choice=choice,
             stage=stage,
+            stream_config=self.stream_config,
         )
         tool_message = await tool.execute(params)
         # 6. Close stage with StageProcessor
@@ -1,6 +1,8 @@
+import asyncio
 import os
 import sys
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
 # Ensure project root on sys.path so `import task` works when run from the task/ directory
 ROOT = Path(__file__).resolve().parent.parent
@@ -11,39 +13,159 @@ import uvicorn
 from aidial_sdk import DIALApp
 from aidial_sdk.chat_completion import ChatCompletion, Request, Response
 
-from task.agent import GeneralPurposeAgent
+from task.agent import GeneralPurposeAgent, ToolSet
 from task.prompts import SYSTEM_PROMPT
 from task.tools.base import BaseTool
 from task.tools.deployment.image_generation_tool import ImageGenerationTool
 from task.tools.files.file_content_extraction_tool import FileContentExtractionTool
 from task.tools.py_interpreter.python_code_interpreter_tool import PythonCodeInterpreterTool
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.mcp.mcp_client import MCPClient, MCPClientConfig
 from task.tools.mcp.mcp_tool import MCPTool
-from task.tools.rag.document_cache import DocumentCache
-from task.tools.rag.rag_tool import RagTool
+from task.tools.mcp.mcp_tool_model import MCPToolModel
+from task.tools.mcp.mcp_tool_registry import MCPToolRegistry
+from task.utils.dial_clients import DialClientRegistry
+from task.utils.dial_file_conent_extractor import DialFileContentExtractor
+from task.utils.extracted_document_cache import ExtractedDocumentCache
+from task.utils.extraction_pool import ExtractionPool
+from task.utils.stream_writer import StreamWriterConfig
+
+if TYPE_CHECKING:
+    from task.tools.rag.rag_tool import RagTool
 
 DIAL_ENDPOINT = os.getenv('DIAL_ENDPOINT', "http://localhost:8080")
 DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', 'gpt-4o')
 #DEPLOYMENT_NAME = os.getenv('DEPLOYMENT_NAME', 'claude-sonnet-3-7')
+MAX_TOOL_ITERATIONS = int(os.getenv('MAX_TOOL_ITERATIONS', '10'))
+STREAM_FLUSH_SIZE = int(os.getenv('STREAM_FLUSH_SIZE', '2048'))
+STREAM_FLUSH_INTERVAL_MS = int(os.getenv('STREAM_FLUSH_INTERVAL_MS', '30'))
+DIAL_MAX_CONNECTIONS = int(os.getenv('DIAL_MAX_CONNECTIONS', '100'))
+DIAL_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('DIAL_MAX_KEEPALIVE_CONNECTIONS', '20'))
+DIAL_KEEPALIVE_EXPIRY = float(os.getenv('DIAL_KEEPALIVE_EXPIRY', '30'))
+EXTRACTION_THREAD_WORKERS = int(os.getenv('EXTRACTION_THREAD_WORKERS', '4'))
+EXTRACTION_PROCESS_WORKERS = int(os.getenv('EXTRACTION_PROCESS_WORKERS', '2'))
+EXTRACTED_DOCUMENT_CACHE_SIZE_MB = int(os.getenv('EXTRACTED_DOCUMENT_CACHE_SIZE_MB', '256'))
+EXTRACTED_DOCUMENT_CACHE_TTL_SECONDS = float(os.getenv('EXTRACTED_DOCUMENT_CACHE_TTL_SECONDS', '3600'))
+# Budget of parsed CSV frames, the last parsed frame is kept even if it is larger
+CSV_CACHE_SIZE_MB = int(os.getenv('CSV_CACHE_SIZE_MB', '512'))
+LAZY_PDF_EXTRACTION = os.getenv('LAZY_PDF_EXTRACTION', 'true').lower() == 'true'
+PDF_PAGES_PER_BATCH = int(os.getenv('PDF_PAGES_PER_BATCH', '4'))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', '32'))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '16'))
+MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '100'))
+DOWNLOAD_SPOOL_SIZE_MB = int(os.getenv('DOWNLOAD_SPOOL_SIZE_MB', '8'))
+# Directory of persisted RAG indexes, empty to keep them in memory only
+RAG_INDEX_DIR = os.getenv('RAG_INDEX_DIR', str(ROOT / '.rag_index'))
+RAG_CACHE_SIZE_MB = int(os.getenv('RAG_CACHE_SIZE_MB', '512'))
+RAG_FLAT_MAX_CHUNKS = int(os.getenv('RAG_FLAT_MAX_CHUNKS', '10000'))
+RAG_HNSW_MAX_CHUNKS = int(os.getenv('RAG_HNSW_MAX_CHUNKS', '200000'))
+# Vectors compression: 'none', 'sq8' or 'pq'
+RAG_QUANTIZATION = os.getenv('RAG_QUANTIZATION', 'none')
+# 'generate' (answer with inner LLM call), 'retrieve' (return ranked chunks to agent) or 'auto' (chunks for short
+# requests)
+RAG_MODE = os.getenv('RAG_MODE', 'auto')
+RAG_AUTO_RETRIEVAL_MAX_WORDS = int(os.getenv('RAG_AUTO_RETRIEVAL_MAX_WORDS', '12'))
+RAG_RETRIEVAL_CANDIDATES = int(os.getenv('RAG_RETRIEVAL_CANDIDATES', '8'))
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '2000'))
+# MCP sessions per server, calls go to the least loaded one, dead sessions are found by pings and replaced
+MCP_SESSIONS_PER_SERVER = int(os.getenv('MCP_SESSIONS_PER_SERVER', '2'))
+MCP_PING_INTERVAL_SECONDS = float(os.getenv('MCP_PING_INTERVAL_SECONDS', '30'))
+MCP_CALL_RETRIES = int(os.getenv('MCP_CALL_RETRIES', '2'))
+# Tool lists of MCP servers are refreshed in background after this time (and on change notifications)
+MCP_TOOLS_TTL_SECONDS = float(os.getenv('MCP_TOOLS_TTL_SECONDS', '300'))
+INTERPRETER_MCP_URL = 'http://localhost:8050/mcp'
+TOOLS_MCP_URL = 'http://localhost:8051/mcp'
+# Pre-started Python interpreter kernels for new conversations and idle time after which session of conversation
+# is forgotten
+INTERPRETER_WARM_SESSIONS = int(os.getenv('INTERPRETER_WARM_SESSIONS', '2'))
+INTERPRETER_SESSION_TTL_SECONDS = float(os.getenv('INTERPRETER_SESSION_TTL_SECONDS', '1800'))
+# Output files of code execution that are moved to DIAL bucket at once
+INTERPRETER_FILE_TRANSFER_CONCURRENCY = int(os.getenv('INTERPRETER_FILE_TRANSFER_CONCURRENCY', '4'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv('EMBEDDING_MAX_WAIT_MS', '5'))
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '50000'))
 
 
 class GeneralPurposeAgentApplication(ChatCompletion):
 
-    def __init__(self):
-        self.tools: list[BaseTool] = []
+    def __init__(
+            self,
+            client_registry: DialClientRegistry,
+            extraction_pool: ExtractionPool,
+            stream_config: Optional[StreamWriterConfig] = None,
+    ):
+        # Tools with their schemas, replaced as a whole when tools of MCP servers change
+        self.tool_set: Optional[ToolSet] = None
+        self._tools_lock = asyncio.Lock()
+        self._local_tools: list[BaseTool] = []
+        self._interpreter_tool: Optional[PythonCodeInterpreterTool] = None
+        # RAG tool owns background threads (cache cleanup, embedding), they are stopped on shutdown
+        self.rag_tool: Optional['RagTool'] = None
+        self._mcp_clients: dict[str, MCPClient] = {}
+        self._mcp_tools: dict[str, list[BaseTool]] = {}
+        # Long-lived DIAL connection pools shared by agents and tools
+        self.client_registry = client_registry
+        # File extractor with parsed documents cache, shared by file extraction and RAG tools
+        self.file_extractor = DialFileContentExtractor(
+            endpoint=DIAL_ENDPOINT,
+            client_registry=client_registry,
+            extraction_pool=extraction_pool,
+            document_cache=ExtractedDocumentCache(
+                max_size_bytes=EXTRACTED_DOCUMENT_CACHE_SIZE_MB * 1024 * 1024,
+                ttl_seconds=EXTRACTED_DOCUMENT_CACHE_TTL_SECONDS,
+            ),
+            csv_cache=ExtractedDocumentCache(
+                max_size_bytes=CSV_CACHE_SIZE_MB * 1024 * 1024,
+                ttl_seconds=EXTRACTED_DOCUMENT_CACHE_TTL_SECONDS,
+                keep_oversized=True,
+            ),
+            lazy_pdf=LAZY_PDF_EXTRACTION,
+            pdf_pages_per_batch=PDF_PAGES_PER_BATCH,
+            pdf_parallel_min_pages=PDF_PARALLEL_MIN_PAGES,
+            pdf_pages_per_task=PDF_PAGES_PER_TASK,
+            max_file_size=MAX_FILE_SIZE_MB * 1024 * 1024,
+            spool_threshold=DOWNLOAD_SPOOL_SIZE_MB * 1024 * 1024,
+        )
+        # Session pool settings of MCP clients
+        self.mcp_config = MCPClientConfig(
+            sessions=MCP_SESSIONS_PER_SERVER,
+            ping_interval_seconds=MCP_PING_INTERVAL_SECONDS,
+            call_retries=MCP_CALL_RETRIES,
+        )
+        # Cached MCP clients and tool lists by server
+        self.tool_registry = MCPToolRegistry(self.mcp_config, ttl_seconds=MCP_TOOLS_TTL_SECONDS)
+        self.tool_registry.add_listener(self._on_mcp_tools_changed)
+        # Stream settings (and frames counters) of this deployment, shared by agents and their tools
+        self.stream_config = stream_config or StreamWriterConfig()
 
     async def _get_mcp_tools(self, url: str) -> list[BaseTool]:
         # 1. Create list of BaseTool
         mcp_tools: list[BaseTool] = []
-        # 2. Create MCPClient
-        mcp_client: MCPClient = await MCPClient.create(url)
+        # 2. Get MCPClient from `tool_registry` (it is created once per server)
+        mcp_client: MCPClient = await self.tool_registry.get_client(url)
+        self._mcp_clients[url] = mcp_client
         # 3. Get tools, iterate through them and add them to created list as MCPTool where the client will be created
-        for mcp_tool_model in await mcp_client.get_tools():
+        for mcp_tool_model in await self.tool_registry.get_tools(url):
             mcp_tools.append(MCPTool(mcp_client, mcp_tool_model))
         #    MCPClient and mcp_tool_model will be the tool itself (see what `mcp_client.get_tools` returns).
         # 4. Return created tool list
+        self._mcp_tools[url] = mcp_tools
         return mcp_tools
 
+    def _on_mcp_tools_changed(self, url: str, mcp_tool_models: list[MCPToolModel]) -> None:
+        """
+        Rebuild tools of changed MCP server and replace tool set. Requests that are in progress keep using the
+        previous set.
+        """
+        if self.tool_set is None:
+            return
+        if url == INTERPRETER_MCP_URL and self._interpreter_tool is not None:
+            self._interpreter_tool.update_tools(mcp_tool_models)
+        if url in self._mcp_tools:
+            self._mcp_tools[url] = [MCPTool(self._mcp_clients[url], model) for model in mcp_tool_models]
+        tools = self._local_tools + [tool for tools in self._mcp_tools.values() for tool in tools]
+        self.tool_set = ToolSet.create(tools)
+        print(f"[GeneralPurposeAgentApplication] Tools are updated: {[tool.name for tool in tools]}")
+
     async def _create_tools(self) -> list[BaseTool]:
         #TODO:
         # 1. Create list of BaseTool
@@ -51,32 +173,76 @@ class GeneralPurposeAgentApplication(ChatCompletion):
         # At the beginning this list can be empty. We will add here tools after they will be implemented
         # ---
         tools: list[BaseTool] = []
-        # 2. Add ImageGenerationTool with DIAL_ENDPOINT
-        tools.append(ImageGenerationTool(DIAL_ENDPOINT))
-        # 3. Add FileContentExtractionTool with DIAL_ENDPOINT
-        tools.append(FileContentExtractionTool(DIAL_ENDPOINT))
-        # 4. Add RagTool with DIAL_ENDPOINT, DEPLOYMENT_NAME, and create DocumentCache (it has static method `create`)
-        tools.append(RagTool(DIAL_ENDPOINT, DEPLOYMENT_NAME, DocumentCache.create()))
+        # 2. Add ImageGenerationTool with DIAL_ENDPOINT and client_registry
+        tools.append(ImageGenerationTool(DIAL_ENDPOINT, self.client_registry))
+        # 3. Add FileContentExtractionTool with file_extractor
+        tools.append(FileContentExtractionTool(self.file_extractor))
+        # 4. Add RagTool with DIAL_ENDPOINT, DEPLOYMENT_NAME, create DocumentCache (it has static method `create`),
+        #    client_registry and file_extractor
+        #    RAG stack (sentence_transformers with torch, faiss) is imported here, not at module level: extraction
+        #    worker processes are spawned and import this module again as `__mp_main__` only to parse files
+        from task.tools.rag.document_cache import DocumentCache
+        from task.tools.rag.index_factory import IndexConfig
+        from task.tools.rag.rag_tool import RagTool
+        self.rag_tool = RagTool(
+            DIAL_ENDPOINT,
+            DEPLOYMENT_NAME,
+            DocumentCache.create(storage_dir=RAG_INDEX_DIR, max_size_bytes=RAG_CACHE_SIZE_MB * 1024 * 1024),
+            self.client_registry,
+            self.file_extractor,
+            embedding_batch_size=EMBEDDING_BATCH_SIZE,
+            embedding_max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+            embedding_cache_size=EMBEDDING_CACHE_SIZE,
+            index_config=IndexConfig(
+                flat_max_chunks=RAG_FLAT_MAX_CHUNKS,
+                hnsw_max_chunks=RAG_HNSW_MAX_CHUNKS,
+                quantization=RAG_QUANTIZATION,
+            ),
+            mode=RAG_MODE,
+            auto_retrieval_max_words=RAG_AUTO_RETRIEVAL_MAX_WORDS,
+            retrieval_candidates=RAG_RETRIEVAL_CANDIDATES,
+            context_token_budget=RAG_CONTEXT_TOKEN_BUDGET,
+        )
+        tools.append(self.rag_tool)
         # 5. Add PythonCodeInterpreterTool with DIAL_ENDPOINT, `http://localhost:8050/mcp` mcp_url, tool_name is
         #    `execute_code`, more detailed about tools see in repository https://github.com/khshanovskyi/mcp-python-code-interpreter
-        tools.append(await PythonCodeInterpreterTool.create(
+        self._interpreter_tool = await PythonCodeInterpreterTool.create(
              dial_endpoint=DIAL_ENDPOINT, 
-             mcp_url='http://localhost:8050/mcp', 
-             tool_name='execute_code'))
+             mcp_url=INTERPRETER_MCP_URL, 
+             tool_name='execute_code',
+             client_registry=self.client_registry,
+             mcp_config=self.mcp_config,
+             warm_sessions=INTERPRETER_WARM_SESSIONS,
+             session_ttl_seconds=INTERPRETER_SESSION_TTL_SECONDS,
+             file_transfer_concurrency=INTERPRETER_FILE_TRANSFER_CONCURRENCY,
+             tool_registry=self.tool_registry)
+        tools.append(self._interpreter_tool)
+        self._local_tools = list(tools)
         # 6. Extend tools with MCP tools from `http://localhost:8051/mcp` (use method `_get_mcp_tools`)
-        tools.extend(await self._get_mcp_tools('http://localhost:8051/mcp'))
+        tools.extend(await self._get_mcp_tools(TOOLS_MCP_URL))
         return tools
 
     async def chat_completion(self, request: Request, response: Response) -> None:
         #TODO:
-        # 1. If `self.tools` are absent then call `_create_tools` method and assign to the `self.tools`
-        if not self.tools:
-            self.tools = await self._create_tools()
+        # 1. If `self.tool_set` is absent then call `_create_tools` method and create ToolSet from them (schemas are
+        #    serialized once, not per request). Otherwise schedule background refresh of expired MCP tool lists, tool
+        #    set is replaced when they change. Request uses the set that is current at its start.
+        if self.tool_set is None:
+            async with self._tools_lock:
+                if self.tool_set is None:
+                    self.tool_set = ToolSet.create(await self._create_tools())
+        else:
+            self.tool_registry.refresh_expired()
+        tool_set = self.tool_set
         # 2. Create `choice` (`with response.create_single_choice() as choice:`) and:
         #   - Create GeneralPurposeAgent with:
         #       - endpoint=DIAL_ENDPOINT
         #       - system_prompt=SYSTEM_PROMPT
-        #       - tools=self.tools
+        #       - tools=tool_set.tools
+        #       - client_registry=self.client_registry
+        #       - tool_schemas=tool_set.schemas
+        #       - max_iterations=MAX_TOOL_ITERATIONS
+        #       - stream_config=self.stream_config
         #   - call `handle_request` on created agent with:
         #       - choice=choice
         #       - deployment_name=DEPLOYMENT_NAME
@@ -86,7 +252,11 @@ class GeneralPurposeAgentApplication(ChatCompletion):
             agent = GeneralPurposeAgent(
                 endpoint=DIAL_ENDPOINT,
                 system_prompt=SYSTEM_PROMPT,
-                tools=self.tools)
+                tools=tool_set.tools,
+                client_registry=self.client_registry,
+                tool_schemas=tool_set.schemas,
+                max_iterations=MAX_TOOL_ITERATIONS,
+                stream_config=self.stream_config)
             await agent.handle_request(
                 choice=choice, 
                 deployment_name=DEPLOYMENT_NAME, 
@@ -96,15 +266,42 @@ class GeneralPurposeAgentApplication(ChatCompletion):
 #TODO:
 # 1. Create DIALApp
 app = DIALApp()
-# 2. Create GeneralPurposeAgentApplication
-agent_app = GeneralPurposeAgentApplication()
+# 2. Create DialClientRegistry, ExtractionPool and GeneralPurposeAgentApplication
+client_registry = DialClientRegistry(
+    max_connections=DIAL_MAX_CONNECTIONS,
+    max_keepalive_connections=DIAL_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=DIAL_KEEPALIVE_EXPIRY,
+)
+extraction_pool = ExtractionPool(
+    thread_workers=EXTRACTION_THREAD_WORKERS,
+    process_workers=EXTRACTION_PROCESS_WORKERS,
+)
+agent_app = GeneralPurposeAgentApplication(
+    client_registry=client_registry,
+    extraction_pool=extraction_pool,
+    stream_config=StreamWriterConfig(
+        max_buffer_size=STREAM_FLUSH_SIZE,
+        flush_interval_ms=STREAM_FLUSH_INTERVAL_MS,
+    )
+)
 # 2.1 Pre-create tools on startup to avoid per-request MCP initialization
 # @app.on_event("startup")
 # async def _startup_init_tools() -> None:
 #     try:
-#         agent_app.tools = await agent_app._create_tools()
+#         agent_app.tool_set = ToolSet.create(await agent_app._create_tools())
 #     except Exception as exc:
-#         print(f"[startup] Tool initialization failed: {exc}")
+#         print(f"[GeneralPurposeAgentApplication] Tool initialization failed: {exc}")
+# 2.2 Stop interpreter kernel sessions, close MCP clients and DIAL connection pools, stop RAG background threads and
+#     extraction workers on shutdown
+@app.on_event("shutdown")
+async def _shutdown_close_clients() -> None:
+    if agent_app._interpreter_tool is not None:
+        agent_app._interpreter_tool.kernel_sessions.stop()
+    await agent_app.tool_registry.close()
+    if agent_app.rag_tool is not None:
+        agent_app.rag_tool.close()
+    await client_registry.close()
+    extraction_pool.shutdown()
 # 3. Add to created DIALApp chat_completion with:
 #       - deployment_name="general-purpose-agent"
 #       - impl=agent_app
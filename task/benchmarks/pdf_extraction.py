@@ -0,0 +1,99 @@
+"""
+Compares serial and parallel (page ranges in worker processes) PDF extraction.
+
+Usage:
+    python -m task.benchmarks.pdf_extraction [path/to/file.pdf] [--pages 200] [--workers 4] [--pages-per-task 16]
+
+If PDF file is not provided, synthetic PDF with `--pages` text pages is generated. Parallel extraction can be faster
+only if there are several CPU cores for worker processes.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from task.utils.extraction_pool import ExtractionPool
+from task.utils.pdf_extraction import count_pdf_pages, extract_pdf_document, remove_temp_pdf, write_temp_pdf
+
+
+def generate_pdf(page_count: int, lines_per_page: int = 60) -> bytes:
+    """Generate PDF with `page_count` pages of plain text."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(page_count))}] /Count {page_count} >>",
+    ]
+    font_id = 3 + 2 * page_count
+    for page in range(page_count):
+        lines = " ".join(
+            f"(Page {page + 1} line {line + 1}: the quick brown fox jumps over the lazy dog) Tj T*"
+            for line in range(lines_per_page)
+        )
+        stream = f"BT /F1 10 Tf 20 800 Td 12 TL {lines} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * page} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{obj}\nendobj\n".encode()
+    xref_offset = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    content += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF".encode()
+    return content
+
+
+async def _measure(path: str, extraction_pool: ExtractionPool, parallel_min_pages: int, pages_per_task: int):
+    start = time.perf_counter()
+    document = await extract_pdf_document(
+        path, extraction_pool, parallel_min_pages=parallel_min_pages, pages_per_task=pages_per_task
+    )
+    return time.perf_counter() - start, document
+
+
+async def main(args: argparse.Namespace) -> None:
+    if args.path:
+        with open(args.path, 'rb') as file:
+            file_content = file.read()
+    else:
+        file_content = generate_pdf(args.pages)
+    path = write_temp_pdf(file_content)
+    extraction_pool = ExtractionPool(thread_workers=1, process_workers=args.workers)
+    try:
+        # Warm up worker processes, so spawn time is not measured
+        page_counts = await asyncio.gather(
+            *(extraction_pool.run('.pdf', count_pdf_pages, path) for _ in range(args.workers))
+        )
+        # Threshold above page count makes extraction serial (one worker task for all pages)
+        serial_time, serial_document = await _measure(
+            path, extraction_pool, parallel_min_pages=page_counts[0] + 1, pages_per_task=args.pages_per_task
+        )
+        parallel_time, parallel_document = await _measure(
+            path, extraction_pool, parallel_min_pages=0, pages_per_task=args.pages_per_task
+        )
+    finally:
+        extraction_pool.shutdown()
+        remove_temp_pdf(path)
+
+    print(f"Pages: {len(serial_document.page_offsets)}, characters: {len(serial_document.text)}")
+    print(f"Serial:   {serial_time:.2f}s")
+    print(f"Parallel: {parallel_time:.2f}s ({args.workers} workers, {args.pages_per_task} pages per task), "
+          f"speedup x{serial_time / parallel_time:.2f}")
+    print(f"Same text: {serial_document == parallel_document}")
+    cpu_count = os.cpu_count() or 1
+    if cpu_count < args.workers:
+        print(f"Warning: only {cpu_count} CPU cores for {args.workers} workers, parallel extraction can't be faster")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="PDF file, synthetic PDF is generated if not provided")
+    parser.add_argument("--pages", type=int, default=200, help="Number of pages of synthetic PDF")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes")
+    parser.add_argument("--pages-per-task", type=int, default=16, help="Number of pages parsed by one worker task")
+    asyncio.run(main(parser.parse_args()))
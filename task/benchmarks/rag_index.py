@@ -0,0 +1,72 @@
+"""
+Compares FAISS index types built by `build_index`: recall against exact search, query latency and bytes per chunk.
+
+Usage:
+    python -m task.benchmarks.rag_index [--chunks 50000] [--dimension 384] [--queries 200] [--k 3]
+
+Synthetic clustered embeddings are used (similar to chunks of a few documents), so no model is needed.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from task.tools.rag.index_factory import IndexConfig, build_index, index_size, normalize
+
+_CONFIGS = {
+    'flat': dict(flat_max_chunks=10 ** 9),
+    'flat-sq8': dict(flat_max_chunks=10 ** 9, quantization='sq8'),
+    'hnsw': dict(flat_max_chunks=0, hnsw_max_chunks=10 ** 9),
+    'hnsw-sq8': dict(flat_max_chunks=0, hnsw_max_chunks=10 ** 9, quantization='sq8'),
+    'ivf': dict(flat_max_chunks=0, hnsw_max_chunks=0),
+    'ivf-sq8': dict(flat_max_chunks=0, hnsw_max_chunks=0, quantization='sq8'),
+    'ivf-pq': dict(flat_max_chunks=0, hnsw_max_chunks=0, quantization='pq'),
+}
+
+
+def generate_embeddings(count: int, dimension: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype('float32')
+    assignments = rng.integers(0, clusters, count)
+    return normalize(centers[assignments] + 0.5 * rng.standard_normal((count, dimension)).astype('float32'))
+
+
+def main(args: argparse.Namespace) -> None:
+    embeddings = generate_embeddings(args.chunks, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = normalize(
+        embeddings[rng.integers(0, args.chunks, args.queries)]
+        + 0.3 * rng.standard_normal((args.queries, args.dimension)).astype('float32')
+    )
+    exact_index = build_index(embeddings, args.dimension, IndexConfig(**_CONFIGS['flat']))
+    _, exact_indices = exact_index.search(queries, args.k)
+
+    print(f"Chunks: {args.chunks}, dimension: {args.dimension}, queries: {args.queries}, k: {args.k}")
+    print(f"{'index':<10} {'build, s':>9} {'recall':>7} {'query, ms':>10} {'bytes/chunk':>12}")
+    for name in args.indexes:
+        if name.startswith('ivf-pq') and args.chunks < 10_000:
+            print(f"{name:<10} skipped, product quantization needs at least 10000 chunks to train")
+            continue
+        start = time.perf_counter()
+        index = build_index(embeddings, args.dimension, IndexConfig(**_CONFIGS[name]))
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found_indices = np.vstack([index.search(query.reshape(1, -1), args.k)[1] for query in queries])
+        query_time_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+        recall = np.mean([
+            len(set(found) & set(exact)) / args.k for found, exact in zip(found_indices, exact_indices)
+        ])
+        bytes_per_chunk = index_size(index) / args.chunks
+        print(f"{name:<10} {build_time:>9.2f} {recall:>7.3f} {query_time_ms:>10.3f} {bytes_per_chunk:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50_000, help="Number of chunks (vectors)")
+    parser.add_argument("--dimension", type=int, default=384, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=3, help="Number of retrieved chunks")
+    parser.add_argument("--indexes", nargs="+", choices=list(_CONFIGS), default=list(_CONFIGS), help="Index types")
+    main(parser.parse_args())
@@ -2,18 +2,20 @@ import json
 from abc import ABC, abstractmethod
 from typing import Any
 
-from aidial_client import AsyncDial
 from aidial_sdk.chat_completion import Message, Role, CustomContent
 from pydantic import StrictStr
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
+from task.utils.dial_clients import DialClientRegistry
+from task.utils.stream_writer import StreamWriter
 
 
 class DeploymentTool(BaseTool, ABC):
 
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, client_registry: DialClientRegistry):
         self.endpoint = endpoint
+        self.client_registry = client_registry
 
     @property
     @abstractmethod
@@ -33,12 +35,11 @@ class DeploymentTool(BaseTool, ABC):
         # 3. Delete `prompt` from `arguments` (there can be provided additional parameters and `prompt` will be added
         #    as user message content and other parameters as `custom_fields`)
         del arguments["prompt"]
-        # 4. Create AsyncDial client (api_version is 2025-01-01-preview)
-        dial_client = AsyncDial(
-            base_url=self.endpoint,
+        # 4. Get AsyncDial client from `client_registry` (api_version is 2025-01-01-preview, it is passed with request)
+        dial_client = self.client_registry.async_client(
+            endpoint=self.endpoint,
             api_key=tool_call_params.api_key,
-            api_version="2025-01-01-preview"
-            )
+        )
         # 5. Call chat completions with:
         #   - messages (here will be just user message. Optionally, in this class you can add system prompt `property`
         #     and if any deployment tool provides system prompt then we need to set it as first message (system prompt))
@@ -51,38 +52,40 @@ class DeploymentTool(BaseTool, ABC):
             messages=[{"role": Role.USER, "content": prompt}],
             stream=True,
             deployment_name=self.deployment_name,
+            api_version="2025-01-01-preview",
             extra_body={"custom_fields": {"configuration": {**arguments}}},
             **self.tool_parameters
         )
-        # 6. Collect content and it to stage, also, collect custom_content -> attachments and if they are present add
-        #    them to stage as attachment as well
-        content = ""
+        # 6. Collect content and add it to stage through StreamWriter (deltas are coalesced into bigger frames), also,
+        #    collect custom_content -> attachments and if they are present add them to stage as attachment as well
         stage = tool_call_params.stage
         custom_content: CustomContent = CustomContent(attachments=[])
-        async for chunk in response_stream:
-            if chunk.choices and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if delta.content:
-                    content += delta.content
-                    stage.append_content(delta.content)
+        with StreamWriter(stage, tool_call_params.stream_config) as stage_writer:
+            async for chunk in response_stream:
+                if chunk.choices and len(chunk.choices) > 0:
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        stage_writer.append_content(delta.content)
 
-                if delta.custom_content and delta.custom_content.attachments:
-                    custom_content.attachments.extend(
-                        delta.custom_content.attachments
-                    )
-                    for attachment in delta.custom_content.attachments:
-                        stage.add_attachment(
-                            type=attachment.type,
-                            title=attachment.title,
-                            data=attachment.data,
-                            url=attachment.url,
-                            reference_url=attachment.reference_url,
-                            reference_type=attachment.reference_type
+                    if delta.custom_content and delta.custom_content.attachments:
+                        # Keep buffered content before attachments
+                        stage_writer.flush()
+                        custom_content.attachments.extend(
+                            delta.custom_content.attachments
                         )
+                        for attachment in delta.custom_content.attachments:
+                            stage.add_attachment(
+                                type=attachment.type,
+                                title=attachment.title,
+                                data=attachment.data,
+                                url=attachment.url,
+                                reference_url=attachment.reference_url,
+                                reference_type=attachment.reference_type
+                            )
         # 7. Return Message with tool role, content, custom_content and tool_call_id
         return Message(
             role=Role.TOOL,
-            content=content,
+            content=stage_writer.content,
             custom_content=custom_content,
             tool_call_id=tool_call_params.tool_call.id
         )
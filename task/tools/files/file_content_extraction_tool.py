@@ -5,6 +5,7 @@ from aidial_sdk.chat_completion import Message
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
+from task.utils.csv_document import CsvDocument
 from task.utils.dial_file_conent_extractor import DialFileContentExtractor
 
 
@@ -15,8 +16,9 @@ class FileContentExtractionTool(BaseTool):
     USAGE: Start with page=1 (by default)
     """
 
-    def __init__(self, endpoint: str):
-        self.endpoint = endpoint
+    def __init__(self, file_extractor: DialFileContentExtractor):
+        # Shared extractor, it caches parsed documents, so each next page doesn't download and parse file again
+        self.file_extractor = file_extractor
 
     @property
     def show_in_stage(self) -> bool:
@@ -48,7 +50,7 @@ class FileContentExtractionTool(BaseTool):
                     },
                 "page": {
                     "type": "integer",
-                    "description": "For large documents pagination is enabled. Each page consists of 10000 characters.",
+                    "description": "For large documents pagination is enabled. Each page consists of 10000 characters. CSV pages consist of whole rows.",
                     "default": 1
                 },
             },
@@ -74,38 +76,43 @@ class FileContentExtractionTool(BaseTool):
             stage.append_content(f"**Page**: {page}\n\r")
         # 8. Append content to stage: "## Response: \n"
         stage.append_content("## Response: \n")
-        # 9. Implement `task.utils.dial_file_conent_extractor`, create DialFileContentExtractor and call `extract_text`
-        #    method as `content`
-        content = DialFileContentExtractor(
-            endpoint=self.endpoint,
-            api_key=tool_call_params.api_key
-        ).extract_text(file_url)
-        # 10. If no `content` present then set it as "Error: File content not found."
-        if not content:
-            content = "Error: File content not found."
-        # 11. If `content` len is more than 10_000 then we need to enable pagination:
+        # 9. Implement `task.utils.dial_file_conent_extractor`, open document with `file_extractor`. Document is read by
+        #    windows, so for PDFs only pages that cover requested window are parsed
+        document = await self.file_extractor.open_document(file_url, tool_call_params.api_key)
+        # 10. Pagination:
         #       - create variable `page_size` as 10_000
-        #       - calculate total pages, formula: (`content len` + `page_size` - 1) // `page_size`
         #       - if `page` is less then 1 (potential hallucination from LLM) then set it as 1
-        #       - otherwise check if page > total pages (potential hallucination), it yes then set `content` as
-        #         `f"Error: Page {page} does not exist. Total pages: {total_pages}"`
         #       - prepare `start_index`: `(page - 1) * page_size`
         #       - prepare `end_index`: `start_index + page_size`
-        #       - get page content from `content` that will start with `start_index` and end with `end_index`
+        #       - read page content from `document` that will start with `start_index` and end with `end_index`
+        #       - calculate total pages, formula: (`content len` + `page_size` - 1) // `page_size` (while document is
+        #         still being parsed content len is estimated)
+        #       - CSV documents are paginated by rows that fit `page_size`, so rows are not cut
+        #       - if no page content then set `content` as "Error: File content not found." for the 1st page,
+        #         otherwise (potential hallucination) as `f"Error: Page {page} does not exist. Total pages: {total_pages}"`
         #       - set `content` as `f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"` (It will show to
         #         LLM that it is not full content and it is pageable)
         page_size = 10_000
-        total_pages = (len(content) + page_size - 1) // page_size
         if page < 1:
             page = 1
-        elif page > total_pages:
-            content = f"Error: Page {page} does not exist. Total pages: {total_pages}"
-        
-        start_index = (page - 1) * page_size
-        end_index = start_index + page_size
-        page_content = content[start_index:end_index]
-        content = f"{page_content}\n\n**Page #{page}. Total pages: {total_pages}**"
-        # 12. Append content to stage: `f"```text\n\r{content}\n\r```\n\r"` (Will be shown in stage as markdown text)
+        if isinstance(document, CsvDocument):
+            page_content = document.read_page(page, page_size)
+            total_pages, is_exact = document.total_pages(page_size), True
+        else:
+            start_index = (page - 1) * page_size
+            end_index = start_index + page_size
+            page_content = await document.read(start_index, end_index)
+            content_length, is_exact = document.length_hint()
+            total_pages = max((content_length + page_size - 1) // page_size, page if page_content else 1)
+        total_pages_label = f"{total_pages}" if is_exact else f"~{total_pages} (estimated)"
+        if not page_content:
+            if page == 1:
+                content = "Error: File content not found."
+            else:
+                content = f"Error: Page {page} does not exist. Total pages: {total_pages_label}"
+        else:
+            content = f"{page_content}\n\n**Page #{page}. Total pages: {total_pages_label}**"
+        # 11. Append content to stage: `f"```text\n\r{content}\n\r```\n\r"` (Will be shown in stage as markdown text)
         stage.append_content(f"```text\n\r{content}\n\r```\n\r")
-        # 13. Return `content`
+        # 12. Return `content`
         return content
@@ -1,10 +1,14 @@
 import asyncio
-import json
+from dataclasses import dataclass
 from datetime import timedelta
-from typing import Optional, Any
+from typing import Awaitable, Callable, Optional, Any, TypeVar
 
+import anyio
+import httpx
+from aidial_sdk.chat_completion import Attachment
 from mcp import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.session import ProgressFnT
 from mcp.types import (
     CallToolResult,
     TextContent,
@@ -15,66 +19,205 @@ from mcp.types import (
     ResourceLink,
     ImageContent,
     AudioContent,
+    ServerNotification,
+    ToolListChangedNotification,
 )
 from pydantic import AnyUrl
 
 from task.tools.mcp.mcp_tool_model import MCPToolModel
 
+T = TypeVar('T')
+
+# Errors of broken session, other errors (e.g. MCP error responses or invalid arguments) leave session in the pool
+_TRANSPORT_ERRORS = (ConnectionError, anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.TransportError)
+
+
+@dataclass
+class MCPToolResult:
+    """
+    All content items of tool call: text items are joined into `text`, images, audio and resources are converted to
+    DIAL attachments.
+    """
+    text: str
+    attachments: list[Attachment]
+    is_error: bool = False
+
+
+def format_progress(progress: float, total: Optional[float], message: Optional[str]) -> str:
+    """Stage line of MCP progress notification."""
+    if total:
+        status = f"{progress / total:.0%}"
+    else:
+        status = f"{progress:g}"
+    return f"> {message} ({status})\n\r" if message else f"> Progress: {status}\n\r"
+
+
+@dataclass
+class MCPClientConfig:
+    """
+    Settings of MCPClient session pool: number of sessions per server, interval of health-check pings and number of
+    retries of idempotent calls on another session.
+    """
+    sessions: int = 2
+    ping_interval_seconds: float = 30
+    ping_timeout_seconds: float = 10
+    call_retries: int = 2
+
+
+@dataclass
+class MCPClientStats:
+    """Call, retry and reconnect counters of MCPClient."""
+    calls: int = 0
+    retries: int = 0
+    failed_calls: int = 0
+    failed_pings: int = 0
+    reconnects: int = 0
+
+
+class _MCPSession:
+    """
+    One streamable HTTP session. Transport and session contexts are entered and exited by the session's own task, so
+    session can be closed (or replaced) from any task.
+    """
+
+    def __init__(self, server_url: str, message_handler: Optional[Callable[[Any], Awaitable[None]]] = None):
+        self.server_url = server_url
+        self.message_handler = message_handler
+        self.session: Optional[ClientSession] = None
+        self.in_flight = 0
+        self.failed = False
+        self._task: Optional[asyncio.Task] = None
+        self._closing = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._task is None or self._task.done()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.failed and not self.done
+
+    async def start(self) -> None:
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(ready))
+        await ready
+
+    async def run(self, func: Callable[[ClientSession], Awaitable[T]]) -> T:
+        """Run call on the session, it fails as soon as the session is closed or broken."""
+        call = asyncio.ensure_future(func(self.session))
+        try:
+            await asyncio.wait({call, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            call.cancel()
+            raise
+        if not call.done():
+            call.cancel()
+            raise ConnectionError(f"MCP session to {self.server_url} is closed")
+        return call.result()
+
+    async def ping(self, timeout: float) -> None:
+        await asyncio.wait_for(self.session.send_ping(), timeout)
+
+    async def close(self) -> None:
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=10)
+            except Exception as e:
+                print(f"[MCPClient] Unable to close session to {self.server_url}: {e}")
+        self.session = None
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        try:
+            # 1. Call `streamablehttp_client` method with `server_url` and enter it as `read_stream, write_stream, _`
+            async with streamablehttp_client(self.server_url, timeout=60, sse_read_timeout=300) as (
+                    read_stream, write_stream, _
+            ):
+                # 2. Create ClientSession with streams from above and enter it
+                async with ClientSession(read_stream, write_stream, message_handler=self.message_handler) as session:
+                    # 3. Initialize session and log connected server
+                    init_result = await session.initialize()
+                    print(f"[MCPClient] Connected to {init_result.serverInfo.name} at {self.server_url}")
+                    self.session = session
+                    ready.set_result(None)
+                    await self._closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not self._closing.is_set():
+                print(f"[MCPClient] Session to {self.server_url} failed: {e}")
+        finally:
+            self.failed = True
+
 
 class MCPClient:
-    """Handles MCP server connection and tool execution"""
+    """
+    Handles MCP server connection and tool execution. Keeps a pool of sessions to the server (see MCPClientConfig):
+    calls go to the least loaded live session, sessions are pinged periodically and dead ones are replaced. Idempotent
+    calls (listing, resources and tools annotated as read-only or idempotent) are retried on another session if the
+    session fails. Listeners added with `add_tools_changed_listener` are notified when server sends
+    `notifications/tools/list_changed` or session is reconnected.
+    """
 
-    def __init__(self, mcp_server_url: str) -> None:
+    def __init__(self, mcp_server_url: str, config: Optional[MCPClientConfig] = None) -> None:
         self.server_url = mcp_server_url
-        self.session: Optional[ClientSession] = None
-        self._streams_context = None
-        self._session_context = None
-        self._owner_task: Optional[asyncio.Task] = None
+        self.config = config or MCPClientConfig()
+        self._sessions: list[_MCPSession] = []
+        self._idempotent_tools: set[str] = set()
+        self._lock = asyncio.Lock()
+        self._health_task: Optional[asyncio.Task] = None
+        self._replacements: set[asyncio.Task] = set()
+        self._tools_changed_listeners: list[Callable[[], None]] = []
+        self.stats = MCPClientStats()
 
     @classmethod
-    async def create(cls, mcp_server_url: str) -> 'MCPClient':
+    async def create(cls, mcp_server_url: str, config: Optional[MCPClientConfig] = None) -> 'MCPClient':
         """Async factory method to create and connect MCPClient"""
         #TODO:
         # 1. Create instance of MCPClient with `cls`
         # 2. Connect to MCP server
         # 3. return created instance
-        instance = cls(mcp_server_url)
+        instance = cls(mcp_server_url, config)
         await instance.connect()
         return instance
 
+    @property
+    def session(self) -> Optional[ClientSession]:
+        """Least loaded live session."""
+        session = self._least_loaded()
+        return session.session if session is not None else None
+
     async def connect(self):
         """Connect to MCP server"""
         #TODO:
-        # 1. Check if session is present, if yes just return to finsh execution
-        if self.session:
-            return
-        # 2. Call `streamablehttp_client` method with `server_url` and set as `self._streams_context`
-        self._streams_context = streamablehttp_client(
-            self.server_url,
-            timeout=60,
-            sse_read_timeout=300,
-        )
-        # 3. Enter `self._streams_context`, result set as `read_stream, write_stream, _`
-        read_stream, write_stream, _ = await self._streams_context.__aenter__()
-        # 4. Create ClientSession with streams from above and set as `self._session_context`
-        self._session_context = ClientSession(read_stream, write_stream)
-        # 5. Enter `self._session_context` and set as self.session
-        self.session = await self._session_context.__aenter__()
-        self._owner_task = asyncio.current_task()
-        # 6. Initialize session and print its result to console
-        init_result = await self.session.initialize()
-        print(init_result)
+        # 1. Check if sessions are present, if yes just return to finsh execution
+        # 2. Start pool sessions, at least one of them must be connected, missing ones are started by health check
+        # 3. Start health check
+        async with self._lock:
+            if self._sessions:
+                return
+            results = await asyncio.gather(
+                *(self._start_session() for _ in range(self.config.sessions)), return_exceptions=True
+            )
+            self._sessions = [session for session in results if isinstance(session, _MCPSession)]
+            if not self._sessions:
+                raise ConnectionError(f"Unable to connect to MCP server {self.server_url}: {results[0]}")
+            if self._health_task is None or self._health_task.done():
+                self._health_task = asyncio.create_task(self._check_health())
 
+    def add_tools_changed_listener(self, listener: Callable[[], None]) -> None:
+        """Call `listener` each time server notifies that its list of tools is changed (or could be, after reconnect)."""
+        self._tools_changed_listeners.append(listener)
 
     async def get_tools(self) -> list[MCPToolModel]:
         """Get available tools from MCP server"""
         #TODO: Get and return MCP tools as list of MCPToolModel
-        if not self.session:
-            await self.connect()
-
-        result = await self.session.list_tools()
+        result = await self._call(lambda session: session.list_tools(), idempotent=True)
         tools: list[MCPToolModel] = []
+        idempotent_tools: set[str] = set()
         for tool in result.tools:
+            if tool.annotations and (tool.annotations.readOnlyHint or tool.annotations.idempotentHint):
+                idempotent_tools.add(tool.name)
             tools.append(
                 MCPToolModel(
                     name=tool.name,
@@ -82,64 +225,111 @@ class MCPClient:
                     parameters=tool.inputSchema,
                 )
             )
+        self._idempotent_tools = idempotent_tools
         return tools
 
-    async def call_tool(self, tool_name: str, tool_args: dict[str, Any]) -> Any:
-        """Call a tool on the MCP server"""
+    async def call_tool(
+            self,
+            tool_name: str,
+            tool_args: dict[str, Any],
+            progress_callback: Optional[ProgressFnT] = None,
+    ) -> Optional[str]:
+        """Call a tool on the MCP server, returns text of all text content items (None if there is no text)"""
+        result = await self.call_tool_content(tool_name, tool_args, progress_callback)
+        return result.text or None
+
+    async def call_tool_content(
+            self,
+            tool_name: str,
+            tool_args: dict[str, Any],
+            progress_callback: Optional[ProgressFnT] = None,
+    ) -> MCPToolResult:
+        """
+        Call a tool on the MCP server and aggregate all content items.
+
+        Args:
+            tool_name: Tool name
+            tool_args: Tool arguments
+            progress_callback: Called with (progress, total, message) of each progress notification while tool runs,
+                tools stream partial output with messages of notifications
+
+        Returns:
+            Text and attachments of tool result
+        """
         #TODO: Make tool call and return its result. Do it in proper way (it returns array of content and you need to handle it properly)
-        if not self.session:
-            raise RuntimeError("MCP client not connected.")
-            #await self.connect()
-
-        result: CallToolResult = await self.session.call_tool(
-            tool_name,
-            tool_args,
-            read_timeout_seconds=timedelta(seconds=300),
+        result: CallToolResult = await self._call(
+            lambda session: session.call_tool(
+                tool_name,
+                tool_args,
+                read_timeout_seconds=timedelta(seconds=300),
+                progress_callback=progress_callback,
+            ),
+            idempotent=tool_name in self._idempotent_tools,
         )
 
-        if not result.content:
-            return None
-        
-        content = result.content[0]
-        if isinstance(content, TextContent):
-            return content.text
-
-        return content
+        texts: list[str] = []
+        attachments: list[Attachment] = []
+        for content in result.content or []:
+            if isinstance(content, TextContent):
+                texts.append(content.text)
+            elif isinstance(content, (ImageContent, AudioContent)):
+                attachments.append(
+                    Attachment(type=content.mimeType, title=f"{tool_name} {content.type} {len(attachments) + 1}", data=content.data)
+                )
+            elif isinstance(content, EmbeddedResource):
+                resource = content.resource
+                data = resource.text if isinstance(resource, TextResourceContents) else resource.blob
+                attachments.append(
+                    Attachment(type=resource.mimeType, title=_resource_title(resource.uri), data=data)
+                )
+            elif isinstance(content, ResourceLink):
+                # Only http(s) and DIAL file links can be opened by clients, other resources (file://, custom schemes)
+                # are read from server, or listed in text if server can't read them
+                title = content.title or content.name
+                if _is_client_url(content.uri):
+                    attachments.append(Attachment(type=content.mimeType, title=title, url=str(content.uri)))
+                    continue
+                try:
+                    resource = await self._read_resource(content.uri)
+                except Exception as e:
+                    print(f"[MCPClient] Unable to read resource {content.uri}: {e}")
+                    resource = None
+                if resource is None:
+                    texts.append(f"Resource: {title} ({content.uri})")
+                    continue
+                data = resource.text if isinstance(resource, TextResourceContents) else resource.blob
+                attachments.append(Attachment(type=resource.mimeType or content.mimeType, title=title, data=data))
+        return MCPToolResult(text="\n".join(texts), attachments=attachments, is_error=bool(result.isError))
 
     async def get_resource(self, uri: AnyUrl) -> str | bytes:
         """Get specific resource content"""
         #Get and return resource. Resources can be returned as TextResourceContents and BlobResourceContents, you
         #      need to return resource value (text or blob)
-        if not self.session:
-            await self.connect()
-
-        result: ReadResourceResult = await self.session.read_resource(uri)
-        if not result.contents:
+        content = await self._read_resource(uri)
+        if content is None:
             return "No content found"
-        
-        content = result.contents[0]
         if isinstance(content, TextResourceContents):
             return content.text
         elif isinstance(content, BlobResourceContents):
             return content.blob
         return "Unsupported resource type"
 
+    async def _read_resource(self, uri: AnyUrl) -> Optional[TextResourceContents | BlobResourceContents]:
+        """First contents item of resource, None if resource is empty"""
+        result: ReadResourceResult = await self._call(lambda session: session.read_resource(uri), idempotent=True)
+        return result.contents[0] if result.contents else None
+
     async def close(self):
         """Close connection to MCP server"""
         #TODO:
-        # 1. Close `self._session_context`
-        # 2. Close `self._streams_context`
-        # 3. Set session, _session_context and _streams_context as None
-        if self._owner_task and asyncio.current_task() is not self._owner_task:
-            return
-        if self._session_context is not None:
-            await self._session_context.__aexit__(None, None, None)
-        if self._streams_context is not None:
-            await self._streams_context.__aexit__(None, None, None)
-        self.session = None
-        self._session_context = None
-        self._streams_context = None
-        self._owner_task = None
+        # 1. Stop health check
+        # 2. Close all sessions
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        sessions, self._sessions = self._sessions, []
+        await asyncio.gather(*(session.close() for session in sessions))
+        print(f"[MCPClient] Closed sessions to {self.server_url}. Stats: {self.stats}")
 
     async def __aenter__(self):
         """Async context manager entry"""
@@ -150,3 +340,103 @@ class MCPClient:
         """Async context manager exit"""
         await self.close()
         return False
+
+    async def _call(self, func: Callable[[ClientSession], Awaitable[T]], idempotent: bool) -> T:
+        """
+        Run call on the least loaded live session. If session fails with transport error then it is replaced,
+        idempotent calls are retried on another session up to `call_retries` times. Other errors are raised as is.
+        """
+        self.stats.calls += 1
+        attempt = 0
+        while True:
+            session = await self._acquire()
+            session.in_flight += 1
+            try:
+                return await session.run(func)
+            except _TRANSPORT_ERRORS as e:
+                session.failed = True
+                replacement = asyncio.create_task(self._replace(session))
+                self._replacements.add(replacement)
+                replacement.add_done_callback(self._replacements.discard)
+                if not idempotent or attempt >= self.config.call_retries:
+                    self.stats.failed_calls += 1
+                    raise
+                attempt += 1
+                self.stats.retries += 1
+                print(f"[MCPClient] Call to {self.server_url} failed, retrying on another session: {e}")
+            finally:
+                session.in_flight -= 1
+
+    async def _acquire(self) -> _MCPSession:
+        session = self._least_loaded()
+        if session is not None:
+            return session
+        async with self._lock:
+            # Sessions could be replaced while waiting for lock
+            session = self._least_loaded()
+            if session is None:
+                session = await self._start_session()
+                self._sessions.append(session)
+            return session
+
+    async def _handle_message(self, message: Any) -> None:
+        if isinstance(message, ServerNotification) and isinstance(message.root, ToolListChangedNotification):
+            print(f"[MCPClient] Tools of {self.server_url} are changed")
+            for listener in list(self._tools_changed_listeners):
+                listener()
+
+    def _least_loaded(self) -> Optional[_MCPSession]:
+        alive_sessions = [session for session in self._sessions if session.alive]
+        return min(alive_sessions, key=lambda session: session.in_flight, default=None)
+
+    async def _start_session(self) -> _MCPSession:
+        session = _MCPSession(self.server_url, self._handle_message)
+        await session.start()
+        return session
+
+    async def _replace(self, session: _MCPSession) -> None:
+        async with self._lock:
+            if session not in self._sessions:
+                return
+            self._sessions.remove(session)
+            try:
+                self._sessions.append(await self._start_session())
+                self.stats.reconnects += 1
+                # Server could be restarted with another set of tools
+                for listener in list(self._tools_changed_listeners):
+                    listener()
+            except Exception as e:
+                print(f"[MCPClient] Unable to reconnect to {self.server_url}, will retry on health check: {e}")
+        # Calls that are still waiting on the dead session fail with it
+        await session.close()
+
+    async def _check_health(self) -> None:
+        """Ping sessions periodically, replace dead ones and start missing ones."""
+        while True:
+            await asyncio.sleep(self.config.ping_interval_seconds)
+            for session in list(self._sessions):
+                if session.alive:
+                    try:
+                        await session.ping(self.config.ping_timeout_seconds)
+                        continue
+                    except Exception as e:
+                        self.stats.failed_pings += 1
+                        print(f"[MCPClient] Ping to {self.server_url} failed: {e}")
+                await self._replace(session)
+            async with self._lock:
+                while len(self._sessions) < self.config.sessions:
+                    try:
+                        self._sessions.append(await self._start_session())
+                    except Exception as e:
+                        print(f"[MCPClient] Unable to connect to {self.server_url}: {e}")
+                        break
+
+
+def _is_client_url(uri: AnyUrl) -> bool:
+    """Whether DIAL clients can open the URL: http(s) URL or DIAL file URL"""
+    return uri.scheme in ("http", "https") or str(uri).startswith("files/")
+
+
+def _resource_title(uri: AnyUrl) -> str:
+    path = (uri.path or "").rstrip("/")
+    return path.rsplit("/", 1)[-1] or str(uri)
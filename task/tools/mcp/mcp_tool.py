@@ -1,12 +1,13 @@
 import json
-from typing import Any
+from typing import Any, Optional
 
 from aidial_sdk.chat_completion import Message
 
 from task.tools.base import BaseTool
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.mcp.mcp_client import MCPClient, format_progress
 from task.tools.mcp.mcp_tool_model import MCPToolModel
 from task.tools.models import ToolCallParams
+from task.utils.stream_writer import StreamWriter
 
 
 class MCPTool(BaseTool):
@@ -20,11 +21,23 @@ class MCPTool(BaseTool):
     async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
         # 1. Load arguments with `json`
         ags = json.loads(tool_call_params.tool_call.function.arguments)
-        # 2. Get content with mcp client tool call
-        content = await self.client.call_tool(self.name, ags)
-        # 3. Append retrieved content to stage
-        tool_call_params.stage.append_content(content)
-        # 4. return content
+        # 2. Get content with mcp client tool call, progress notifications (and partial output in their messages) are
+        #    streamed to stage while tool runs
+        stage = tool_call_params.stage
+        with StreamWriter(stage, tool_call_params.stream_config) as stage_writer:
+            async def on_progress(progress: float, total: Optional[float], message: Optional[str]) -> None:
+                stage_writer.append_content(format_progress(progress, total, message))
+
+            result = await self.client.call_tool_content(self.name, ags, progress_callback=on_progress)
+            # 3. Append retrieved content to stage, tool errors (`isError` results) are marked as errors for LLM
+            content = f"Error: {result.text}" if result.is_error else result.text
+            stage_writer.append_content(content)
+        # 4. Add images and resources as attachments to stage and choice, mention them in content for LLM
+        for attachment in result.attachments:
+            stage.add_attachment(attachment)
+            tool_call_params.choice.add_attachment(attachment)
+            content += f"\n[Attached {attachment.type or 'file'}: {attachment.title}]"
+        # 5. return content
         return content
 
     @property
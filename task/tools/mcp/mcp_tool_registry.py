@@ -0,0 +1,144 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from task.tools.mcp.mcp_client import MCPClient, MCPClientConfig
+from task.tools.mcp.mcp_tool_model import MCPToolModel
+
+
+@dataclass
+class MCPToolRegistryStats:
+    """Counters of MCPToolRegistry."""
+    refreshes: int = 0
+    failed_refreshes: int = 0
+    changes: int = 0
+    notifications: int = 0
+
+
+@dataclass
+class _ServerTools:
+    client: MCPClient
+    tools: list[MCPToolModel]
+    fetched_at: float
+    stale: bool = False
+
+
+class MCPToolRegistry:
+    """
+    Caches MCP clients and their tool lists by server URL. Tool lists are refreshed in background when they are older
+    than `ttl_seconds` or server notifies that they are changed (`notifications/tools/list_changed`), meanwhile
+    cached list is served. Listeners added with `add_listener` are called with server URL and its new tools each time
+    the list is really changed.
+    """
+
+    def __init__(self, mcp_config: Optional[MCPClientConfig] = None, ttl_seconds: float = 300):
+        self.mcp_config = mcp_config
+        self.ttl_seconds = ttl_seconds
+        self._servers: dict[str, _ServerTools] = {}
+        # Single-flight connects and refreshes by server URL
+        self._loading: dict[str, asyncio.Future] = {}
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self._listeners: list[Callable[[str, list[MCPToolModel]], None]] = []
+        self.stats = MCPToolRegistryStats()
+
+    def add_listener(self, listener: Callable[[str, list[MCPToolModel]], None]) -> None:
+        self._listeners.append(listener)
+
+    async def get_client(self, url: str) -> MCPClient:
+        return (await self._get_server(url)).client
+
+    async def get_tools(self, url: str) -> list[MCPToolModel]:
+        """
+        Get tools of server, first call connects to server and waits for the list. Expired or changed list is
+        refreshed in background, cached one is returned.
+        """
+        server = await self._get_server(url)
+        if server.stale or time.monotonic() - server.fetched_at >= self.ttl_seconds:
+            self.refresh(url)
+        return server.tools
+
+    def refresh_expired(self) -> None:
+        """Schedule refresh of all expired or changed tool lists."""
+        now = time.monotonic()
+        for url, server in list(self._servers.items()):
+            if server.stale or now - server.fetched_at >= self.ttl_seconds:
+                self.refresh(url)
+
+    def refresh(self, url: str) -> None:
+        """Schedule refresh of server tools, listeners are called if they are changed."""
+        task = self._refreshing.get(url)
+        if url in self._servers and (task is None or task.done()):
+            self._refreshing[url] = asyncio.create_task(self._refresh(url))
+
+    async def close(self) -> None:
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing.clear()
+        servers, self._servers = list(self._servers.values()), {}
+        await asyncio.gather(*(server.client.close() for server in servers), return_exceptions=True)
+
+    async def _get_server(self, url: str) -> _ServerTools:
+        server = self._servers.get(url)
+        if server is not None:
+            return server
+        loading = self._loading.get(url)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[url] = loading
+        try:
+            client = await MCPClient.create(url, self.mcp_config)
+            try:
+                server = _ServerTools(client, await client.get_tools(), time.monotonic())
+            except BaseException:
+                await client.close()
+                raise
+            client.add_tools_changed_listener(lambda: self._on_tools_changed(url))
+            self._servers[url] = server
+            self.stats.refreshes += 1
+            loading.set_result(server)
+            return server
+        except BaseException as e:
+            loading.set_exception(e)
+            # Exception is raised to this caller, mark it as retrieved in case there are no other waiters
+            loading.exception()
+            raise
+        finally:
+            self._loading.pop(url, None)
+
+    def _on_tools_changed(self, url: str) -> None:
+        server = self._servers.get(url)
+        if server is None:
+            return
+        self.stats.notifications += 1
+        server.stale = True
+        self.refresh(url)
+
+    async def _refresh(self, url: str) -> None:
+        server = self._servers.get(url)
+        if server is None:
+            return
+        server.stale = True
+        # Notification received during refresh marks list as stale again, then it is refreshed once more
+        while server.stale:
+            server.stale = False
+            try:
+                tools = await server.client.get_tools()
+            except Exception as e:
+                self.stats.failed_refreshes += 1
+                server.stale = True
+                print(f"[MCPToolRegistry] Unable to refresh tools of {url}, cached ones are used: {e}")
+                return
+            self.stats.refreshes += 1
+            server.fetched_at = time.monotonic()
+            if tools != server.tools:
+                server.tools = tools
+                self.stats.changes += 1
+                print(f"[MCPToolRegistry] Tools of {url} are changed: {[tool.name for tool in tools]}")
+                for listener in list(self._listeners):
+                    try:
+                        listener(url, tools)
+                    except Exception as e:
+                        print(f"[MCPToolRegistry] Tools listener failed: {e}")
@@ -1,7 +1,10 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 from aidial_sdk.chat_completion import Stage, Choice
 from aidial_client.types.chat.legacy.chat_completion import ToolCall
 
+from task.utils.stream_writer import StreamWriterConfig
+
 
 @dataclass
 class ToolCallParams:
@@ -9,4 +12,5 @@ class ToolCallParams:
     stage: Stage
     choice: Choice
     api_key: str
-    conversation_id: str
+    conversation_id: Optional[str]
+    stream_config: StreamWriterConfig = field(default_factory=StreamWriterConfig)
@@ -0,0 +1,127 @@
+import asyncio
+import base64
+import tempfile
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+from typing import Callable, NamedTuple, Optional
+
+from aidial_client import AsyncDial
+from aidial_sdk.chat_completion import Attachment
+from pydantic import AnyUrl
+
+from task.tools.mcp.mcp_client import MCPClient
+from task.tools.py_interpreter._response import _FileReference
+
+_TEXT_MIME_TYPES = ('application/json', 'application/xml')
+# Number of base64 characters decoded at once, must be multiple of 4
+_DECODE_CHUNK_SIZE = 1024 * 1024
+# Decoded files over this size are spooled to temporary file while uploading
+_SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+
+@dataclass
+class FileTransferStats:
+    """Counters of OutputFileTransfer."""
+    transfers: int = 0
+    uploaded_files: int = 0
+    failed_files: int = 0
+    uploaded_bytes: int = 0
+
+
+class TransferredFile(NamedTuple):
+    name: str
+    attachment: Optional[Attachment]
+    error: Optional[str] = None
+
+
+class OutputFileTransfer:
+    """
+    Moves files produced by code execution from PyInterpreter MCP Server to DIAL bucket. Files are fetched and uploaded
+    concurrently (at most `max_concurrency` of them at once) with AsyncDial, base64 content is decoded by chunks in a
+    thread, and each file is reported with `on_uploaded` as soon as it is uploaded.
+    """
+
+    def __init__(self, mcp_client: MCPClient, max_concurrency: int = 4):
+        self.mcp_client = mcp_client
+        self.max_concurrency = max_concurrency
+        self.stats = FileTransferStats()
+
+    async def transfer(
+            self,
+            files: list[_FileReference],
+            dial_client: AsyncDial,
+            on_uploaded: Callable[[Attachment], None],
+    ) -> list[TransferredFile]:
+        """
+        Args:
+            files: Files from execution result
+            dial_client: AsyncDial client of user
+            on_uploaded: Called with attachment of each uploaded file, in order of upload
+
+        Returns:
+            Transferred files in the order of `files`, failed ones have `error` instead of attachment
+        """
+        self.stats.transfers += 1
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Appdata home is resolved while first files are fetched
+        files_home = asyncio.ensure_future(dial_client.my_appdata_home())
+
+        async def transfer_file(file_ref: _FileReference) -> TransferredFile:
+            async with semaphore:
+                try:
+                    attachment = await self._transfer_file(file_ref, dial_client, files_home)
+                except Exception as e:
+                    self.stats.failed_files += 1
+                    print(f"[OutputFileTransfer] Unable to transfer {file_ref.name}: {e}")
+                    return TransferredFile(file_ref.name, None, str(e))
+            on_uploaded(attachment)
+            return TransferredFile(file_ref.name, attachment)
+
+        try:
+            return await asyncio.gather(*(transfer_file(file_ref) for file_ref in files))
+        finally:
+            if not files_home.done():
+                files_home.cancel()
+
+    async def _transfer_file(
+            self,
+            file_ref: _FileReference,
+            dial_client: AsyncDial,
+            files_home: asyncio.Future,
+    ) -> Attachment:
+        resource = await self.mcp_client.get_resource(AnyUrl(file_ref.uri))
+        # According to MCP binary resources are encoded with base64, text ones are uploaded as utf-8 bytes
+        # https://modelcontextprotocol.io/specification/2025-06-18/server/resources#binary-content
+        if isinstance(resource, bytes):
+            content = _spool([resource])
+        elif file_ref.mime_type.startswith('text/') or file_ref.mime_type in _TEXT_MIME_TYPES:
+            content = await asyncio.to_thread(_spool, [resource.encode('utf-8')])
+        else:
+            content = await asyncio.to_thread(_spool, _decode_base64(resource))
+        try:
+            home: PurePosixPath = await files_home
+            upload_url = f"files/{(home / file_ref.name).as_posix()}"
+            size = content.seek(0, 2)
+            content.seek(0)
+            await dial_client.files.upload(url=upload_url, file=(file_ref.name, content, file_ref.mime_type))
+        finally:
+            content.close()
+        self.stats.uploaded_files += 1
+        self.stats.uploaded_bytes += size
+        return Attachment(url=upload_url, type=file_ref.mime_type, title=file_ref.name)
+
+
+def _decode_base64(data: str):
+    """Decode base64 by chunks, so decoded copy of the whole content is not kept next to the encoded one."""
+    if '\n' in data or '\r' in data or ' ' in data:
+        # Chunk boundaries must be aligned to 4 characters of base64 alphabet
+        data = ''.join(data.split())
+    for start in range(0, len(data), _DECODE_CHUNK_SIZE):
+        yield base64.b64decode(data[start:start + _DECODE_CHUNK_SIZE])
+
+
+def _spool(chunks) -> tempfile.SpooledTemporaryFile:
+    content = tempfile.SpooledTemporaryFile(max_size=_SPOOL_THRESHOLD)
+    for chunk in chunks:
+        content.write(chunk)
+    return content
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import time
+import weakref
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+from task.tools.mcp.mcp_client import MCPClient
+
+
+@dataclass
+class KernelSessionStats:
+    """Affinity and warm pool counters of KernelSessionManager."""
+    affinity_hits: int = 0
+    pool_hits: int = 0
+    pool_misses: int = 0
+    warmed: int = 0
+    warm_failures: int = 0
+    reaped: int = 0
+
+    @property
+    def pool_hit_rate(self) -> float:
+        claims = self.pool_hits + self.pool_misses
+        return self.pool_hits / claims if claims else 0.0
+
+
+class KernelSessionManager:
+    """
+    Maps conversations to interpreter sessions (kernels on the MCP server), so code of one conversation runs in the
+    same kernel even if model doesn't pass `session_id`. Conversations are identified by keys that must be unique per
+    user (e.g. user bucket and conversation id). New conversations claim one of `warm_sessions` pre-started kernels
+    instead of waiting for a cold start, the pool is refilled in background. Sessions idle for longer than
+    `session_ttl_seconds` are forgotten. Callers hold `lock` of conversation from `acquire` until session is bound,
+    so parallel calls of one conversation don't start two kernels.
+    """
+
+    # Code that starts a kernel without side effects
+    _WARM_UP_CODE = "pass"
+
+    def __init__(
+            self,
+            mcp_client: MCPClient,
+            tool_name: str,
+            warm_sessions: int = 2,
+            session_ttl_seconds: float = 1800,
+    ):
+        self.mcp_client = mcp_client
+        self.tool_name = tool_name
+        self.warm_sessions = warm_sessions
+        self.session_ttl_seconds = session_ttl_seconds
+        # conversation_id -> (session_id, last used time), least recently used first
+        self._sessions: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._warm_pool: deque[tuple[str, float]] = deque()
+        self._warming = 0
+        # Locks exist while they are used
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._background_tasks: set[asyncio.Task] = set()
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.stats = KernelSessionStats()
+
+    def lock(self, conversation_id: str) -> asyncio.Lock:
+        """Lock of conversation, calls of conversation hold it from `acquire` until their session is bound."""
+        lock = self._locks.get(conversation_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[conversation_id] = lock
+        return lock
+
+    def acquire(self, conversation_id: str) -> Optional[str]:
+        """
+        Get interpreter session of conversation, or claim pre-started one for new conversation.
+
+        Returns:
+            Session id, None if new session will be started by the call
+        """
+        self._start_background()
+        now = time.monotonic()
+        session = self._sessions.get(conversation_id)
+        if session is not None and now - session[1] < self.session_ttl_seconds:
+            self.stats.affinity_hits += 1
+            self.bind(conversation_id, session[0])
+            return session[0]
+
+        session_id = None
+        while self._warm_pool:
+            warm_session_id, warmed_at = self._warm_pool.popleft()
+            if now - warmed_at < self.session_ttl_seconds:
+                session_id = warm_session_id
+                break
+        if session_id is not None:
+            self.stats.pool_hits += 1
+            self.bind(conversation_id, session_id)
+        else:
+            self.stats.pool_misses += 1
+        self._refill()
+        return session_id
+
+    def bind(self, conversation_id: str, session_id: str) -> None:
+        """Set (or refresh) interpreter session of conversation."""
+        self._sessions[conversation_id] = (session_id, time.monotonic())
+        self._sessions.move_to_end(conversation_id)
+
+    def reap_idle_sessions(self) -> int:
+        """
+        Forget sessions and pre-started kernels idle for longer than TTL.
+
+        Returns:
+            Number of sessions removed
+        """
+        cutoff_time = time.monotonic() - self.session_ttl_seconds
+        removed_count = 0
+        while self._sessions:
+            conversation_id, (_, last_used) = next(iter(self._sessions.items()))
+            if last_used >= cutoff_time:
+                break
+            del self._sessions[conversation_id]
+            removed_count += 1
+        while self._warm_pool and self._warm_pool[0][1] < cutoff_time:
+            self._warm_pool.popleft()
+            removed_count += 1
+        self.stats.reaped += removed_count
+        if removed_count:
+            self._refill()
+        return removed_count
+
+    def stop(self) -> None:
+        if self._reaper_task is not None:
+            self._reaper_task.cancel()
+            self._reaper_task = None
+        for task in list(self._background_tasks):
+            task.cancel()
+        print(f"[KernelSessionManager] Stopped. Stats: {self.stats}")
+
+    def _start_background(self) -> None:
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_periodically())
+            self._refill()
+
+    def _refill(self) -> None:
+        while len(self._warm_pool) + self._warming < self.warm_sessions:
+            self._warming += 1
+            task = asyncio.create_task(self._warm_up())
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def _warm_up(self) -> None:
+        try:
+            response = await self.mcp_client.call_tool(self.tool_name, {"code": self._WARM_UP_CODE})
+            session_id = json.loads(response)["session_info"]["session_id"]
+            self._warm_pool.append((str(session_id), time.monotonic()))
+            self.stats.warmed += 1
+        except Exception as e:
+            self.stats.warm_failures += 1
+            print(f"[KernelSessionManager] Unable to start interpreter session: {e}")
+        finally:
+            self._warming -= 1
+
+    async def _reap_periodically(self) -> None:
+        interval = min(self.session_ttl_seconds, 60)
+        while True:
+            await asyncio.sleep(interval)
+            self.reap_idle_sessions()
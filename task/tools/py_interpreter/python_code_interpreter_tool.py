@@ -1,16 +1,25 @@
-import base64
+import contextlib
+import hashlib
 import json
+import time
 from typing import Any, Optional
 
-from aidial_client import Dial
 from aidial_sdk.chat_completion import Message, Attachment
-from pydantic import StrictStr, AnyUrl
+from pydantic import StrictStr
 
 from task.tools.base import BaseTool
 from task.tools.py_interpreter._response import _ExecutionResult
-from task.tools.mcp.mcp_client import MCPClient
+from task.tools.py_interpreter.file_transfer import OutputFileTransfer
+from task.tools.py_interpreter.kernel_sessions import KernelSessionManager
+from task.tools.mcp.mcp_client import MCPClient, MCPClientConfig, format_progress
 from task.tools.mcp.mcp_tool_model import MCPToolModel
+from task.tools.mcp.mcp_tool_registry import MCPToolRegistry
 from task.tools.models import ToolCallParams
+from task.utils.dial_clients import DialClientRegistry
+from task.utils.stream_writer import StreamWriter
+
+# Max number of remembered user buckets, expired ones are dropped first, then the oldest one
+_MAX_CACHED_BUCKETS = 1024
 
 
 class PythonCodeInterpreterTool(BaseTool):
@@ -26,6 +35,11 @@ class PythonCodeInterpreterTool(BaseTool):
             mcp_tool_models: list[MCPToolModel],
             tool_name: str,
             dial_endpoint: str,
+            client_registry: DialClientRegistry,
+            warm_sessions: int = 2,
+            session_ttl_seconds: float = 1800,
+            file_transfer_concurrency: int = 4,
+            bucket_ttl_seconds: float = 300,
     ):
         """
         :param tool_name: it must be actual name of tool that executes code. It is 'execute_code'.
@@ -34,18 +48,29 @@ class PythonCodeInterpreterTool(BaseTool):
         #TODO:
         # 1. Set dial_endpoint
         self.dial_endpoint = dial_endpoint
+        self.client_registry = client_registry
         # 2. Set mcp_client
         self.mcp_client = mcp_client
         # 3. Set _code_execute_tool: Optional[MCPToolModel] as None at start, then iterate through `mcp_tool_models` and
         #    if any of tool model has the same same as `tool_name` then set _code_execute_tool as tool model
-        self._code_execute_tool: Optional[MCPToolModel] = None
-        for tool in mcp_tool_models:
-            if tool.name == tool_name:
-                self._code_execute_tool = tool
-                break
+        self._code_execute_tool: Optional[MCPToolModel] = self._find_tool(mcp_tool_models, tool_name)
         # 4. If `_code_execute_tool` is null then raise error (We cannot set up PythonCodeInterpreterTool without tool that executes code)
         if not self._code_execute_tool:
             raise ValueError("We cannot set up PythonCodeInterpreterTool without tool that executes code")
+        # 5. Create `kernel_sessions`, conversations reuse their interpreter session and new ones claim pre-started
+        #    kernels
+        self.kernel_sessions = KernelSessionManager(
+            mcp_client,
+            tool_name,
+            warm_sessions=warm_sessions,
+            session_ttl_seconds=session_ttl_seconds,
+        )
+        # 6. Create `file_transfer`, it moves files produced by code from PyInterpreter to DIAL bucket
+        self.file_transfer = OutputFileTransfer(mcp_client, max_concurrency=file_transfer_concurrency)
+        # 7. Remember user buckets (by hash of api key) for `bucket_ttl_seconds`, so code executions don't request
+        #    bucket from DIAL each time
+        self._bucket_ttl_seconds = bucket_ttl_seconds
+        self._buckets: dict[str, tuple[str, float]] = {}
 
     @classmethod
     async def create(
@@ -53,21 +78,79 @@ class PythonCodeInterpreterTool(BaseTool):
             mcp_url: str,
             tool_name: str,
             dial_endpoint: str,
+            client_registry: DialClientRegistry,
+            mcp_config: Optional[MCPClientConfig] = None,
+            warm_sessions: int = 2,
+            session_ttl_seconds: float = 1800,
+            file_transfer_concurrency: int = 4,
+            tool_registry: Optional[MCPToolRegistry] = None,
     ) -> 'PythonCodeInterpreterTool':
         """Async factory method to create PythonCodeInterpreterTool"""
         #TODO:
-        # 1. Create MCPClient
-        mcp_client: MCPClient = await MCPClient.create(mcp_url)
+        # 1. Create MCPClient (pool of sessions, see MCPClientConfig), or take cached one from `tool_registry`
         # 2. Get tools
-        tools = await mcp_client.get_tools()
+        if tool_registry is not None:
+            mcp_client = await tool_registry.get_client(mcp_url)
+            tools = await tool_registry.get_tools(mcp_url)
+        else:
+            mcp_client: MCPClient = await MCPClient.create(mcp_url, mcp_config)
+            tools = await mcp_client.get_tools()
         # 3. Create PythonCodeInterpreterTool instance and return it
         return cls(
             mcp_client=mcp_client, 
             mcp_tool_models=tools, 
             tool_name=tool_name, 
-            dial_endpoint=dial_endpoint
+            dial_endpoint=dial_endpoint,
+            client_registry=client_registry,
+            warm_sessions=warm_sessions,
+            session_ttl_seconds=session_ttl_seconds,
+            file_transfer_concurrency=file_transfer_concurrency,
             )
 
+    def update_tools(self, mcp_tool_models: list[MCPToolModel]) -> None:
+        """Take description and parameters of code execution tool from refreshed list of server tools."""
+        tool = self._find_tool(mcp_tool_models, self.name)
+        if tool is None:
+            print(f"[PythonCodeInterpreterTool] Tool {self.name} is absent on server, previous definition is kept")
+            return
+        self._code_execute_tool = tool
+
+    async def _get_session_key(self, tool_call_params: ToolCallParams) -> Optional[str]:
+        """Key of interpreter session: user bucket and conversation id, None if there is no conversation id."""
+        if not tool_call_params.conversation_id:
+            return None
+        bucket = await self._get_bucket(tool_call_params.api_key)
+        if bucket is None:
+            return None
+        return f"{bucket}:{tool_call_params.conversation_id}"
+
+    async def _get_bucket(self, api_key: str) -> Optional[str]:
+        """User bucket, remembered for `bucket_ttl_seconds`. None if DIAL didn't return it."""
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        now = time.monotonic()
+        cached = self._buckets.get(key_hash)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        dial_client = self.client_registry.async_client(endpoint=self.dial_endpoint, api_key=api_key)
+        try:
+            bucket = await dial_client.my_bucket()
+        except Exception as e:
+            print(f"[PythonCodeInterpreterTool] Unable to get user bucket, session won't be reused: {e}")
+            return None
+        if len(self._buckets) >= _MAX_CACHED_BUCKETS:
+            self._buckets = {k: v for k, v in self._buckets.items() if v[1] > now}
+            if len(self._buckets) >= _MAX_CACHED_BUCKETS:
+                self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[key_hash] = (bucket, now + self._bucket_ttl_seconds)
+        return bucket
+
+    @staticmethod
+    def _find_tool(mcp_tool_models: list[MCPToolModel], tool_name: str) -> Optional[MCPToolModel]:
+        for tool in mcp_tool_models:
+            if tool.name == tool_name:
+                return tool
+        return None
+
     @property
     def show_in_stage(self) -> bool:
         # set as False since we will have custom variant of representation in Stage
@@ -102,65 +185,61 @@ class PythonCodeInterpreterTool(BaseTool):
         stage.append_content("## Request arguments: \n")
         # 6. Append content to stage: `"```python\n\r{code}\n\r```\n\r"` it will show code in stage as python markdown
         stage.append_content(f"```python\n\r{code}\n\r```\n\r")
-        # 7. Append session to stage:
+        # 7. If `session_id` is absent then take session of conversation (or pre-started one) from `kernel_sessions`
+        #    and append session to stage:
         #       - if `session_id` is present and not 0 then append to stage `f"**session_id**: {session_id}\n\r"`
         #       - otherwise append "New session will be created\n\r"
-        if session_id:
-            stage.append_content(f"**session_id**: {session_id}\n\r")
-        else:
-            args.pop("session_id", None)
-            stage.append_content("New session will be created\n\r")
-        # 8. Make tool call
-        tool_call_response = await self.mcp_client.call_tool(self.name, args)
-        # 9. Load retrieved response as json (️⚠️ here can be potential issues if you didn't properly implemented
-        #    MCPClient tool call, it must return string)
-        if not tool_call_response:
-            raise ValueError("MCP tool returned empty response")
-        execution_result_json = json.loads(tool_call_response)
-        # 10. Validate result with _ExecutionResult (it is full copy of https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/models.py)
-        execution_result = _ExecutionResult.model_validate(execution_result_json)
+        #    Sessions are remembered by user and conversation, requests without conversation id don't reuse sessions.
+        #    Calls of the same conversation run one by one, so parallel calls don't start two kernels.
+        session_key = await self._get_session_key(tool_call_params)
+        async with self.kernel_sessions.lock(session_key) if session_key else contextlib.nullcontext():
+            if session_id:
+                if session_key:
+                    self.kernel_sessions.bind(session_key, str(session_id))
+            elif session_key:
+                session_id = self.kernel_sessions.acquire(session_key)
+                if session_id:
+                    args["session_id"] = session_id
+            if session_id:
+                stage.append_content(f"**session_id**: {session_id}\n\r")
+            else:
+                args.pop("session_id", None)
+                stage.append_content("New session will be created\n\r")
+            # 8. Make tool call, progress of execution (and partial output in its messages) is streamed to stage
+            with StreamWriter(stage, tool_call_params.stream_config) as progress_writer:
+                async def on_progress(progress: float, total: Optional[float], message: Optional[str]) -> None:
+                    progress_writer.append_content(format_progress(progress, total, message))
+
+                tool_call_response = await self.mcp_client.call_tool(self.name, args, progress_callback=on_progress)
+            # 9. Load retrieved response as json (️⚠️ here can be potential issues if you didn't properly implemented
+            #    MCPClient tool call, it must return string)
+            if not tool_call_response:
+                raise ValueError("MCP tool returned empty response")
+            execution_result_json = json.loads(tool_call_response)
+            # 10. Validate result with _ExecutionResult (it is full copy of https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/models.py)
+            execution_result = _ExecutionResult.model_validate(execution_result_json)
+            #     Remember session of conversation (server could start a new one, e.g. if previous one expired)
+            if execution_result.session_info and session_key:
+                self.kernel_sessions.bind(session_key, execution_result.session_info.session_id)
         # 11. If execution_result contains files we need to pool files from PyInterpreter and upload them to DIAL bucked:
-        #       - Create Dial client
-        #       - Get with client `my_appdata_home` path as `files_home`
-        #       - Iterated through files and:
-        #           - get file name and mime_type and assign to appropriate variables
-        #           - get resource with mcp client by URL from file (https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/server.py#L429)
-        #           - according to MCP binary resources must be encoded with base64 https://modelcontextprotocol.io/specification/2025-06-18/server/resources#binary-content
-        #             Check if mime_type starts with `text/` or some of 'application/json', 'application/xml', is yes
-        #             then encode resource with 'utf-8' format (text will be present as bytes to upload to DIAL bucket).
-        #             Otherwise (binary file) decode it with `b64decode`
-        #           - Prepare URL to upload downloaded file: f"files/{(files_home / file_name).as_posix()}"
-        #           - Upload file with DIAL client
-        #           - Prepare Attachment with url, type (mime_type), and title (file_name)
-        #           - Add attachment to stage and also add this attachment to choice (it will be chown in both stage and choice)
+        #       - Get AsyncDial client from `client_registry`
+        #       - Transfer files with `file_transfer`, files are fetched from PyInterpreter (by URL from file
+        #         https://github.com/khshanovskyi/mcp-python-code-interpreter/blob/main/interpreter/server.py#L429)
+        #         and uploaded to f"files/{(files_home / file_name).as_posix()}" concurrently
+        #       - As soon as file is uploaded add its Attachment (url, type (mime_type), and title (file_name)) to stage
+        #         and also to choice (it will be chown in both stage and choice)
         #       - Add to execution_result json addition
         if execution_result.files:
-            dial_client = Dial(base_url=self.dial_endpoint, api_key=tool_call_params.api_key)
-            files_home = dial_client.my_appdata_home()
-            for file_ref in execution_result.files:
-                file_name = file_ref.name
-                mime_type = file_ref.mime_type
-                resource = await self.mcp_client.get_resource(AnyUrl(file_ref.uri))
-                if mime_type.startswith('text/') or mime_type in ('application/json', 'application/xml'):
-                    file_content = resource.encode('utf-8')
-                else:
-                    file_content = base64.b64decode(resource)
-                
-                upload_url = f"files/{(files_home / file_name).as_posix()}"
-                dial_client.files.upload(url=upload_url, file=file_content)
-                attachment = Attachment(
-                    url=upload_url,
-                    type=mime_type,
-                    title=file_name
-                )
+            dial_client = self.client_registry.async_client(endpoint=self.dial_endpoint, api_key=tool_call_params.api_key)
+
+            def on_uploaded(attachment: Attachment) -> None:
                 stage.add_attachment(attachment)
                 tool_call_params.choice.add_attachment(attachment)
-            
+
+            transferred_files = await self.file_transfer.transfer(execution_result.files, dial_client, on_uploaded)
             execution_result_json['files_uploaded_to_dial'] = [
-                {
-                    'name': file_ref.name
-                }
-                for file_ref in execution_result.files
+                {'name': file.name} if file.error is None else {'name': file.name, 'error': file.error}
+                for file in transferred_files
             ]
         # 12. Check if execution_result output present and if yes iterate through all output results and cut it length
         #     to 1000 chars, it is needed to avoid high costs and context window overload
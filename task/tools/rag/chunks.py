@@ -0,0 +1,169 @@
+import bisect
+import re
+import sys
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_text_splitters import TextSplitter
+
+
+class RetrievedChunk(NamedTuple):
+    """Chunk found by search with its similarity score and [start, end) offsets in source document."""
+    text: str
+    score: float
+    start: int
+    end: int
+
+
+class DocumentChunks(Sequence[str]):
+    """In-memory list of document chunks with start offsets of chunks in source document (in characters)."""
+
+    def __init__(self, texts: list[str], starts: Sequence[int]):
+        if len(texts) != len(starts):
+            raise ValueError("Each chunk must have start offset")
+        self._texts = texts
+        self._starts = np.asarray(starts, dtype='<u8')
+
+    @property
+    def size(self) -> int:
+        """Approximate memory of chunks in bytes."""
+        return sys.getsizeof(self._texts) + sum(sys.getsizeof(text) for text in self._texts) + self._starts.nbytes
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self._starts
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __getitem__(self, index):
+        return self._texts[index]
+
+
+def split_document(text_splitter: TextSplitter, text: str) -> DocumentChunks:
+    """
+    Split text into chunks, `text_splitter` must be created with `add_start_index=True`.
+
+    Returns:
+        Chunks with their start offsets
+    """
+    documents = text_splitter.create_documents([text])
+    return DocumentChunks(
+        [document.page_content for document in documents],
+        [document.metadata['start_index'] for document in documents],
+    )
+
+
+class StreamingTextSplitter:
+    """
+    Splits text that arrives in segments (e.g. pages of document that is still parsed) into the same chunks as
+    `split_document` of the whole text, with their start offsets in it. `text_splitter` must be
+    RecursiveCharacterTextSplitter that keeps separators at the start of splits (default one) and `separator` must be
+    the first of its separators.
+
+    Chunks of the recursive splitter depend on the whole text: text is split by `separator`, small splits are merged
+    into chunks and large ones are split recursively. So received text is split only up to its last complete split
+    (next segment could extend the last one) and chunks that start before the last chunk are final: merging restarts
+    from the start of the last chunk (or after large split) the same way. Until `separator` is received nothing is
+    final, text without it is split by other separators.
+    """
+
+    def __init__(self, text_splitter: TextSplitter, chunk_size: int, chunk_overlap: int, separator: str = "\n\n"):
+        self._text_splitter = text_splitter
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._separator = separator
+        self._separator_found = False
+        # Received text that is still needed, it starts at `buffer_offset` of the whole text
+        self._buffer = ''
+        self._buffer_offset = 0
+        # Offset in the whole text from which text is split again
+        self._split_offset = 0
+        # Offset from which start of the next chunk is searched, the same way as `split_document` does
+        self._search_offset = 0
+
+    def push(self, segment: str) -> list[Tuple[str, int]]:
+        """
+        Add next segment of text.
+
+        Returns:
+            Final chunks with their start offsets
+        """
+        self._buffer += segment
+        if not self._separator_found:
+            if self._separator not in self._buffer:
+                return []
+            self._separator_found = True
+
+        text = self._buffer[self._split_offset - self._buffer_offset:]
+        split_starts = self._split_starts(text)
+        if len(split_starts) < 2:
+            return []
+        complete_text = text[:split_starts[-1]]
+        chunks = self._split(complete_text)
+        if not chunks:
+            return []
+        # Found start offsets of chunks can point to earlier occurrences of their text, but the last chunk always ends
+        # with the last non-whitespace character
+        last_chunk_start = len(complete_text.rstrip()) - len(chunks[-1][0])
+        restart_offset = self._restart_offset(text, split_starts, last_chunk_start)
+        if not restart_offset:
+            return []
+
+        final_chunks = chunks if restart_offset > last_chunk_start else chunks[:-1]
+        self._split_offset += restart_offset
+        if final_chunks:
+            last_text, last_start = final_chunks[-1]
+            self._search_offset = max(0, last_start + len(last_text) - self._chunk_overlap)
+        # Search of short chunk can find its earlier occurrence and move search offset back, so text before it is
+        # kept for one more chunk
+        keep_from = max(0, min(self._split_offset, self._search_offset) - self._chunk_size)
+        self._buffer = self._buffer[keep_from - self._buffer_offset:]
+        self._buffer_offset = keep_from
+        return final_chunks
+
+    def finish(self) -> list[Tuple[str, int]]:
+        """Returns remaining chunks with their start offsets."""
+        text = self._buffer[self._split_offset - self._buffer_offset:]
+        chunks = self._split(text) if text else []
+        self._buffer = ''
+        self._buffer_offset = self._split_offset = self._search_offset = 0
+        self._separator_found = False
+        return chunks
+
+    def _split(self, text: str) -> list[Tuple[str, int]]:
+        """Split `text` that starts at `split_offset`, start offsets of chunks are searched as `create_documents` does."""
+        chunks = []
+        search_offset = self._search_offset
+        for chunk in self._text_splitter.split_text(text):
+            start = self._buffer.find(chunk, max(0, search_offset - self._buffer_offset)) + self._buffer_offset
+            chunks.append((chunk, start))
+            search_offset = max(0, start + len(chunk) - self._chunk_overlap)
+        return chunks
+
+    def _split_starts(self, text: str) -> list[int]:
+        """Start offsets of splits of `text` by `separator`, separator is kept at the start of split."""
+        starts = [match.start() for match in re.finditer(re.escape(self._separator), text)]
+        return starts if starts and starts[0] == 0 else [0, *starts]
+
+    def _restart_offset(self, text: str, split_starts: list[int], last_chunk_start: int) -> Optional[int]:
+        """
+        Offset in `text` from which splitting gives the same chunks as splitting of the whole text, None if it is
+        unknown yet.
+
+        Args:
+            text: Text that is split again
+            split_starts: Start offsets of splits of `text`, the last split is not complete
+            last_chunk_start: Start offset of the last chunk of complete splits
+        """
+        index = bisect.bisect_right(split_starts, last_chunk_start) - 1
+        split_start, split_end = split_starts[index], split_starts[index + 1]
+        # Large split is split recursively on its own, merging of the next splits starts after it
+        if split_end - split_start >= self._chunk_size:
+            return split_end
+        # Chunk text is stripped, so it could start with whitespace-only split before the one where its text starts
+        if index > 0:
+            previous_split = text[split_starts[index - 1]:split_start]
+            if len(previous_split) < self._chunk_size and not previous_split.strip():
+                return None
+        return split_start
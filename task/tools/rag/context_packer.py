@@ -0,0 +1,131 @@
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+from task.tools.rag.chunks import RetrievedChunk
+
+# Chunks separated by not more than this number of characters (whitespace stripped by splitter) are merged
+_MAX_MERGE_GAP = 2
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of LLM tokens, ~4 characters per token for English text."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class ContextPackerStats:
+    """Token counters of ContextPacker, `tokens_saved` are tokens of overlaps and duplicates that are not sent."""
+    packs: int = 0
+    candidates: int = 0
+    merged_chunks: int = 0
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+    candidate_tokens: int = 0
+    packed_tokens: int = 0
+    overlap_tokens_removed: int = 0
+    duplicate_tokens_removed: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.overlap_tokens_removed + self.duplicate_tokens_removed
+
+
+class ContextPacker:
+    """
+    Packs retrieved chunks into context of limited size. Chunks of the same document that overlap or are adjacent
+    (by their offsets) are merged into one span, spans that are mostly contained in better ones (share at least
+    `duplicate_threshold` of word 3-grams, e.g. the same text in two documents) are dropped, and best spans are taken
+    while they fit in `token_budget`.
+    """
+
+    def __init__(
+            self,
+            token_budget: int = 2000,
+            duplicate_threshold: float = 0.8,
+            count_tokens: Callable[[str], int] = estimate_tokens,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.count_tokens = count_tokens
+        self.stats = ContextPackerStats()
+
+    def pack(self, retrieved: dict[str, list[RetrievedChunk]]) -> dict[str, list[RetrievedChunk]]:
+        """
+        Args:
+            retrieved: Candidate chunks by document
+
+        Returns:
+            Packed spans by document (documents without spans are kept empty), ordered by score
+        """
+        self.stats.packs += 1
+        spans: list[tuple[str, RetrievedChunk]] = []
+        for document, chunks in retrieved.items():
+            self.stats.candidates += len(chunks)
+            candidate_tokens = sum(self.count_tokens(chunk.text) for chunk in chunks)
+            self.stats.candidate_tokens += candidate_tokens
+            merged = self._merge(chunks)
+            self.stats.merged_chunks += len(chunks) - len(merged)
+            self.stats.overlap_tokens_removed += candidate_tokens - sum(self.count_tokens(span.text) for span in merged)
+            spans.extend((document, span) for span in merged)
+        spans.sort(key=lambda item: item[1].score, reverse=True)
+
+        packed: dict[str, list[RetrievedChunk]] = {document: [] for document in retrieved}
+        packed_shingles: list[set[tuple[str, ...]]] = []
+        used_tokens = 0
+        for document, span in spans:
+            span_tokens = self.count_tokens(span.text)
+            shingles = _shingles(span.text)
+            if any(_containment(shingles, other) >= self.duplicate_threshold for other in packed_shingles):
+                self.stats.dropped_duplicates += 1
+                self.stats.duplicate_tokens_removed += span_tokens
+                continue
+            if used_tokens + span_tokens > self.token_budget:
+                if used_tokens > 0:
+                    self.stats.dropped_over_budget += 1
+                    continue
+                # The best span is always sent, cut to the budget
+                span = self._truncate(span)
+                span_tokens = self.count_tokens(span.text)
+            packed[document].append(span)
+            packed_shingles.append(shingles)
+            used_tokens += span_tokens
+        self.stats.packed_tokens += used_tokens
+        return packed
+
+    @staticmethod
+    def _merge(chunks: list[RetrievedChunk]) -> list[RetrievedChunk]:
+        merged: list[RetrievedChunk] = []
+        for chunk in sorted(chunks, key=lambda item: item.start):
+            if merged and chunk.start <= merged[-1].end + _MAX_MERGE_GAP:
+                last = merged[-1]
+                if chunk.end <= last.end:
+                    text = last.text
+                elif chunk.start >= last.end:
+                    text = last.text + '\n' + chunk.text
+                else:
+                    text = last.text + chunk.text[last.end - chunk.start:]
+                merged[-1] = RetrievedChunk(text, max(last.score, chunk.score), last.start, max(last.end, chunk.end))
+            else:
+                merged.append(chunk)
+        return merged
+
+    def _truncate(self, span: RetrievedChunk) -> RetrievedChunk:
+        text = span.text
+        while text and self.count_tokens(text) > self.token_budget:
+            text = text[:len(text) * self.token_budget // self.count_tokens(text)]
+        return RetrievedChunk(text, span.score, span.start, span.start + len(text))
+
+
+def _shingles(text: str) -> set[tuple[str, ...]]:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < 3:
+        return {tuple(words)}
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def _containment(first: set, second: set) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / min(len(first), len(second))
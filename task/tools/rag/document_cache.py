@@ -1,24 +1,77 @@
-from datetime import datetime, time, timedelta
-from typing import Any, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, NamedTuple, Optional, Tuple
+import heapq
+import sys
 import threading
 
+from task.tools.rag.chunks import DocumentChunks
+from task.tools.rag.index_factory import index_size
+from task.tools.rag.index_store import ChunkFile, DiskIndexStore
+
+
+@dataclass
+class DocumentCacheStats:
+    """Hit, miss, eviction and size counters of DocumentCache."""
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    size_bytes: int = 0
+
+
+class _Entry(NamedTuple):
+    index: Any
+    chunks: Any
+    timestamp: datetime
+    size: int
+
 
 class DocumentCache:
     """
-    Thread-safe document cache with automatic cleanup at midnight.
-    Removes entries older than 24 hours.
+    Thread-safe LRU document cache bounded by `max_size_bytes` (FAISS vectors and chunks text of all entries).
+    Removes entries older than `ttl` (24 hours by default): they are kept in expiry heap and a background thread wakes
+    up when the oldest one expires.
+    If `storage_dir` is set, entries are also persisted to disk (see DiskIndexStore), so they survive restarts and
+    are shared between worker processes. Entries evicted from memory are loaded from disk again.
+    Entries are keyed by content, other keys (e.g. conversation and file URL) are references to them, see
+    `set_reference`, so the same document is cached once.
     """
 
-    def __init__(self):
-        self._cache: dict[str, Tuple[Any, Any, datetime]] = {}
+    # Disk store is also cleaned from entries that are not in memory (evicted or written by other processes)
+    _DISK_CLEANUP_INTERVAL = timedelta(hours=1)
+    _MAX_REFERENCES = 100_000
+
+    def __init__(
+            self,
+            storage_dir: Optional[str] = None,
+            max_size_bytes: int = 512 * 1024 * 1024,
+            ttl: timedelta = timedelta(hours=24),
+    ):
+        self._cache: OrderedDict[str, _Entry] = OrderedDict()
+        self._expiry_heap: list[Tuple[datetime, str]] = []
+        self._references: OrderedDict[str, Tuple[str, datetime]] = OrderedDict()
         self._lock = threading.Lock()
+        self._expiry_changed = threading.Condition(self._lock)
         self._cleanup_thread = None
         self._stop_event = threading.Event()
         self._running = False
+        self._store = DiskIndexStore(storage_dir) if storage_dir else None
+        self._max_size_bytes = max_size_bytes
+        self._ttl = ttl
+        self.stats = DocumentCacheStats()
 
     @classmethod
-    def create(cls) ->'DocumentCache':
-        instance = cls()
+    def create(
+            cls,
+            storage_dir: Optional[str] = None,
+            max_size_bytes: int = 512 * 1024 * 1024,
+            ttl: timedelta = timedelta(hours=24),
+    ) -> 'DocumentCache':
+        instance = cls(storage_dir, max_size_bytes, ttl)
         instance.start_cleanup_task()
         return instance
 
@@ -33,66 +86,173 @@ class DocumentCache:
             Tuple of (index, chunks) if found and not expired, None otherwise
         """
         with self._lock:
-            if key in self._cache:
-                index, chunks, timestamp = self._cache[key]
-                if datetime.now() - timestamp < timedelta(hours=24):
-                    return (index, chunks)
-                else:
-                    del self._cache[key]
-            return None
+            entry = self._cache.get(key)
+            if entry is not None:
+                if datetime.now() - entry.timestamp < self._ttl:
+                    self._cache.move_to_end(key)
+                    self.stats.hits += 1
+                    return (entry.index, entry.chunks)
+                self._remove(key)
+                self.stats.expirations += 1
+                if self._store is not None:
+                    self._store.remove(key)
+                self.stats.misses += 1
+                return None
+        return self._load(key)
 
     def set(self, key: str, index: Any, chunks: Any) -> None:
         """
-        Store an entry in the cache.
+        Store an entry in the cache, least recently used entries are evicted when cache is over its size.
 
         Args:
             key: Cache key
             index: FAISS index
-            chunks: Document chunks
+            chunks: Document chunks with their start offsets (DocumentChunks or ChunkFile)
+        """
+        timestamp = datetime.now()
+        self._put(key, _Entry(index, chunks, timestamp, self._entry_size(index, chunks)))
+        if self._store is not None:
+            try:
+                self._store.save(key, index, chunks, timestamp)
+            except Exception as e:
+                print(f"[DocumentCache] Unable to persist entry {key}: {e}")
+
+    def get_reference(self, key: str) -> Optional[str]:
+        """
+        Resolve reference.
+
+        Args:
+            key: Reference key
+
+        Returns:
+            Key of referenced entry if reference is set and not expired, None otherwise
         """
         with self._lock:
-            self._cache[key] = (index, chunks, datetime.now())
+            reference = self._references.get(key)
+            if reference is None:
+                return None
+            entry_key, timestamp = reference
+            if datetime.now() - timestamp >= self._ttl:
+                del self._references[key]
+                return None
+            self._references.move_to_end(key)
+            return entry_key
+
+    def set_reference(self, key: str, entry_key: str) -> None:
+        """
+        Set cheap reference to an entry, e.g. from conversation file to entry keyed by document content.
+
+        Args:
+            key: Reference key
+            entry_key: Key of referenced entry
+        """
+        with self._lock:
+            self._references[key] = (entry_key, datetime.now())
+            self._references.move_to_end(key)
+            while len(self._references) > self._MAX_REFERENCES:
+                self._references.popitem(last=False)
 
     def clear(self) -> None:
         """Clear all cached entries."""
         with self._lock:
             self._cache.clear()
+            self._references.clear()
+            self._expiry_heap.clear()
+            self.stats.entries = 0
+            self.stats.size_bytes = 0
+        if self._store is not None:
+            self._store.clear()
 
     def cleanup_old_entries(self) -> int:
         """
-        Remove entries older than 24 hours.
+        Remove expired entries.
 
         Returns:
             Number of entries removed
         """
         now = datetime.now()
-        cutoff_time = now - timedelta(hours=24)
+        cutoff_time = now - self._ttl
+        removed_count = 0
 
         with self._lock:
-            keys_to_remove = [
-                key for key, (_, _, timestamp) in self._cache.items()
-                if timestamp < cutoff_time
-            ]
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, key = heapq.heappop(self._expiry_heap)
+                entry = self._cache.get(key)
+                # Heap item is stale if entry was evicted or replaced after it was pushed
+                if entry is not None and entry.timestamp <= cutoff_time:
+                    self._remove(key)
+                    self.stats.expirations += 1
+                    removed_count += 1
 
-            for key in keys_to_remove:
-                del self._cache[key]
+        if removed_count > 0:
+            print(f"[DocumentCache] Cleaned up {removed_count} expired entries at {now}")
+        return removed_count
 
-            removed_count = len(keys_to_remove)
-            if removed_count > 0:
-                print(f"[DocumentCache] Cleaned up {removed_count} expired entries at {now}")
+    def _put(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            if entry.size > self._max_size_bytes:
+                return
+            self._cache[key] = entry
+            self.stats.entries += 1
+            self.stats.size_bytes += entry.size
+            heapq.heappush(self._expiry_heap, (entry.timestamp + self._ttl, key))
+            while self.stats.size_bytes > self._max_size_bytes:
+                self._remove(next(iter(self._cache)))
+                self.stats.evictions += 1
+            self._expiry_changed.notify()
 
-            return removed_count
+    def _remove(self, key: str) -> None:
+        entry = self._cache.pop(key)
+        self.stats.entries -= 1
+        self.stats.size_bytes -= entry.size
 
-    def _schedule_midnight_cleanup(self) -> None:
-        """Background thread that runs cleanup at midnight every day."""
+    def _load(self, key: str) -> Tuple[Any, Any] | None:
+        """Load entry from disk store (index and chunks are memory-mapped) and keep it in memory."""
+        stored = self._store.load(key) if self._store is not None else None
+        if stored is None:
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        index, chunks, timestamp = stored
+        if datetime.now() - timestamp >= self._ttl:
+            self._store.remove(key)
+            with self._lock:
+                self.stats.expirations += 1
+                self.stats.misses += 1
+            return None
+        self._put(key, _Entry(index, chunks, timestamp, self._entry_size(index, chunks)))
+        with self._lock:
+            self.stats.disk_hits += 1
+        return (index, chunks)
+
+    @staticmethod
+    def _entry_size(index: Any, chunks: Any) -> int:
+        """Approximate memory of entry: FAISS index and chunks text."""
+        if isinstance(chunks, (ChunkFile, DocumentChunks)):
+            return index_size(index) + chunks.size
+        return index_size(index) + sys.getsizeof(chunks) + sum(sys.getsizeof(chunk) for chunk in chunks)
+
+    def _schedule_expiry_cleanup(self) -> None:
+        """Background thread that runs cleanup when the oldest entry expires."""
+        next_disk_cleanup = datetime.now()
         while not self._stop_event.is_set():
             now = datetime.now()
-            tomorrow = now + timedelta(days=1)
-            midnight = datetime.combine(tomorrow.date(), time.min)
-            seconds_until_midnight = (midnight - now).total_seconds()
+            if self._store is not None and now >= next_disk_cleanup:
+                removed_count = self._store.remove_older_than(now - self._ttl)
+                if removed_count > 0:
+                    print(f"[DocumentCache] Cleaned up {removed_count} expired entries on disk at {now}")
+                next_disk_cleanup = now + self._DISK_CLEANUP_INTERVAL
 
-            if self._stop_event.wait(timeout=seconds_until_midnight):
-                break
+            with self._expiry_changed:
+                wake_up_at = next_disk_cleanup if self._store is not None else now + self._ttl
+                if self._expiry_heap:
+                    wake_up_at = min(wake_up_at, self._expiry_heap[0][0])
+                timeout = (wake_up_at - datetime.now()).total_seconds()
+                # Stop event is checked under the lock, otherwise notification of stop could come before wait
+                if timeout > 0 and not self._stop_event.is_set():
+                    self._expiry_changed.wait(timeout=timeout)
 
             if not self._stop_event.is_set():
                 self.cleanup_old_entries()
@@ -103,27 +263,34 @@ class DocumentCache:
             self._running = True
             self._stop_event.clear()
             self._cleanup_thread = threading.Thread(
-                target=self._schedule_midnight_cleanup,
+                target=self._schedule_expiry_cleanup,
                 daemon=True,
                 name="DocumentCache-Cleanup"
             )
             self._cleanup_thread.start()
-            print("[DocumentCache] Started automatic cleanup thread (runs at midnight)")
+            print("[DocumentCache] Started automatic cleanup thread (runs when entries expire)")
 
     def stop_cleanup_task(self) -> None:
         """Stop the background cleanup thread."""
         if self._running:
             self._running = False
             self._stop_event.set()
+            with self._expiry_changed:
+                self._expiry_changed.notify()
             if self._cleanup_thread and self._cleanup_thread.is_alive():
                 self._cleanup_thread.join(timeout=5)
-            print("[DocumentCache] Stopped automatic cleanup thread")
+            print(f"[DocumentCache] Stopped automatic cleanup thread. Stats: {self.stats}")
 
     def size(self) -> int:
         """Return the number of cached entries."""
         with self._lock:
             return len(self._cache)
 
+    def size_bytes(self) -> int:
+        """Return approximate memory of cached entries."""
+        with self._lock:
+            return self.stats.size_bytes
+
     def __contains__(self, key: str) -> bool:
         """Check if a key exists in the cache (and is not expired)."""
-        return self.get(key) is not None
\ No newline at end of file
+        return self.get(key) is not None
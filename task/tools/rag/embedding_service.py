@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+@dataclass
+class EmbeddingServiceStats:
+    """Batch-size and queue-latency counters of EmbeddingService."""
+    requests: int = 0
+    batches: int = 0
+    texts: int = 0
+    max_batch_size: int = 0
+    queue_latency_ms_total: float = 0.0
+    max_queue_latency_ms: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    @property
+    def avg_batch_size(self) -> float:
+        return self.texts / self.batches if self.batches else 0.0
+
+    @property
+    def avg_queue_latency_ms(self) -> float:
+        return self.queue_latency_ms_total / self.requests if self.requests else 0.0
+
+
+@dataclass
+class _EncodeRequest:
+    texts: list[str]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class EmbeddingService:
+    """
+    Encodes texts with SentenceTransformer in a dedicated thread, so encoding doesn't block the event loop.
+    Concurrent encode requests are gathered into micro-batches: a batch is encoded when it has `max_batch_size` texts
+    or when its oldest request has waited for `max_wait_ms`. Large requests are split into batch-sized parts and
+    priority requests (search queries) have their own queue that is taken first, so they wait at most for the batch
+    that is being encoded, not for the whole document ingestion.
+    Embeddings are cached by hash of text (LRU of `cache_size` texts), so repeated chunks are not encoded again.
+    """
+
+    def __init__(
+            self,
+            model: SentenceTransformer,
+            max_batch_size: int = 64,
+            max_wait_ms: float = 5,
+            cache_size: int = 50_000,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._cache: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._cache_size = cache_size
+        # One thread, model runs its own intra-op threads
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Embedding")
+        self._pending: deque[_EncodeRequest] = deque()
+        self._priority_pending: deque[_EncodeRequest] = deque()
+        self._pending_texts = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.stats = EmbeddingServiceStats()
+
+    async def encode(self, texts: list[str], priority: bool = False) -> np.ndarray:
+        """
+        Encode texts.
+
+        Args:
+            texts: Texts to encode
+            priority: Encode them before already queued non-priority requests
+
+        Returns:
+            Float32 embeddings, one row per text
+        """
+        if not texts:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype='float32')
+
+        keys = [hashlib.sha256(text.encode('utf-8')).digest() for text in texts]
+        embeddings: dict[bytes, np.ndarray] = {}
+        missing_texts: dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key in embeddings or key in missing_texts:
+                continue
+            if (embedding := self._cache.get(key)) is not None:
+                self._cache.move_to_end(key)
+                embeddings[key] = embedding
+            else:
+                missing_texts[key] = text
+        self.stats.cache_hits += len(embeddings)
+        self.stats.cache_misses += len(missing_texts)
+
+        if missing_texts:
+            missing_keys = list(missing_texts)
+            texts_to_encode = list(missing_texts.values())
+            parts = [
+                texts_to_encode[i:i + self.max_batch_size]
+                for i in range(0, len(texts_to_encode), self.max_batch_size)
+            ]
+            encoded = np.vstack(await asyncio.gather(*(self.submit(part, priority) for part in parts))).astype('float32')
+            for key, embedding in zip(missing_keys, encoded):
+                embeddings[key] = embedding
+                # Copy, so cached row doesn't keep the whole batch array in memory
+                self._cache_put(key, embedding.copy())
+
+        return np.vstack([embeddings[key] for key in keys])
+
+    def submit(self, texts: list[str], priority: bool = False) -> asyncio.Future:
+        """
+        Queue texts for encoding.
+
+        Args:
+            texts: Texts to encode
+            priority: Queue them before non-priority requests
+
+        Returns:
+            Future with embeddings of texts
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        request = _EncodeRequest(texts=texts, future=loop.create_future(), enqueued_at=loop.time())
+        (self._priority_pending if priority else self._pending).append(request)
+        self._pending_texts += len(texts)
+        self.stats.requests += 1
+        self._wakeup.set()
+        return request.future
+
+    def shutdown(self) -> None:
+        """Stop batching worker and encoding thread."""
+        if self._worker is not None:
+            self._worker.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        print(f"[EmbeddingService] Stopped. Stats: {self.stats}")
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending and not self._priority_pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait for more requests until batch is full or the oldest request waited long enough
+            deadline = min(
+                queue[0].enqueued_at for queue in (self._priority_pending, self._pending) if queue
+            ) + self.max_wait
+            while self._pending_texts < self.max_batch_size and (timeout := deadline - loop.time()) > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            started_at = loop.time()
+            for request in batch:
+                queue_latency_ms = (started_at - request.enqueued_at) * 1000
+                self.stats.queue_latency_ms_total += queue_latency_ms
+                self.stats.max_queue_latency_ms = max(self.stats.max_queue_latency_ms, queue_latency_ms)
+            texts = [text for request in batch for text in request.texts]
+            self.stats.batches += 1
+            self.stats.texts += len(texts)
+            self.stats.max_batch_size = max(self.stats.max_batch_size, len(texts))
+
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self._encode, texts)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result(embeddings[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+    def _cache_put(self, key: bytes, embedding: np.ndarray) -> None:
+        if self._cache_size <= 0:
+            return
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _take_batch(self) -> list[_EncodeRequest]:
+        # Priority requests first, the rest of the batch is filled with non-priority ones
+        batch: list[_EncodeRequest] = []
+        batch_texts = 0
+        for queue in (self._priority_pending, self._pending):
+            while queue and (not batch or batch_texts + len(queue[0].texts) <= self.max_batch_size):
+                request = queue.popleft()
+                batch.append(request)
+                batch_texts += len(request.texts)
+        self._pending_texts -= batch_texts
+        return batch
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.max_batch_size, convert_to_numpy=True)
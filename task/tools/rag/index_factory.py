@@ -0,0 +1,148 @@
+import math
+from dataclasses import dataclass
+from typing import Any
+
+import faiss
+import numpy as np
+
+QUANTIZATIONS = ('none', 'sq8', 'pq')
+
+
+@dataclass
+class IndexConfig:
+    """
+    Settings of FAISS index selection. Documents with up to `flat_max_chunks` chunks use exact (flat) search, up to
+    `hnsw_max_chunks` HNSW graph, larger ones IVF. `quantization` compresses stored vectors: 'sq8' (8-bit scalar,
+    4x smaller) or 'pq' (product quantization, IVF only, `pq_bytes` per vector).
+    """
+    flat_max_chunks: int = 10_000
+    hnsw_max_chunks: int = 200_000
+    quantization: str = 'none'
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 80
+    hnsw_ef_search: int = 256
+    ivf_nprobe: int = 16
+    pq_bytes: int = 48
+    max_training_points: int = 100_000
+
+    def __post_init__(self):
+        if self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{self.quantization}', supported: {', '.join(QUANTIZATIONS)}")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 copy of vectors normalized to unit length, so inner product is cosine similarity."""
+    normalized = np.array(vectors, dtype='float32', copy=True)
+    faiss.normalize_L2(normalized)
+    return normalized
+
+
+def build_index(embeddings: np.ndarray, dimension: int, config: IndexConfig = IndexConfig()) -> Any:
+    """
+    Build inner-product index that suits the number of vectors.
+
+    Args:
+        embeddings: Embeddings, one row per chunk
+        dimension: Embedding dimension
+        config: Index selection settings
+
+    Returns:
+        FAISS index with normalized embeddings added
+    """
+    vectors = normalize(embeddings).reshape(-1, dimension)
+    count = len(vectors)
+
+    if count <= config.flat_max_chunks:
+        if config.quantization == 'none':
+            index = faiss.IndexFlatIP(dimension)
+        else:
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    elif count <= config.hnsw_max_chunks:
+        index = _create_hnsw_index(dimension, config)
+    else:
+        nlist = int(4 * math.sqrt(count))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if config.quantization == 'pq':
+            # Number of sub-quantizers must divide dimension
+            subquantizers = max(m for m in range(1, config.pq_bytes + 1) if dimension % m == 0)
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, subquantizers, 8, faiss.METRIC_INNER_PRODUCT)
+        elif config.quantization == 'sq8':
+            index = faiss.IndexIVFScalarQuantizer(
+                quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = config.ivf_nprobe
+
+    if not index.is_trained:
+        training_points = vectors
+        if count > config.max_training_points:
+            sample = np.random.default_rng(0).choice(count, config.max_training_points, replace=False)
+            training_points = vectors[sample]
+        index.train(training_points)
+    index.add(vectors)
+    return index
+
+
+def _create_hnsw_index(dimension: int, config: IndexConfig) -> Any:
+    if config.quantization == 'none':
+        index = faiss.IndexHNSWFlat(dimension, config.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, config.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = config.hnsw_ef_construction
+    index.hnsw.efSearch = config.hnsw_ef_search
+    return index
+
+
+class IndexBuilder:
+    """
+    Builds index from embeddings that are added in batches (e.g. while document is still parsed), the same index type
+    as `build_index` is selected. Without quantization vectors are added to the index right away: to flat index and
+    to HNSW once there are more than `flat_max_chunks` of them. Quantized and IVF indexes are trained, so their
+    vectors are kept until `build`.
+    """
+
+    def __init__(self, dimension: int, config: IndexConfig = IndexConfig()):
+        self.dimension = dimension
+        self.config = config
+        self.count = 0
+        self._index = faiss.IndexFlatIP(dimension) if config.quantization == 'none' else None
+        self._vectors: list[np.ndarray] = []
+
+    def add(self, embeddings: np.ndarray) -> None:
+        vectors = normalize(embeddings).reshape(-1, self.dimension)
+        self.count += len(vectors)
+        if self._index is not None and self.count > self.config.hnsw_max_chunks:
+            # IVF index is built from all vectors
+            self._vectors.append(self._index.reconstruct_n(0, self._index.ntotal))
+            self._index = None
+        elif isinstance(self._index, faiss.IndexFlat) and self.count > self.config.flat_max_chunks:
+            hnsw_index = _create_hnsw_index(self.dimension, self.config)
+            hnsw_index.add(self._index.reconstruct_n(0, self._index.ntotal))
+            self._index = hnsw_index
+
+        if self._index is not None:
+            self._index.add(vectors)
+        else:
+            self._vectors.append(vectors)
+
+    def build(self) -> Any:
+        """Returns FAISS index with all added embeddings."""
+        if self._index is not None:
+            return self._index
+        vectors = np.vstack(self._vectors) if self._vectors else np.empty((0, self.dimension), dtype='float32')
+        self._vectors = []
+        return build_index(vectors, self.dimension, self.config)
+
+
+def index_size(index: Any) -> int:
+    """Approximate memory of index in bytes."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        graph_size = hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+        return index_size(index.storage) + graph_size
+    if isinstance(index, faiss.IndexIVF):
+        # Codes with their ids and coarse quantizer centroids
+        return index.ntotal * (index.code_size + 8) + index_size(index.quantizer)
+    return index.ntotal * getattr(index, 'code_size', index.d * 4)
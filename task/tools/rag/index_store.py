@@ -0,0 +1,164 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from task.tools.rag.chunks import DocumentChunks
+
+_CHUNKS_MAGIC = b'CHK2'
+_CHUNKS_HEADER = struct.Struct('<4sQ')
+
+
+class ChunkFile(Sequence[str]):
+    """
+    Read-only list of chunks backed by memory-mapped offset-indexed file: header (magic, count), `count + 1` uint64
+    offsets, `count` uint64 start offsets of chunks in source document and UTF-8 text of all chunks. Chunk is decoded
+    only when it is accessed.
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _CHUNKS_HEADER.unpack_from(self._mmap)
+        if magic != _CHUNKS_MAGIC:
+            raise ValueError(f"Not a chunks file: {path}")
+        self._offsets = np.frombuffer(self._mmap, dtype='<u8', count=self._count + 1, offset=_CHUNKS_HEADER.size)
+        self._starts = np.frombuffer(
+            self._mmap, dtype='<u8', count=self._count, offset=_CHUNKS_HEADER.size + self._offsets.nbytes
+        )
+        self._data_start = _CHUNKS_HEADER.size + self._offsets.nbytes + self._starts.nbytes
+
+    @staticmethod
+    def write(path: str, chunks: Sequence[str], starts: Sequence[int]) -> None:
+        encoded_chunks = [chunk.encode('utf-8') for chunk in chunks]
+        offsets = np.zeros(len(encoded_chunks) + 1, dtype='<u8')
+        np.cumsum([len(chunk) for chunk in encoded_chunks], out=offsets[1:])
+        with open(path, 'wb') as file:
+            file.write(_CHUNKS_HEADER.pack(_CHUNKS_MAGIC, len(encoded_chunks)))
+            file.write(offsets.tobytes())
+            file.write(np.asarray(starts, dtype='<u8').tobytes())
+            for chunk in encoded_chunks:
+                file.write(chunk)
+
+    @property
+    def size(self) -> int:
+        """Size of mapped file in bytes."""
+        return len(self._mmap)
+
+    @property
+    def starts(self) -> np.ndarray:
+        """Start offsets of chunks in source document (in characters)."""
+        return self._starts
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("chunk index out of range")
+        start = self._data_start + int(self._offsets[index])
+        end = self._data_start + int(self._offsets[index + 1])
+        return self._mmap[start:end].decode('utf-8')
+
+
+class DiskIndexStore:
+    """
+    On-disk store of FAISS indexes and their chunks. Each entry is written as `<name>.faiss` (`faiss.write_index`),
+    `<name>.chunks` (ChunkFile) and `<name>.json` (key and timestamp), where name is hash of the key. Indexes are
+    reopened with `IO_FLAG_MMAP`, so loads are fast and page cache is shared between processes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def save(self, key: str, index: Any, chunks: DocumentChunks | ChunkFile, timestamp: datetime) -> None:
+        """Write entry, files are replaced atomically, metadata is removed first and written last."""
+        name = self._name(key)
+        with self._lock:
+            try:
+                os.remove(self.directory / f"{name}.json")
+            except FileNotFoundError:
+                pass
+            self._write_atomically(name, '.faiss', lambda path: faiss.write_index(index, path))
+            self._write_atomically(name, '.chunks', lambda path: ChunkFile.write(path, chunks, chunks.starts))
+            self._write_atomically(
+                name,
+                '.json',
+                lambda path: Path(path).write_text(json.dumps({"key": key, "timestamp": timestamp.isoformat()})),
+            )
+
+    def load(self, key: str) -> Tuple[Any, ChunkFile, datetime] | None:
+        """
+        Returns:
+            Tuple of (index, chunks, timestamp) if entry is stored, None otherwise
+        """
+        name = self._name(key)
+        try:
+            metadata = json.loads((self.directory / f"{name}.json").read_text())
+            index = faiss.read_index(str(self.directory / f"{name}.faiss"), faiss.IO_FLAG_MMAP)
+            chunks = ChunkFile(str(self.directory / f"{name}.chunks"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[DiskIndexStore] Unable to load entry {key}: {e}")
+            self.remove(key)
+            return None
+        return index, chunks, datetime.fromisoformat(metadata["timestamp"])
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self._remove_files(self._name(key))
+
+    def remove_older_than(self, cutoff_time: datetime) -> int:
+        """
+        Remove entries stored before `cutoff_time`.
+
+        Returns:
+            Number of entries removed
+        """
+        removed_count = 0
+        with self._lock:
+            for metadata_path in self.directory.glob('*.json'):
+                try:
+                    timestamp = datetime.fromisoformat(json.loads(metadata_path.read_text())["timestamp"])
+                except Exception:
+                    timestamp = datetime.min
+                if timestamp < cutoff_time:
+                    self._remove_files(metadata_path.stem)
+                    removed_count += 1
+        return removed_count
+
+    def clear(self) -> None:
+        with self._lock:
+            for metadata_path in self.directory.glob('*.json'):
+                self._remove_files(metadata_path.stem)
+
+    def _name(self, key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _write_atomically(self, name: str, suffix: str, write) -> None:
+        temp_path = self.directory / f"{name}{suffix}.{os.getpid()}.tmp"
+        write(str(temp_path))
+        os.replace(temp_path, self.directory / f"{name}{suffix}")
+
+    def _remove_files(self, name: str) -> None:
+        # Metadata first, so partially removed entry is not loaded
+        for suffix in ('.json', '.faiss', '.chunks'):
+            try:
+                os.remove(self.directory / f"{name}{suffix}")
+            except FileNotFoundError:
+                pass
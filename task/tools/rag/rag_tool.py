@@ -1,17 +1,27 @@
+import asyncio
+import hashlib
 import json
-from typing import Any
+from collections import deque
+from typing import Any, Optional, Tuple
 
-import faiss
-import numpy as np
-from aidial_client import AsyncDial
 from aidial_sdk.chat_completion import Message, Role
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
 from task.tools.base import BaseTool
 from task.tools.models import ToolCallParams
+from task.tools.rag.chunks import DocumentChunks, RetrievedChunk, StreamingTextSplitter
+from task.tools.rag.context_packer import ContextPacker
 from task.tools.rag.document_cache import DocumentCache
+from task.tools.rag.embedding_service import EmbeddingService
+from task.tools.rag.index_factory import IndexBuilder, IndexConfig, normalize
+from task.utils.dial_clients import DialClientRegistry
 from task.utils.dial_file_conent_extractor import DialFileContentExtractor
+from task.utils.extracted_document_cache import ExtractedDocument
+from task.utils.lazy_pdf_document import LazyPdfDocument
+from task.utils.single_flight import SingleFlight
+from task.utils.stream_writer import StreamWriter
 
 # TODO: provide system prompt for Generation step
 _SYSTEM_PROMPT = """
@@ -21,8 +31,24 @@ You are a focused assistant that answers user questions using only the retrieved
 - When relevant, quote short snippets from the context to justify the answer.
 - Ignore irrelevant or duplicate chunks.
 - If asked for calculations, compute from the provided data; show the math briefly.
+- If there are several requests, answer each of them separately under its number.
+- If there are several documents, mention which document each fact comes from.
 """
 
+# Part of document content key, entries with other embedding model or chunking must not be reused
+_INDEX_VERSION = "all-MiniLM-L6-v2:500:50:ip:offsets"
+
+_CHUNK_SIZE = 500
+_CHUNK_OVERLAP = 50
+# Documents are indexed by text windows of this size (in characters), see `_index_document`
+_INGESTION_WINDOW = 64 * 1024
+# Number of chunk batches that are encoded while the next text is read and split
+_MAX_BATCHES_IN_FLIGHT = 4
+
+# 'generate' answers with inner LLM call, 'retrieve' returns ranked chunks to the orchestration model, 'auto' returns
+# chunks for short requests
+RAG_MODES = ('generate', 'retrieve', 'auto')
+
 
 class RagTool(BaseTool):
     """
@@ -30,12 +56,40 @@ class RagTool(BaseTool):
     Supports: PDF, TXT, CSV, HTML.
     """
 
-    def __init__(self, endpoint: str, deployment_name: str, document_cache: DocumentCache):
+    def __init__(
+            self,
+            endpoint: str,
+            deployment_name: str,
+            document_cache: DocumentCache,
+            client_registry: DialClientRegistry,
+            file_extractor: DialFileContentExtractor,
+            embedding_batch_size: int = 64,
+            embedding_max_wait_ms: float = 5,
+            embedding_cache_size: int = 50_000,
+            index_config: Optional[IndexConfig] = None,
+            mode: str = 'generate',
+            auto_retrieval_max_words: int = 12,
+            retrieval_candidates: int = 8,
+            context_token_budget: int = 2000,
+    ):
         #TODO:
-        # 1. Set endpoint
+        # 1. Set endpoint, client_registry (shared DIAL connection pools) and file_extractor (shared with file content
+        #    extraction tool, so already parsed documents are not parsed again)
         self.endpoint = endpoint
+        self.client_registry = client_registry
+        self.file_extractor = file_extractor
         # 2. Set deployment_name
         self.deployment_name = deployment_name
+        #    Set `mode` (see RAG_MODES), in 'auto' mode requests up to `auto_retrieval_max_words` words are answered
+        #    with retrieved chunks only
+        if mode not in RAG_MODES:
+            raise ValueError(f"Unknown RAG mode '{mode}', supported: {', '.join(RAG_MODES)}")
+        self.mode = mode
+        self.auto_retrieval_max_words = auto_retrieval_max_words
+        #    Search returns `retrieval_candidates` chunks per request and document, ContextPacker merges overlapping
+        #    ones, drops duplicates and keeps the best of them within `context_token_budget`
+        self.retrieval_candidates = retrieval_candidates
+        self.context_packer = ContextPacker(token_budget=context_token_budget)
         # 3. Set document_cache. DocumentCache is implemented, relate to it as to centralized Dict with file_url (as key),
         #    and indexed embeddings (as value), that have some autoclean. This cache will allow us to speed up RAG search.
         self.document_cache = document_cache
@@ -44,16 +98,31 @@ class RagTool(BaseTool):
         #     More info: https://medium.com/@rahultiwari065/unlocking-the-power-of-sentence-embeddings-with-all-minilm-l6-v2-7d6589a5f0aa
         #   - Optional! You can set it use CPU forcefully with `device='cpu'`, in case if not set up then will use GPU if it has CUDA cores
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedding_dimension = self.model.get_sentence_embedding_dimension()
+        #    FAISS index type is selected by number of chunks, see IndexConfig
+        self.index_config = index_config or IndexConfig()
+        #    Model is used through `embedding_service`, it encodes in dedicated thread and batches concurrent requests
+        self.embedding_service = EmbeddingService(
+            self.model,
+            max_batch_size=embedding_batch_size,
+            max_wait_ms=embedding_max_wait_ms,
+            cache_size=embedding_cache_size,
+        )
+        #    Concurrent ingestions of the same file (per conversation) and indexing of the same content are shared
+        self._file_ingestions: SingleFlight[Tuple[Any, Any] | None] = SingleFlight()
+        self._index_builds: SingleFlight[Tuple[Any, Any]] = SingleFlight()
         # 5. Create RecursiveCharacterTextSplitter as `text_splitter` with:
         #   - chunk_size=500
         #   - chunk_overlap=50
         #   - length_function=len
         #   - separators=["\n\n", "\n", ". ", " ", ""]
+        #   - add_start_index=True (chunks keep their offsets in document)
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500,
-            chunk_overlap=50,
+            chunk_size=_CHUNK_SIZE,
+            chunk_overlap=_CHUNK_OVERLAP,
             length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+            separators=["\n\n", "\n", ". ", " ", ""],
+            add_start_index=True,
         )
 
     @property
@@ -75,102 +144,116 @@ class RagTool(BaseTool):
                 "Use this tool when user asks questions about document content, needs specific information from large files, "
                 "or wants to search for particular topics/keywords. "
                 "Don't use it when: user wants to read entire document sequentially. "
-                "HOW IT WORKS: Splits document into chunks, finds top 3 most relevant sections using semantic search, "
-                "then generates answer based only on those sections.")
+                "HOW IT WORKS: Splits document into chunks, finds the most relevant sections using semantic search, "
+                "then generates answer based only on those sections. "
+                "Several questions and documents (e.g. to compare them) must be passed in one call as lists. "
+                "With `retrieval_only` (default for short questions) it returns ranked sections with relevance scores "
+                "and offsets instead of the answer, answer the user from them.")
 
     @property
     def parameters(self) -> dict[str, Any]:
         # TODO: provide tool parameters JSON Schema:
-        #  - request is string, description: "The search query or question to search for in the document", required
-        #  - file_url is string, required
+        #  - requests is array of strings, description: "The search queries or questions to search for in the
+        #    documents", required
+        #  - file_urls is array of strings, required
+        #  - retrieval_only is boolean, optional
         return {
             "type": "object",
             "properties": {
-                "request": {
-                    "type": "string",
-                    "description": "The search query or question to search for in the document"
+                "requests": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The search queries or questions to search for in the documents"
+                },
+                "file_urls": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "File URLs"
                 },
-                "file_url": {
-                    "type": "string",
-                    "description": "File URL"
+                "retrieval_only": {
+                    "type": "boolean",
+                    "description": "Return relevant document sections instead of generated answer"
                 },
             },
-            "required": ["request", "file_url"],
+            "required": ["requests", "file_urls"],
         }
 
+    def close(self) -> None:
+        """Stop cleanup thread of `document_cache` and encoding worker of `embedding_service`."""
+        self.document_cache.stop_cleanup_task()
+        self.embedding_service.shutdown()
+
     async def _execute(self, tool_call_params: ToolCallParams) -> str | Message:
         #TODO:
         # 1. Load arguments with `json`
         arguments = json.loads(tool_call_params.tool_call.function.arguments)
-        # 2. Get `request` from arguments
-        request = arguments["request"]
-        # 3. Get `file_url` from arguments
-        file_url = arguments["file_url"]
+        # 2. Get `requests` from arguments (single `request` string of previous tool calls is supported as well),
+        #    without duplicates
+        requests = list(dict.fromkeys(self._as_list(arguments.get("requests", arguments.get("request")))))
+        # 3. Get `file_urls` from arguments (single `file_url` of previous tool calls is supported as well), without
+        #    duplicates
+        file_urls = list(dict.fromkeys(self._as_list(arguments.get("file_urls", arguments.get("file_url")))))
+        if not requests or not file_urls:
+            raise ValueError("Error: At least one request and one file URL are required.")
 
         # 4. Get stage from `tool_call_params`
         stage = tool_call_params.stage
         # 5. Append content to stage: "## Request arguments: \n"
         stage.append_content("## Request arguments: \n")
-        # 6. Append content to stage: `f"**Request**: {request}\n\r"`
-        stage.append_content(f"**Request**: {request}\n\r")
-        # 7. Append content to stage: `f"**File URL**: {file_url}\n\r"`
-        stage.append_content(f"**Document URL**: {file_url}\n")
-
-        # 8. Create `cache_document_key`, it is string from `conversation_id` and `file_url`, with such key we guarantee
-        #    access to cached indexes for one particular conversation,
-        cache_document_key = f"{tool_call_params.conversation_id}:{file_url}"
-        # 9. Get from `document_cache` by `cache_document_key` a cache
-        cached_data = self.document_cache.get(cache_document_key)
-        # 10. If cache is present then set it as `index, chunks = cached_data` (cached_data is retrieved cache from 9 step),
-        #     otherwise:
-        #       - Create DialFileContentExtractor and extract text by `file_url` as `text_content`
-        #       - If no `text_content` then appen to stage info about it ans return the string with the error that file content is not found
-        #       - Create `chunks` with `text_splitter`
-        #       - Create `embeddings` with `model`
-        #       - Create IndexFlatL2 with `384` dimensions as `index` (more about IndexFlatL2 https://shayan-fazeli.medium.com/faiss-a-quick-tutorial-to-efficient-similarity-search-595850e08473)
-        #       - Add to `index` np.array with created embeddings as type 'float32'
-        #       - Add to `document_cache`
-        if cached_data is not None:
-            index, chunks = cached_data
-        else:
-            text_content = DialFileContentExtractor(
-                endpoint=self.endpoint,
-                api_key=tool_call_params.api_key
-            ).extract_text(file_url)
-            if not text_content:
-                stage.append_content("## Response: \n")
-                content = "Error: File content not found."
-                stage.append_content(f"{content}\n")
-                return content
-            chunks = self.text_splitter.split_text(text_content)
-            embeddings = self.model.encode(chunks)
-            index = faiss.IndexFlatL2(384)
-            index.add(np.array(embeddings).astype('float32'))
-            self.document_cache.set(cache_document_key, index, chunks)
-
-        # 11. Prepare `query_embedding` with model. You need to encode request as type 'float32'
-        query_embedding = self.model.encode([request]).astype('float32')
-        # 12. Through created index make search with `query_embedding`, `k` set as 3. As response we expect tuple of
-        #     `distances` and `indices`
-        k = min(3, len(chunks))
-        distances, indices = index.search(query_embedding, k=k)
-
-        # 13. Now you need to iterate through `indices[0]` and and by each idx get element from `chunks`, result save as `retrieved_chunks`
-        retrieved_chunks = [chunks[idx] for idx in indices[0]]
-        # 14. Make augmentation
-        augmented_prompt = self.__augmentation(request, retrieved_chunks)
-        # 15. Append content to stage: "## RAG Request: \n"
+        # 6. Append content to stage each request: `f"**Request**: {request}\n\r"`
+        for request in requests:
+            stage.append_content(f"**Request**: {request}\n\r")
+        # 7. Append content to stage each file URL: `f"**Document URL**: {file_url}\n"`
+        for file_url in file_urls:
+            stage.append_content(f"**Document URL**: {file_url}\n")
+
+        # 8. Get indexes of all documents with `_get_index` concurrently
+        indexes = await asyncio.gather(*(
+            self._get_index(tool_call_params.conversation_id, file_url, tool_call_params.api_key)
+            for file_url in file_urls
+        ))
+        # 9. If there is no content in any document then append to stage info about it and return the string with
+        #    the error that file content is not found
+        documents = {file_url: cached_data for file_url, cached_data in zip(file_urls, indexes) if cached_data}
+        if not documents:
+            stage.append_content("## Response: \n")
+            content = "Error: File content not found."
+            stage.append_content(f"{content}\n")
+            return content
+
+        # 10. Prepare `query_embeddings` of all requests in one batch with `embedding_service` (they are encoded as
+        #     type 'float32') and normalize them, indexes use inner product of normalized vectors. Queries have priority,
+        #     so they don't wait for chunks of documents that are being ingested
+        query_embeddings = normalize(await self.embedding_service.encode(requests, priority=True))
+        # 11. Search all requests in each index with one batched search (`k` set as `retrieval_candidates`), chunks
+        #     found by few requests are used once
+        # 12. Pack retrieved chunks with `context_packer` into context of limited size and make augmentation,
+        #     documents without content are mentioned in it
+        retrieved = self.context_packer.pack(await self._retrieve(documents, query_embeddings))
+        missing_file_urls = [file_url for file_url in file_urls if file_url not in documents]
+
+        # 13. In retrieval-only mode append to stage ranked chunks and return them, orchestration model answers from
+        #     them, so there is no inner Generation
+        if self._is_retrieval_only(requests, arguments.get("retrieval_only")):
+            content = self._format_retrieved(retrieved, missing_file_urls)
+            stage.append_content("## Retrieved chunks: \n")
+            stage.append_content(f"```text\n\r{content}\n\r```\n\r")
+            return content
+
+        augmented_prompt = self.__augmentation(requests, retrieved, missing_file_urls)
+        # 14. Append content to stage: "## RAG Request: \n"
         stage.append_content(f"## RAG Request: \n")
-        # 16. Append content to stage: `ff"```text\n\r{augmented_prompt}\n\r```\n\r"` (will be shown as markdown text)
+        # 15. Append content to stage: `ff"```text\n\r{augmented_prompt}\n\r```\n\r"` (will be shown as markdown text)
         stage.append_content(f"```text\n\r{augmented_prompt}\n\r```\n\r")
-        # 17. Append content to stage: "## Response: \n"
+        # 16. Append content to stage: "## Response: \n"
         stage.append_content("## Response: \n")
 
-        # 18. Now make Generation with AsyncDial (don't forget about api_version '025-01-01-preview, provide LLM with system prompt and augmented prompt and:
-        #   - stream response to stage (user in real time will be able to see what the LLM responding while Generation step)
+        # 17. Now make one Generation for all requests with AsyncDial from `client_registry` (don't forget about api_version '025-01-01-preview, provide LLM with system prompt and augmented prompt and:
+        #   - stream response to stage through StreamWriter (user in real time will be able to see what the LLM
+        #     responding while Generation step, deltas are coalesced into bigger frames)
         #   - collect all content (we need to return it as tool execution result)
-        dial_client = AsyncDial(
-            base_url=self.endpoint,
+        dial_client = self.client_registry.async_client(
+            endpoint=self.endpoint,
             api_key=tool_call_params.api_key,
         )
 
@@ -188,19 +271,211 @@ class RagTool(BaseTool):
             deployment_name=self.deployment_name,
             stream=True,
         )
-        content = ''
-        async for chunk in chunks_stream:
-            if chunk.choices and len(chunk.choices) > 0:
-                delta = chunk.choices[0].delta
-                if delta and delta.content:
-                    tool_call_params.stage.append_content(delta.content)
-                    content += delta.content
-
-        # 19. return collected content
-        return content
-
-    def __augmentation(self, request: str, chunks: list[str]) -> str:
+        with StreamWriter(stage, tool_call_params.stream_config) as stage_writer:
+            async for chunk in chunks_stream:
+                if chunk.choices and len(chunk.choices) > 0:
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        stage_writer.append_content(delta.content)
+
+        # 18. return collected content
+        return stage_writer.content
+
+    async def _get_index(self, conversation_id: str, file_url: str, api_key: str) -> Tuple[Any, Any] | None:
+        """
+        Get document index from cache or ingest document.
+
+        Returns:
+            Tuple of (index, chunks), None if document has no content
+        """
+        #TODO:
+        # 1. Create `cache_document_key`, it is string from `conversation_id` and `file_url`, with such key we
+        #    guarantee access to cached indexes for one particular conversation. It is a reference to entry keyed by
+        #    document content, so the same document attached in many conversations is indexed once
+        # 2. Resolve `cache_document_key` to content key and get from `document_cache` a cache (in thread, it can be
+        #    loaded from disk)
+        # 3. If cache is not present then ingest document with `_ingest`. Concurrent calls for the same document
+        #    (e.g. few questions in one turn) share one ingestion, if it fails all of them get the error
+        cache_document_key = f"{conversation_id}:{file_url}"
+        content_key = self.document_cache.get_reference(cache_document_key)
+        cached_data = await asyncio.to_thread(self.document_cache.get, content_key) if content_key else None
+        if cached_data is None:
+            cached_data = await self._file_ingestions.do(
+                cache_document_key,
+                lambda: self._ingest(cache_document_key, file_url, api_key),
+            )
+        return cached_data
+
+    async def _retrieve(
+            self,
+            documents: dict[str, Tuple[Any, Any]],
+            query_embeddings: np.ndarray,
+    ) -> dict[str, list[RetrievedChunk]]:
+        """
+        Search all queries in each document index with one batched search.
+
+        Returns:
+            Retrieved chunks by file URL, ordered by best score, each chunk once
+        """
+        async def search(index: Any, chunks: Any) -> list[RetrievedChunk]:
+            k = min(self.retrieval_candidates, len(chunks))
+            distances, indices = await asyncio.to_thread(index.search, query_embeddings, k)
+            # Approximate indexes return -1 if they found less than `k` chunks
+            best_scores: dict[int, float] = {}
+            for query_distances, query_indices in zip(distances, indices):
+                for score, idx in zip(query_distances, query_indices):
+                    if idx >= 0:
+                        best_scores[int(idx)] = max(best_scores.get(int(idx), float('-inf')), float(score))
+            retrieved_chunks = []
+            for idx in sorted(best_scores, key=best_scores.get, reverse=True):
+                text = chunks[idx]
+                start = int(chunks.starts[idx])
+                retrieved_chunks.append(RetrievedChunk(text, best_scores[idx], start, start + len(text)))
+            return retrieved_chunks
+
+        retrieved = await asyncio.gather(*(search(index, chunks) for index, chunks in documents.values()))
+        return dict(zip(documents, retrieved))
+
+    def _is_retrieval_only(self, requests: list[str], retrieval_only: Optional[bool]) -> bool:
+        if retrieval_only is not None:
+            return bool(retrieval_only)
+        if self.mode == 'auto':
+            return all(len(request.split()) <= self.auto_retrieval_max_words for request in requests)
+        return self.mode == 'retrieve'
+
+    @staticmethod
+    def _format_retrieved(retrieved: dict[str, list[RetrievedChunk]], missing_file_urls: list[str]) -> str:
+        """Ranked chunks of each document with their scores and offsets in document."""
+        sections = []
+        for file_url, chunks in retrieved.items():
+            section = f"DOCUMENT: {file_url}"
+            for rank, chunk in enumerate(chunks, 1):
+                section += f"\n\n[{rank}] score: {chunk.score:.3f}, offset: {chunk.start}-{chunk.end}\n{chunk.text}"
+            sections.append(section)
+        for file_url in missing_file_urls:
+            sections.append(f"DOCUMENT: {file_url}\nError: File content not found.")
+        return "\n\n".join(sections)
+
+    @staticmethod
+    def _as_list(value: Any) -> list[str]:
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return [str(item) for item in value]
+
+    async def _ingest(self, cache_document_key: str, file_url: str, api_key: str) -> Tuple[Any, Any] | None:
+        """
+        Extract document and get its index: by content key from `document_cache` or build it.
+
+        Returns:
+            Tuple of (index, chunks), None if document has no content
+        """
+        #TODO:
+        # 1. Open document text with DialFileContentExtractor by `file_url`
+        # 2. If PDF pages are still parsed then wait for the full document (the rest of pages are parsed in parallel),
+        #    content key must be known before anything is embedded
+        # 3. Create content key from hash of document text (if no text then return None) and get index by content
+        #    key with `_build_index`: index cached in memory or on disk is reused (after restart, for the same file
+        #    under another URL), documents with the same content are indexed once at a time
+        # 4. Set reference from `cache_document_key` to content key
+        document = await self.file_extractor.open_text(file_url, api_key)
+        if isinstance(document, LazyPdfDocument):
+            document = await document.complete()
+        if not document.text:
+            return None
+        content_key = await asyncio.to_thread(self._content_key, document.text)
+        cached_data = await self._index_builds.do(content_key, lambda: self._build_index(content_key, document))
+        self.document_cache.set_reference(cache_document_key, content_key)
+        return cached_data
+
+    async def _build_index(self, content_key: str, document: ExtractedDocument) -> Tuple[Any, Any]:
+        #TODO:
+        # 1. Check `document_cache` by `content_key`, return cached data if present
+        # 2. Index document with `_index_document`
+        # 3. Add to `document_cache` by `content_key` (only fully built index is cached) and return it
+        cached_data = await asyncio.to_thread(self.document_cache.get, content_key)
+        if cached_data is not None:
+            return cached_data
+        index, chunks = await self._index_document(document)
+        await asyncio.to_thread(self.document_cache.set, content_key, index, chunks)
+        return index, chunks
+
+    async def _index_document(self, document: ExtractedDocument) -> Tuple[Any, DocumentChunks]:
+        """
+        Index document as a pipeline: text is read in windows, each window is split into chunks right away, chunks
+        are encoded in batches by `embedding_service` while next windows are split, and embeddings are added to the
+        index as soon as they are encoded.
+
+        Returns:
+            Tuple of (index, chunks)
+        """
+        #TODO:
+        # 1. Read text windows with `document.read`
+        # 2. Split windows with StreamingTextSplitter (chunks keep their start offsets, overlap across windows)
+        # 3. Encode chunks in batches of `embedding_service.max_batch_size` (embeddings of already seen chunks are
+        #    reused), up to `_MAX_BATCHES_IN_FLIGHT` batches are encoded while text is read further
+        # 4. Add embeddings to IndexBuilder in thread: exact (flat) for small documents, HNSW or IVF for large ones
+        #    (more about FAISS indexes https://github.com/facebookresearch/faiss/wiki/Faiss-indexes)
+        # 5. Index has normalized embeddings, similarity is inner product
+        splitter = StreamingTextSplitter(self.text_splitter, _CHUNK_SIZE, _CHUNK_OVERLAP)
+        index_builder = IndexBuilder(self.embedding_dimension, self.index_config)
+        texts: list[str] = []
+        starts: list[int] = []
+        batch: list[str] = []
+        encoding: deque[asyncio.Future] = deque()
+
+        async def add_encoded() -> None:
+            embeddings = await encoding.popleft()
+            await asyncio.to_thread(index_builder.add, embeddings)
+
+        async def add_chunks(chunks: list[Tuple[str, int]], flush: bool = False) -> None:
+            for text, start in chunks:
+                texts.append(text)
+                starts.append(start)
+                batch.append(text)
+                if len(batch) >= self.embedding_service.max_batch_size:
+                    encoding.append(asyncio.ensure_future(self.embedding_service.encode(batch.copy())))
+                    batch.clear()
+            if flush and batch:
+                encoding.append(asyncio.ensure_future(self.embedding_service.encode(batch.copy())))
+                batch.clear()
+            while len(encoding) > (0 if flush else _MAX_BATCHES_IN_FLIGHT):
+                await add_encoded()
+
+        try:
+            offset = 0
+            while window := await document.read(offset, offset + _INGESTION_WINDOW):
+                offset += len(window)
+                await add_chunks(splitter.push(window))
+            await add_chunks(splitter.finish(), flush=True)
+        except BaseException:
+            for future in encoding:
+                future.cancel()
+            raise
+
+        index = await asyncio.to_thread(index_builder.build)
+        return index, DocumentChunks(texts, starts)
+
+    @staticmethod
+    def _content_key(text_content: str) -> str:
+        return f"{_INDEX_VERSION}:{hashlib.sha256(text_content.encode('utf-8')).hexdigest()}"
+
+    def __augmentation(
+            self,
+            requests: list[str],
+            retrieved: dict[str, list[RetrievedChunk]],
+            missing_file_urls: list[str],
+    ) -> str:
         #make prompt augmentation
-        """Combine retrieved chunks with the user's request."""
-        joined_chunks = "\n\n".join(chunks)
-        return f"CONTEXT:\n{joined_chunks}\n---\nREQUEST: {request}"
+        """Combine retrieved chunks of each document with the user's requests."""
+        context = "\n\n".join(
+            f"DOCUMENT: {file_url}\n" + "\n\n".join(chunk.text for chunk in chunks)
+            for file_url, chunks in retrieved.items()
+        )
+        for file_url in missing_file_urls:
+            context += f"\n\nDOCUMENT: {file_url}\nError: File content not found."
+        if len(requests) == 1:
+            return f"CONTEXT:\n{context}\n---\nREQUEST: {requests[0]}"
+        numbered_requests = "\n".join(f"{number}. {request}" for number, request in enumerate(requests, 1))
+        return f"CONTEXT:\n{context}\n---\nREQUESTS:\n{numbered_requests}"
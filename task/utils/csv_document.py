@@ -0,0 +1,88 @@
+import io
+
+import pandas as pd
+
+from task.utils.extracted_document_cache import ExtractedDocument
+
+
+def load_csv_document(file: str | bytes | bytearray) -> 'CsvDocument':
+    """
+    Parse CSV file (path or content). Runs in worker thread, so it must stay module-level.
+
+    Args:
+        file: Path of CSV file or its content
+
+    Returns:
+        CSV document
+    """
+    # One read of the whole file (`low_memory=False`), so column types are inferred from all rows and the frame is
+    # built without intermediate chunk copies
+    with open(file, 'rb') if isinstance(file, str) else io.BytesIO(file) as csv_file:
+        return CsvDocument(pd.read_csv(csv_file, encoding='utf-8', encoding_errors='ignore', low_memory=False))
+
+
+class CsvDocument:
+    """
+    Parsed CSV file that is paginated by rows: each page renders to markdown only rows of its window, so rows are
+    never cut. The first page starts with columns summary.
+    """
+
+    _SAMPLE_ROWS = 20
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+        # Computed once, deep memory usage of large frame is not cheap
+        self._size = int(frame.memory_usage(deep=True).sum())
+        sample = frame.head(self._SAMPLE_ROWS).to_markdown(index=False)
+        sample_lines = sample.splitlines()
+        # Average length of rendered row (without header lines) is used to fit pages to size in characters
+        self._row_length = max(1, (len(sample) - sum(len(line) + 1 for line in sample_lines[:2]))
+                               // max(1, len(sample_lines) - 2))
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint in bytes."""
+        return self._size
+
+    @property
+    def row_count(self) -> int:
+        return len(self.frame)
+
+    def rows_per_page(self, page_size: int) -> int:
+        return max(1, page_size // self._row_length)
+
+    def total_pages(self, page_size: int) -> int:
+        rows_per_page = self.rows_per_page(page_size)
+        return max(1, (self.row_count + rows_per_page - 1) // rows_per_page)
+
+    def read_page(self, page: int, page_size: int) -> str:
+        """
+        Render rows of the page as markdown table.
+
+        Args:
+            page: Page number (from 1)
+            page_size: Approximate page size in characters
+
+        Returns:
+            Markdown table (with columns summary for the 1st page), empty string if page does not exist
+        """
+        rows_per_page = self.rows_per_page(page_size)
+        start_row = (page - 1) * rows_per_page
+        if page < 1 or (start_row >= self.row_count and page > 1):
+            return ''
+        end_row = min(start_row + rows_per_page, self.row_count)
+        rows = self.frame.iloc[start_row:end_row].to_markdown(index=False)
+        if page > 1:
+            return f"**Rows {start_row + 1}-{end_row} of {self.row_count}**\n\n{rows}"
+        return f"{self._summary()}\n\n{rows}"
+
+    def to_extracted_document(self) -> ExtractedDocument:
+        """Render the whole CSV as markdown table."""
+        return ExtractedDocument(text=self.frame.to_markdown(index=False))
+
+    def _summary(self) -> str:
+        columns = pd.DataFrame({"column": self.frame.columns, "dtype": [str(dtype) for dtype in self.frame.dtypes]})
+        return (
+            f"**Rows**: {self.row_count}, **Columns**: {len(self.frame.columns)}\n\n"
+            f"{columns.to_markdown(index=False)}"
+        )
@@ -0,0 +1,82 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+from aidial_client import AsyncDial, AsyncDialClientPool
+
+
+@dataclass
+class _EndpointPool:
+    async_client_pool: Optional[AsyncDialClientPool] = field(default=None)
+    async_http_client: Optional[httpx.AsyncClient] = field(default=None)
+
+
+class DialClientRegistry:
+    """
+    Registry of long-lived DIAL connection pools keyed by endpoint.
+    Clients are cheap wrappers around shared keep-alive pool, per-request `api_key` is applied per client. API version
+    is passed with each chat completion request.
+    """
+
+    def __init__(
+            self,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            keepalive_expiry: float = 30.0,
+            timeout: httpx.Timeout = httpx.Timeout(timeout=600.0, connect=5.0),
+    ):
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._timeout = timeout
+        self._pools: dict[str, _EndpointPool] = {}
+        self._lock = threading.Lock()
+
+    def async_client(self, endpoint: str, api_key: str) -> AsyncDial:
+        """
+        Create AsyncDial client on top of shared connection pool.
+
+        Args:
+            endpoint: DIAL Core endpoint
+            api_key: Per-request API key
+
+        Returns:
+            AsyncDial client
+        """
+        pool = self._get_pool(endpoint)
+        with self._lock:
+            if pool.async_client_pool is None:
+                pool.async_client_pool = AsyncDialClientPool(connection_limits=self._limits)
+        return pool.async_client_pool.create_client(base_url=endpoint, api_key=api_key, timeout=self._timeout)
+
+    def async_http_client(self, endpoint: str) -> httpx.AsyncClient:
+        """Shared async connection pool for requests that are not covered by AsyncDial (e.g. streaming downloads)."""
+        pool = self._get_pool(endpoint)
+        with self._lock:
+            if pool.async_http_client is None:
+                pool.async_http_client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout)
+            return pool.async_http_client
+
+    async def close(self) -> None:
+        """Close connection pools of DIAL clients and downloads."""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            if pool.async_client_pool is not None:
+                # AsyncDialClientPool has no close method, its clients share this HTTP client
+                await pool.async_client_pool._internal_http_client.aclose()
+            if pool.async_http_client is not None:
+                await pool.async_http_client.aclose()
+        print(f"[DialClientRegistry] Closed {len(pools)} connection pools")
+
+    def _get_pool(self, endpoint: str) -> _EndpointPool:
+        with self._lock:
+            pool = self._pools.get(endpoint)
+            if pool is None:
+                pool = _EndpointPool()
+                self._pools[endpoint] = pool
+            return pool
@@ -1,73 +1,287 @@
+import asyncio
 import io
-from pathlib import Path
+from typing import BinaryIO, Optional
 
 import pdfplumber
 import pandas as pd
-from aidial_client import Dial
 from bs4 import BeautifulSoup
 
+from task.utils.csv_document import CsvDocument, load_csv_document
+from task.utils.dial_clients import DialClientRegistry
+from task.utils.downloaded_file import DownloadedFile
+from task.utils.extracted_document_cache import ExtractedDocument, ExtractedDocumentCache
+from task.utils.extraction_pool import ExtractionPool
+from task.utils.lazy_pdf_document import LazyPdfDocument
+from task.utils.pdf_extraction import (
+    build_pdf_document,
+    count_pdf_pages,
+    extract_pdf_document,
+    remove_temp_pdf,
+)
+
 
 class DialFileContentExtractor:
+    """
+    Downloads files from DIAL bucket and extracts their text. It is long-lived and shared between tools, so parsed
+    documents are cached by file URL and content fingerprint (ETag or hash) for all of them.
+    """
 
-    def __init__(self, endpoint: str, api_key: str):
+    def __init__(
+            self,
+            endpoint: str,
+            client_registry: DialClientRegistry,
+            extraction_pool: ExtractionPool,
+            document_cache: ExtractedDocumentCache,
+            csv_cache: Optional[ExtractedDocumentCache] = None,
+            lazy_pdf: bool = True,
+            pdf_pages_per_batch: int = 4,
+            pdf_parallel_min_pages: int = 32,
+            pdf_pages_per_task: int = 16,
+            max_file_size: int = 100 * 1024 * 1024,
+            spool_threshold: int = 8 * 1024 * 1024,
+    ):
         #TODO:
-        # Set Dial client with endpoint as base_url and api_key
-        self.dial_client = Dial(base_url=endpoint, api_key=api_key)
+        # Set endpoint, client_registry (shared DIAL connection pools), extraction_pool (workers for parsing) and
+        # document_cache (already parsed documents)
+        self.endpoint = endpoint
+        self.client_registry = client_registry
+        self.extraction_pool = extraction_pool
+        self.document_cache = document_cache
+        # Parsed CSV frames have their own budget, so large exports are parsed once for all their pages
+        self.csv_cache = csv_cache or document_cache
+        # PDF pages can be parsed on demand, see `open_document`
+        self.lazy_pdf = lazy_pdf
+        self.pdf_pages_per_batch = pdf_pages_per_batch
+        # Large PDFs are split into page ranges that are parsed in parallel by worker processes
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        self.pdf_pages_per_task = pdf_pages_per_task
+        # Downloads over `max_file_size` are rejected, ones over `spool_threshold` are spilled to temporary file
+        self.max_file_size = max_file_size
+        self.spool_threshold = spool_threshold
 
-    def extract_text(self, file_url: str) -> str:
-        #TODO:
-        # 1. Download with Dial client file by `file_url` (files -> download)
-        # 2. Get downloaded file name and content
-        # 3. Get file extension, use for this `Path(filename).suffix.lower()`
-        # 4. Call `__extract_text` and return its result
-        download_response = self.dial_client.files.download(file_url)
-        filename = download_response.filename
-        file_content = download_response.get_content()
-        file_extension = Path(filename).suffix.lower()
-        return self.__extract_text(file_content, file_extension, filename)
-
-    def __extract_text(self, file_content: bytes, file_extension: str, filename: str) -> str:
-        """Extract text content based on file type."""
+    async def open_text(self, file_url: str, api_key: str) -> ExtractedDocument | LazyPdfDocument:
+        """
+        Open document text for sequential reading with `read(start, end)`. PDF pages are always parsed on demand
+        (the rest of them in background, large PDFs by several page ranges in parallel), so reader can process first
+        pages while next ones are parsed.
+        """
+        document = await self._load_document(file_url, api_key, lazy=True)
+        if isinstance(document, CsvDocument):
+            return await self.extraction_pool.run('.csv', document.to_extracted_document)
+        return document
+
+    async def open_document(
+            self,
+            file_url: str,
+            api_key: str,
+    ) -> ExtractedDocument | LazyPdfDocument | CsvDocument:
+        """
+        Open document for windowed reading (`read(start, end)`, CSV by rows with `read_page(page, page_size)`). If
+        lazy mode is on then PDF pages are parsed on demand, only pages that cover requested window, and the rest of
+        them in background.
+        """
+        return await self._load_document(file_url, api_key, lazy=self.lazy_pdf)
+
+    async def _load_document(
+            self,
+            file_url: str,
+            api_key: str,
+            lazy: bool,
+    ) -> ExtractedDocument | LazyPdfDocument | CsvDocument:
         #TODO:
-        # Wrap in `try-except` block:
+        # 1. Get file ETag from metadata (it is authorized with user `api_key`) and check `document_cache`
+        # 2. Otherwise download file by `file_url` (streamed to memory or temporary file, size is limited)
+        # 3. Get file extension, use for this `Path(filename).suffix.lower()` (see `DownloadedFile.extension`)
+        # 4. Parse content with `extract_text_from_content` in `extraction_pool` (PDF with `extract_pdf_document`
+        #    or lazily), add to `document_cache` and return it
+        etag = await self._get_etag(file_url, api_key)
+        if etag and (document := self._get_cached(file_url, etag)) is not None:
+            return document
+
+        downloaded_file = await self._download(file_url, api_key)
+        try:
+            fingerprint = etag or downloaded_file.etag or downloaded_file.sha256
+            if fingerprint != etag and (document := self._get_cached(file_url, fingerprint)) is not None:
+                return document
+            return await self._parse(file_url, fingerprint, downloaded_file, lazy)
+        finally:
+            downloaded_file.close()
+
+    async def _parse(
+            self,
+            file_url: str,
+            fingerprint: str,
+            downloaded_file: DownloadedFile,
+            lazy: bool,
+    ) -> ExtractedDocument | LazyPdfDocument | CsvDocument:
+        file_extension = downloaded_file.extension
+        if file_extension == '.pdf':
+            # Workers memory-map the same temporary file instead of receiving PDF bytes with each task
+            path = await asyncio.to_thread(downloaded_file.take_file)
+            if lazy:
+                return await self._open_lazy_pdf(file_url, fingerprint, path)
+            try:
+                document = await extract_pdf_document(
+                    path,
+                    self.extraction_pool,
+                    parallel_min_pages=self.pdf_parallel_min_pages,
+                    pages_per_task=self.pdf_pages_per_task,
+                )
+            except Exception as e:
+                print(f"Error extracting text from file: {e}")
+                document = ExtractedDocument(text="")
+            finally:
+                remove_temp_pdf(path)
+        elif file_extension == '.csv':
+            # Parsed frame is cached, pages render only their rows
+            try:
+                document = await self.extraction_pool.run(
+                    file_extension, load_csv_document, downloaded_file.path or downloaded_file.take_content()
+                )
+            except Exception as e:
+                print(f"Error extracting text from file: {e}")
+                return ExtractedDocument(text="")
+            self.csv_cache.set(file_url, fingerprint, document)
+            return document
+        elif downloaded_file.path is not None:
+            document = await self.extraction_pool.run(
+                file_extension, extract_text_from_file, downloaded_file.path, file_extension
+            )
+        else:
+            document = await self.extraction_pool.run(
+                file_extension, extract_text_from_content, downloaded_file.take_content(), file_extension
+            )
+        if document.text:
+            self.document_cache.set(file_url, fingerprint, document)
+        return document
+
+    async def _open_lazy_pdf(self, file_url: str, fingerprint: str, path: str) -> LazyPdfDocument:
+        try:
+            page_count = await self.extraction_pool.run('.pdf', count_pdf_pages, path)
+        except BaseException:
+            remove_temp_pdf(path)
+            raise
+        lazy_document = LazyPdfDocument(
+            path=path,
+            page_count=page_count,
+            extraction_pool=self.extraction_pool,
+            pages_per_batch=self.pdf_pages_per_batch,
+            parallel_min_pages=self.pdf_parallel_min_pages,
+            pages_per_task=self.pdf_pages_per_task,
+            parallel_tasks=max(self.extraction_pool.process_workers, 1),
+            # Replace lazy document with fully parsed one, it frees temporary file and fixes cache size accounting
+            on_complete=lambda completed: self.document_cache.set(file_url, fingerprint, completed),
+            # Failed document would re-raise on each read, next request downloads and parses file again
+            on_error=lambda failed, _: self.document_cache.remove(file_url, fingerprint, failed),
+        )
+        self.document_cache.set(file_url, fingerprint, lazy_document)
+        return lazy_document
+
+    def _get_cached(
+            self,
+            file_url: str,
+            fingerprint: str,
+    ) -> ExtractedDocument | LazyPdfDocument | CsvDocument | None:
+        document = self.document_cache.get(file_url, fingerprint)
+        if document is None and self.csv_cache is not self.document_cache:
+            document = self.csv_cache.get(file_url, fingerprint)
+        return document
+
+    async def _get_etag(self, file_url: str, api_key: str) -> Optional[str]:
+        dial_client = self.client_registry.async_client(endpoint=self.endpoint, api_key=api_key)
         try:
-        #   1. if `file_extension` is '.txt' then return `file_content.decode('utf-8', errors='ignore')`
-            if file_extension == '.txt':
-                return file_content.decode('utf-8', errors='ignore')
-        #   2. if `file_extension` is '.pdf' then:
-        #       - load it with `io.BytesIO(file_content)`
-        #       - with pdfplumber.open PDF files bites
-        #       - iterate through created pages adn create array with extracted page text
-        #       - return it joined with `\n`
-            elif file_extension == '.pdf':
-                pdf_file = io.BytesIO(file_content)
-                with pdfplumber.open(pdf_file) as pdf:
-                    pages_text = [page.extract_text() for page in pdf.pages]
-                    return '\n'.join(pages_text)
-        #   3. if `file_extension` is '.csv' then:
-        #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
-        #       - create csv buffer from `io.StringIO(decoded_text_content)`
-        #       - read csv with pandas (pd) as dataframe
-        #       - return dataframe to markdown (index=False)
-            elif file_extension == '.csv':
-                decoded_text_content = file_content.decode('utf-8', errors='ignore')
-                csv_buffer = io.StringIO(decoded_text_content)
-                df = pd.read_csv(csv_buffer)
-                return df.to_markdown(index=False)
-        #   4. if `file_extension` is in ['.html', '.htm'] then:
-        #       - decode `file_content` with encoding 'utf-8' and errors='ignore'
-        #       - create BeautifulSoup with decoded html content, features set as 'html.parser' as `soup`
-        #       - remove script and style elements: iterate through `soup(["script", "style"])` and `decompose` those scripts
-        #       - return `soup.get_text(separator='\n', strip=True)`
-            elif file_extension in ['.html', '.htm']:
-                decoded_html_content = file_content.decode('utf-8', errors='ignore')
-                soup = BeautifulSoup(decoded_html_content, features='html.parser')
-                for script in soup(["script", "style"]):
-                    script.decompose()
-                return soup.get_text(separator='\n', strip=True)
-        #   5. otherwise return it as decoded `file_content` with encoding 'utf-8' and errors='ignore'
-            else:
-                return file_content.decode('utf-8', errors='ignore')    
+            metadata = await dial_client.files.get_metadata(file_url)
         except Exception as e:
-            print(f"Error extracting text from file: {e}")
-            return ""
+            print(f"Unable to get file metadata, file will be downloaded: {e}")
+            return None
+        return metadata.etag
+
+    async def _download(self, file_url: str, api_key: str) -> DownloadedFile:
+        dial_client = self.client_registry.async_client(endpoint=self.endpoint, api_key=api_key)
+        storage_resource = dial_client.files.get_storage_resource(file_url)
+        if storage_resource.filename is None:
+            raise ValueError(f"URL points to a directory, not a file: {file_url}")
+
+        downloaded_file = DownloadedFile(
+            filename=storage_resource.filename,
+            max_size=self.max_file_size,
+            spool_threshold=self.spool_threshold,
+        )
+        http_client = self.client_registry.async_http_client(self.endpoint)
+        try:
+            async with http_client.stream(
+                    "GET",
+                    storage_resource.absolute_url,
+                    headers={"api-key": api_key},
+            ) as response:
+                response.raise_for_status()
+                # Reject oversized file before downloading it
+                if (content_length := response.headers.get("content-length")) is not None:
+                    downloaded_file.check_size(int(content_length))
+                async for chunk in response.aiter_bytes():
+                    downloaded_file.write(chunk)
+                downloaded_file.etag = response.headers.get("etag")
+            downloaded_file.finish()
+        except BaseException:
+            downloaded_file.close()
+            raise
+        return downloaded_file
+
+
+def extract_text_from_content(file_content: bytes | bytearray, file_extension: str) -> ExtractedDocument:
+    """Extract text from file content. Runs in worker thread/process, so it must stay module-level."""
+    return _extract_text(io.BytesIO(file_content), file_extension)
+
+
+def extract_text_from_file(path: str, file_extension: str) -> ExtractedDocument:
+    """Extract text from file, it is read as stream. Runs in worker thread/process, so it must stay module-level."""
+    try:
+        with open(path, 'rb') as file:
+            return _extract_text(file, file_extension)
+    except OSError as e:
+        print(f"Error extracting text from file: {e}")
+        return ExtractedDocument(text="")
+
+
+def _extract_text(file: BinaryIO, file_extension: str) -> ExtractedDocument:
+    """Extract text content based on file type, parsers read binary `file` stream instead of its full decoded copy."""
+    #TODO:
+    # Wrap in `try-except` block:
+    try:
+    #   1. if `file_extension` is '.txt' then return `file` read as text with encoding 'utf-8' and errors='ignore'
+        if file_extension == '.txt':
+            return ExtractedDocument(text=_text_stream(file).read())
+    #   2. if `file_extension` is '.pdf' then:
+    #       - with pdfplumber.open PDF `file`
+    #       - iterate through created pages adn create array with extracted page text
+    #       - return it joined with `\n` together with start offset of each page
+        elif file_extension == '.pdf':
+            with pdfplumber.open(file) as pdf:
+                pages_text = [page.extract_text() or '' for page in pdf.pages]
+            return build_pdf_document(pages_text)
+    #   3. if `file_extension` is '.csv' then:
+    #       - read csv from `file` with pandas (pd) as dataframe, encoding 'utf-8' and encoding_errors='ignore'
+    #       - return dataframe to markdown (index=False)
+        elif file_extension == '.csv':
+            df = pd.read_csv(file, encoding='utf-8', encoding_errors='ignore')
+            return ExtractedDocument(text=df.to_markdown(index=False))
+    #   4. if `file_extension` is in ['.html', '.htm'] then:
+    #       - create BeautifulSoup with `file` read as text (encoding 'utf-8' and errors='ignore'), features set as
+    #         'html.parser' as `soup`
+    #       - remove script and style elements: iterate through `soup(["script", "style"])` and `decompose` those scripts
+    #       - return `soup.get_text(separator='\n', strip=True)`
+        elif file_extension in ['.html', '.htm']:
+            soup = BeautifulSoup(_text_stream(file), features='html.parser')
+            for script in soup(["script", "style"]):
+                script.decompose()
+            return ExtractedDocument(text=soup.get_text(separator='\n', strip=True))
+    #   5. otherwise return `file` read as text with encoding 'utf-8' and errors='ignore'
+        else:
+            return ExtractedDocument(text=_text_stream(file).read())
+    except Exception as e:
+        print(f"Error extracting text from file: {e}")
+        return ExtractedDocument(text="")
+
+
+def _text_stream(file: BinaryIO) -> io.TextIOWrapper:
+    return io.TextIOWrapper(file, encoding='utf-8', errors='ignore')
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class DownloadedFile:
+    """
+    Content of downloading file. It is kept in memory until it grows over `spool_threshold` bytes, then it is spilled
+    to a named temporary file, so worker processes can open (memory-map) it by path. Size is checked on each chunk,
+    so oversized files are rejected before they are fully downloaded.
+    """
+
+    def __init__(self, filename: str, max_size: int, spool_threshold: int):
+        self.filename = filename
+        self.extension = Path(filename).suffix.lower()
+        self.etag: Optional[str] = None
+        self.size = 0
+        self._max_size = max_size
+        self._spool_threshold = spool_threshold
+        self._buffer: Optional[bytearray] = bytearray()
+        self._file = None
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def path(self) -> Optional[str]:
+        """Path of temporary file, None while content is in memory."""
+        return self._file.name if self._file is not None else None
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def check_size(self, size: int) -> None:
+        """Raises ValueError if `size` (e.g. Content-Length) is over the limit."""
+        if size > self._max_size:
+            raise ValueError(
+                f"File {self.filename} is too large: {size} bytes, max allowed size is {self._max_size} bytes"
+            )
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self.check_size(self.size)
+        self._sha256.update(chunk)
+        if self._file is None and self.size > self._spool_threshold:
+            self._file = tempfile.NamedTemporaryFile(suffix=self.extension, delete=False)
+            self._file.write(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.extend(chunk)
+
+    def finish(self) -> None:
+        """Flush content to temporary file (if it is spilled), must be called when download is finished."""
+        if self._file is not None:
+            self._file.close()
+
+    def take_file(self) -> str:
+        """
+        Get path of temporary file with content, content is spilled to it if it is still in memory. Caller takes
+        ownership of the file and removes it.
+        """
+        if self._file is None:
+            self._file = tempfile.NamedTemporaryFile(suffix=self.extension, delete=False)
+            self._file.write(self._buffer)
+            self._buffer = None
+        self._file.close()
+        path = self._file.name
+        self._file = None
+        self._buffer = bytearray()
+        return path
+
+    def take_content(self) -> Optional[bytearray]:
+        """
+        Get in-memory content without copying it, None when it is spilled to temporary file. Caller takes ownership
+        of the buffer, downloaded file doesn't keep it anymore.
+        """
+        if self._file is not None:
+            return None
+        content, self._buffer = self._buffer, bytearray()
+        return content
+
+    def close(self) -> None:
+        """Release content, temporary file is removed."""
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except OSError as e:
+                print(f"Unable to remove temporary file {self._file.name}: {e}")
+            self._file = None
@@ -0,0 +1,141 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Protocol, Tuple
+
+
+@dataclass
+class ExtractedDocument:
+    """
+    Extracted text of the file.
+
+    Args:
+        text: Full extracted text
+        page_offsets: Start offset in `text` of each source page (PDF pages), `[0]` for formats without pages
+    """
+    text: str
+    page_offsets: list[int] = field(default_factory=lambda: [0])
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint in bytes."""
+        return sys.getsizeof(self.text) + sys.getsizeof(self.page_offsets) + 8 * len(self.page_offsets)
+
+    def length_hint(self) -> tuple[int, bool]:
+        """Returns tuple of (text length, is_exact), the same as for lazily parsed documents."""
+        return len(self.text), True
+
+    async def read(self, start: int, end: int) -> str:
+        """Get text in [start, end) window, the same as for lazily parsed documents."""
+        return self.text[start:end]
+
+
+class _CachedDocument(Protocol):
+    @property
+    def size(self) -> int: ...
+
+
+class ExtractedDocumentCache:
+    """
+    Thread-safe LRU cache of extracted documents keyed by file URL and content fingerprint (ETag or hash).
+    Bounded by total size of cached documents, entries expire after `ttl_seconds`. Size of each document is taken
+    once on insert (lazily parsed documents change their size later, they are replaced with complete documents).
+    Documents larger than the whole budget are not cached, unless `keep_oversized` is set: then such document evicts
+    all others and stays the only cached one.
+    """
+
+    def __init__(
+            self,
+            max_size_bytes: int = 256 * 1024 * 1024,
+            ttl_seconds: float = 3600,
+            keep_oversized: bool = False,
+    ):
+        # key -> (document, insert time, size accounted on insert)
+        self._cache: OrderedDict[Tuple[str, str], Tuple[_CachedDocument, float, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_size_bytes = max_size_bytes
+        self._ttl_seconds = ttl_seconds
+        self._keep_oversized = keep_oversized
+        self._size_bytes = 0
+
+    def get(self, file_url: str, fingerprint: str) -> _CachedDocument | None:
+        """
+        Retrieve a cached document.
+
+        Args:
+            file_url: File URL
+            fingerprint: File content fingerprint (ETag or hash)
+
+        Returns:
+            Document (ExtractedDocument or LazyPdfDocument) if found and not expired, None otherwise
+        """
+        key = (file_url, fingerprint)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            document, timestamp, _ = entry
+            if time.monotonic() - timestamp >= self._ttl_seconds:
+                self._remove(key)
+                return None
+            self._cache.move_to_end(key)
+            return document
+
+    def set(self, file_url: str, fingerprint: str, document: _CachedDocument) -> None:
+        """
+        Store a document in the cache, least recently used documents are evicted when cache is over its size.
+
+        Args:
+            file_url: File URL
+            fingerprint: File content fingerprint (ETag or hash)
+            document: Extracted document (ExtractedDocument or LazyPdfDocument)
+        """
+        document_size = document.size
+        if document_size > self._max_size_bytes and not self._keep_oversized:
+            return
+        key = (file_url, fingerprint)
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            self._cache[key] = (document, time.monotonic(), document_size)
+            self._size_bytes += document_size
+            # The new document itself is never evicted here
+            while self._size_bytes > self._max_size_bytes and len(self._cache) > 1:
+                self._remove(next(iter(self._cache)))
+
+    def remove(self, file_url: str, fingerprint: str, document: Optional[_CachedDocument] = None) -> None:
+        """
+        Remove cached document.
+
+        Args:
+            file_url: File URL
+            fingerprint: File content fingerprint (ETag or hash)
+            document: If present, entry is removed only if it is still this document
+        """
+        key = (file_url, fingerprint)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and (document is None or entry[0] is document):
+                self._remove(key)
+
+    def clear(self) -> None:
+        """Clear all cached documents."""
+        with self._lock:
+            self._cache.clear()
+            self._size_bytes = 0
+
+    def size(self) -> int:
+        """Return the number of cached documents."""
+        with self._lock:
+            return len(self._cache)
+
+    def size_bytes(self) -> int:
+        """Return approximate memory footprint of cached documents."""
+        with self._lock:
+            return self._size_bytes
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        _, _, document_size = self._cache.pop(key)
+        self._size_bytes -= document_size
@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+
+@dataclass
+class ExtractionPoolStats:
+    """Queue-depth and throughput counters of ExtractionPool."""
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    max_queue_depth: int = 0
+
+
+class ExtractionPool:
+    """
+    Bounded worker pools for CPU-bound file parsing, so parsing doesn't block the event loop.
+    Pure-python parsers (pdfplumber, BeautifulSoup) hold the GIL and run in processes, others run in threads.
+    """
+
+    PROCESS_EXTENSIONS = frozenset({'.pdf', '.html', '.htm'})
+
+    def __init__(self, thread_workers: int = 4, process_workers: int = 2):
+        """
+        Args:
+            thread_workers: Max number of parsing tasks that run in threads at the same time
+            process_workers: Max number of parsing tasks that run in processes at the same time. If 0 then
+                all formats are parsed in threads
+        """
+        self.process_workers = process_workers
+        self._thread_executor = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="Extraction")
+        self._thread_slots = asyncio.Semaphore(thread_workers)
+        self._process_executor: Optional[ProcessPoolExecutor] = None
+        self._process_slots: Optional[asyncio.Semaphore] = None
+        if process_workers > 0:
+            # `spawn` since the app process already runs threads (fork is not safe with them)
+            self._process_executor = ProcessPoolExecutor(
+                max_workers=process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+            )
+            self._process_slots = asyncio.Semaphore(process_workers)
+        self.stats = ExtractionPoolStats()
+
+    async def run(self, file_extension: str, func: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run parsing function in the worker pool that suits file format.
+
+        Args:
+            file_extension: File extension, e.g. '.pdf'
+            func: Module-level (picklable) parsing function
+            *args: Function arguments
+
+        Returns:
+            Function result
+        """
+        executor, slots = self._select(file_extension)
+        waiting = slots.locked()
+        if waiting:
+            self.stats.queued += 1
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queued)
+        async with slots:
+            if waiting:
+                self.stats.queued -= 1
+            self.stats.running += 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+            except Exception:
+                self.stats.failed += 1
+                raise
+            finally:
+                self.stats.running -= 1
+            self.stats.completed += 1
+            return result
+
+    def shutdown(self) -> None:
+        """Stop worker pools."""
+        self._thread_executor.shutdown(wait=False, cancel_futures=True)
+        if self._process_executor is not None:
+            self._process_executor.shutdown(wait=False, cancel_futures=True)
+        print(f"[ExtractionPool] Stopped worker pools. Stats: {self.stats}")
+
+    def _select(self, file_extension: str) -> tuple[Executor, asyncio.Semaphore]:
+        if self._process_executor is not None and file_extension in self.PROCESS_EXTENSIONS:
+            return self._process_executor, self._process_slots
+        return self._thread_executor, self._thread_slots
+
+
+def _init_process_worker() -> None:
+    """Import parsers once when worker process starts, not with its first task."""
+    import bs4  # noqa: F401
+    import task.utils.pdf_extraction  # noqa: F401
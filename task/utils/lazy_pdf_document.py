@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import os
+import sys
+import weakref
+from typing import Callable, Optional
+
+from task.utils.extracted_document_cache import ExtractedDocument
+from task.utils.extraction_pool import ExtractionPool
+from task.utils.pdf_extraction import extract_pdf_pages, remove_temp_pdf
+
+
+class LazyPdfDocument:
+    """
+    PDF document that parses pages on demand. Pages are joined with `\\n` (the same as full extraction) and running
+    character offsets of parsed pages let a requested text window parse only pages that cover it. After the first
+    read the rest of pages are parsed in background, once all of them are parsed `on_complete` receives the full
+    ExtractedDocument. Documents with at least `parallel_min_pages` pages are parsed in background by `parallel_tasks`
+    ranges of `pages_per_task` pages at once (by worker processes). Temporary PDF file is removed once all pages are
+    parsed. If parsing fails `on_error` receives the document and exception, document can't be read anymore.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            page_count: int,
+            extraction_pool: ExtractionPool,
+            pages_per_batch: int = 4,
+            parallel_min_pages: int = 32,
+            pages_per_task: int = 16,
+            parallel_tasks: int = 2,
+            on_complete: Optional[Callable[[ExtractedDocument], None]] = None,
+            on_error: Optional[Callable[['LazyPdfDocument', Exception], None]] = None,
+    ):
+        self._path = path
+        self._file_size = os.path.getsize(path)
+        self._remove_file = weakref.finalize(self, remove_temp_pdf, path)
+        self.page_count = page_count
+        self._extraction_pool = extraction_pool
+        self._pages_per_batch = pages_per_batch
+        self._parallel_min_pages = parallel_min_pages
+        self._pages_per_task = pages_per_task
+        self._parallel_tasks = parallel_tasks
+        self._on_complete = on_complete
+        self._on_error = on_error
+        self._pages: list[str] = []
+        self._page_offsets: list[int] = []
+        self._lock = asyncio.Lock()
+        self._background_task: Optional[asyncio.Task] = None
+        self._document: Optional[ExtractedDocument] = None
+        self._error: Optional[Exception] = None
+
+    @property
+    def size(self) -> int:
+        """Approximate memory footprint in bytes."""
+        file_size = self._file_size if self._remove_file.alive else 0
+        return file_size + sum(sys.getsizeof(page) for page in self._pages)
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self._pages) >= self.page_count
+
+    def length_hint(self) -> tuple[int, bool]:
+        """
+        Returns:
+            Tuple of (text length, is_exact). While document is not fully parsed length is estimated by average
+            length of parsed pages
+        """
+        if self.is_complete or not self._pages:
+            return self._length, self.is_complete
+        return self._length * self.page_count // len(self._pages), False
+
+    async def read(self, start: int, end: int) -> str:
+        """
+        Get text in [start, end) window, parses only pages that are needed to cover it.
+
+        Args:
+            start: Start character offset
+            end: End character offset
+
+        Returns:
+            Text of the window (shorter or empty if document ends before)
+        """
+        async with self._lock:
+            while self._length < end and not self.is_complete:
+                await self._parse_next_batch()
+        self._start_background_parsing()
+
+        if not self._pages or start >= self._length:
+            return ''
+        first_page = bisect.bisect_right(self._page_offsets, start) - 1
+        last_page = bisect.bisect_left(self._page_offsets, end)
+        window_offset = self._page_offsets[first_page]
+        window_text = '\n'.join(self._pages[first_page:last_page])
+        return window_text[start - window_offset:end - window_offset]
+
+    async def complete(self) -> ExtractedDocument:
+        """Wait until all pages are parsed and return full document."""
+        self._start_background_parsing()
+        await asyncio.shield(self._background_task)
+        if self._error is not None:
+            raise self._error
+        return self._document
+
+    @property
+    def _length(self) -> int:
+        if not self._pages:
+            return 0
+        return self._page_offsets[-1] + len(self._pages[-1])
+
+    async def _parse_next_batch(self) -> None:
+        start_page = len(self._pages)
+        end_page = min(start_page + self._pages_per_batch, self.page_count)
+        pages = await self._extraction_pool.run(
+            '.pdf', extract_pdf_pages, self._path, start_page, end_page
+        )
+        self._append_pages(pages)
+
+    async def _parse_next_ranges(self) -> None:
+        """Parse next `parallel_tasks` ranges of pages at once, pages are appended in order."""
+        start_page = len(self._pages)
+        ranges = [
+            (range_start, min(range_start + self._pages_per_task, self.page_count))
+            for range_start in range(start_page, self.page_count, self._pages_per_task)
+        ][:self._parallel_tasks]
+        ranges_pages = await asyncio.gather(*(
+            self._extraction_pool.run('.pdf', extract_pdf_pages, self._path, range_start, range_end)
+            for range_start, range_end in ranges
+        ))
+        for pages in ranges_pages:
+            self._append_pages(pages)
+
+    def _append_pages(self, pages: list[str]) -> None:
+        for page_text in pages:
+            self._page_offsets.append(self._length + 1 if self._pages else 0)
+            self._pages.append(page_text)
+
+    def _start_background_parsing(self) -> None:
+        if self._background_task is None:
+            self._background_task = asyncio.create_task(self._parse_remaining_pages())
+
+    async def _parse_remaining_pages(self) -> None:
+        try:
+            while not self.is_complete:
+                async with self._lock:
+                    if self.is_complete:
+                        break
+                    if self.page_count >= self._parallel_min_pages:
+                        await self._parse_next_ranges()
+                    else:
+                        await self._parse_next_batch()
+        except Exception as e:
+            print(f"Error extracting text from PDF pages: {e}")
+            self._error = e
+            self._remove_file()
+            if self._on_error is not None:
+                self._on_error(self, e)
+            return
+
+        self._document = ExtractedDocument(text='\n'.join(self._pages), page_offsets=self._page_offsets or [0])
+        # File is not needed anymore, all pages are parsed
+        self._remove_file()
+        if self._on_complete is not None:
+            self._on_complete(self._document)
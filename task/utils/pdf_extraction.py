@@ -0,0 +1,89 @@
+import asyncio
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import pdfplumber
+
+from task.utils.extracted_document_cache import ExtractedDocument
+from task.utils.extraction_pool import ExtractionPool
+
+# Functions below run in worker processes, so they must stay module-level. Workers memory-map the same file instead
+# of receiving a pickled copy of PDF bytes with each task.
+
+
+@contextmanager
+def _open_pdf(path: str, pages: Optional[list[int]] = None) -> Iterator[pdfplumber.PDF]:
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        with pdfplumber.open(mapped_file, pages=pages) as pdf:
+            yield pdf
+
+
+def count_pdf_pages(path: str) -> int:
+    """Return number of pages in PDF file."""
+    with _open_pdf(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_pdf_pages(path: str, start_page: int, end_page: int) -> list[str]:
+    """Extract text of PDF file pages in [start_page, end_page)."""
+    # pdfplumber page numbers are 1-based, only requested pages are loaded
+    with _open_pdf(path, pages=list(range(start_page + 1, end_page + 1))) as pdf:
+        return [page.extract_text() or '' for page in pdf.pages]
+
+
+def write_temp_pdf(file_content: bytes) -> str:
+    """Write PDF content to temporary file that can be shared with worker processes. Caller removes it."""
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as file:
+        file.write(file_content)
+        return file.name
+
+
+def remove_temp_pdf(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError as e:
+        print(f"Unable to remove temporary PDF file {path}: {e}")
+
+
+def build_pdf_document(pages_text: list[str]) -> ExtractedDocument:
+    """Join pages with `\\n` and calculate start offset of each page."""
+    page_offsets = []
+    offset = 0
+    for page_text in pages_text:
+        page_offsets.append(offset)
+        offset += len(page_text) + 1
+    return ExtractedDocument(text='\n'.join(pages_text), page_offsets=page_offsets or [0])
+
+
+async def extract_pdf_document(
+        path: str,
+        extraction_pool: ExtractionPool,
+        parallel_min_pages: int = 32,
+        pages_per_task: int = 16,
+) -> ExtractedDocument:
+    """
+    Extract full PDF document. PDFs with at least `parallel_min_pages` pages are split into page ranges that are
+    parsed in parallel by worker processes and reassembled in order, smaller ones are parsed by one worker.
+
+    Args:
+        path: Path to PDF file (see `write_temp_pdf`)
+        extraction_pool: Worker pools
+        parallel_min_pages: Page count threshold for parallel parsing
+        pages_per_task: Number of pages parsed by one worker task
+
+    Returns:
+        Extracted document
+    """
+    page_count = await extraction_pool.run('.pdf', count_pdf_pages, path)
+    if page_count < parallel_min_pages:
+        pages_text = await extraction_pool.run('.pdf', extract_pdf_pages, path, 0, page_count)
+        return build_pdf_document(pages_text)
+
+    ranges_text = await asyncio.gather(*(
+        extraction_pool.run('.pdf', extract_pdf_pages, path, start_page, min(start_page + pages_per_task, page_count))
+        for start_page in range(0, page_count, pages_per_task)
+    ))
+    return build_pdf_document([page_text for range_text in ranges_text for page_text in range_text])
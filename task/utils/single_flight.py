@@ -0,0 +1,41 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):
+    """
+    Deduplicates concurrent calls by key: the first caller starts the call and concurrent callers with the same key
+    await its result (or exception). Key is released once the call is finished, so next calls start a new one.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Args:
+            key: Call key
+            func: Function that starts the call, it is called only if there is no call in flight with the same key
+
+        Returns:
+            Result of the call
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda finished: self._finish(key, finished))
+        # Cancellation of one caller doesn't cancel the call for others
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark exception as retrieved, callers could be cancelled and not await it
+        if not task.cancelled():
+            task.exception()
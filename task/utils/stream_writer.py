@@ -0,0 +1,92 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional, Protocol
+
+
+class _ContentTarget(Protocol):
+    def append_content(self, content: str) -> None: ...
+
+
+@dataclass
+class StreamWriterStats:
+    """Counters shared by all writers created with the same config."""
+    appends: int = 0
+    frames_sent: int = 0
+    chars_sent: int = 0
+
+
+@dataclass
+class StreamWriterConfig:
+    """
+    Coalescing settings for streamed output.
+
+    Args:
+        max_buffer_size: Buffered content is flushed once it reaches this number of characters
+        flush_interval_ms: Buffered content is flushed not later than this interval after the first buffered
+            delta. Set 0 to send each delta as separate frame.
+    """
+    max_buffer_size: int = 2048
+    flush_interval_ms: int = 30
+    stats: StreamWriterStats = field(default_factory=StreamWriterStats)
+
+
+class StreamWriter:
+    """
+    Buffered writer around `Choice`/`Stage` that coalesces token deltas into bigger frames.
+    Use it as context manager, buffered content is always flushed on exit (before stage is closed).
+    """
+
+    def __init__(self, target: _ContentTarget, config: StreamWriterConfig):
+        self._target = target
+        self._config = config
+        self._parts: list[str] = []
+        self._buffer: list[str] = []
+        self._buffer_size = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def __enter__(self) -> 'StreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.flush()
+        return False
+
+    @property
+    def content(self) -> str:
+        """All content written so far."""
+        return "".join(self._parts)
+
+    def append_content(self, content: str) -> None:
+        if not content:
+            return
+        self._config.stats.appends += 1
+        self._parts.append(content)
+        self._buffer.append(content)
+        self._buffer_size += len(content)
+
+        if self._buffer_size >= self._config.max_buffer_size or self._config.flush_interval_ms <= 0:
+            self.flush()
+        elif self._flush_handle is None:
+            self._schedule_flush()
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return
+
+        frame = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_size = 0
+        self._target.append_content(frame)
+        self._config.stats.frames_sent += 1
+        self._config.stats.chars_sent += len(frame)
+
+    def _schedule_flush(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop, content will be flushed by size or on exit
+            return
+        self._flush_handle = loop.call_later(self._config.flush_interval_ms / 1000, self.flush)
@@ -0,0 +1,95 @@
+import asyncio
+import json
+from typing import Any, Awaitable, Callable
+
+from aidial_client.types.chat.legacy.chat_completion import ToolCall
+
+
+class ToolCallDispatcher:
+    """
+    Collects streamed tool call deltas and launches every tool call as soon as its arguments are complete,
+    so tool execution overlaps with the rest of the orchestration stream.
+
+    A tool call is treated as complete when:
+        - its accumulated `function.arguments` parse as a JSON object, or
+        - a tool call with a higher index appears in the stream (models stream tool calls one after another), or
+        - the stream is finished (see `finish`).
+    """
+
+    def __init__(self, launch: Callable[[ToolCall], Awaitable[dict[str, Any]]]):
+        self._launch = launch
+        self._tool_call_deltas: dict[int, Any] = {}
+        self._tool_calls: dict[int, ToolCall] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def add_delta(self, tool_call_delta: Any) -> None:
+        """
+        Add streamed tool call delta and dispatch tool calls that became complete.
+
+        Args:
+            tool_call_delta: Tool call delta from the completion chunk
+        """
+        index = tool_call_delta.index
+        if tool_call_delta.id:
+            for previous_index in list(self._tool_call_deltas):
+                if previous_index < index:
+                    self._dispatch(previous_index)
+            self._tool_call_deltas[index] = tool_call_delta
+        else:
+            tool_call = self._tool_call_deltas.get(index)
+            if tool_call is None or index in self._tasks or not tool_call_delta.function:
+                return
+            tool_call.function.arguments += tool_call_delta.function.arguments or ""
+
+        if self._is_arguments_complete(self._tool_call_deltas[index].function.arguments):
+            self._dispatch(index)
+
+    @property
+    def has_tool_calls(self) -> bool:
+        return bool(self._tool_call_deltas)
+
+    async def finish(self) -> tuple[list[ToolCall], list[dict[str, Any]]]:
+        """
+        Dispatch the rest of tool calls and wait for all of them. If one of them fails, the rest are cancelled and
+        awaited before its exception is raised.
+
+        Returns:
+            Tuple of (tool_calls, tool_messages) ordered by tool call index
+        """
+        for index in self._tool_call_deltas:
+            self._dispatch(index)
+        indexes = sorted(self._tasks)
+        try:
+            tool_messages = await asyncio.gather(*(self._tasks[index] for index in indexes))
+        except BaseException:
+            await self.cancel()
+            raise
+        return [self._tool_calls[index] for index in indexes], list(tool_messages)
+
+    async def cancel(self) -> None:
+        """
+        Cancel already launched tool calls (e.g. when orchestration stream failed) and wait until they are finished,
+        so no tool keeps writing to the choice after it.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _dispatch(self, index: int) -> None:
+        if index in self._tasks:
+            return
+        tool_call = ToolCall.validate(self._tool_call_deltas[index])
+        self._tool_calls[index] = tool_call
+        self._tasks[index] = asyncio.create_task(self._launch(tool_call))
+
+    @staticmethod
+    def _is_arguments_complete(arguments: str | None) -> bool:
+        # Arguments are always JSON object, so there is no sense to try to parse them until closing brace arrives.
+        # Once JSON object is parsed successfully no more valid chunks can be appended to it.
+        if not arguments or not arguments.rstrip().endswith("}"):
+            return False
+        try:
+            return isinstance(json.loads(arguments), dict)
+        except ValueError:
+            return False
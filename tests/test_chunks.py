@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from task.tools.rag.chunks import StreamingTextSplitter, split_document
+
+_CHUNK_SIZE = 500
+_CHUNK_OVERLAP = 50
+_MANUAL = (Path(__file__).parent / "microwave_manual.txt").read_text(encoding="utf-8")
+
+
+def _text_splitter() -> RecursiveCharacterTextSplitter:
+    # The same settings as RagTool uses
+    return RecursiveCharacterTextSplitter(
+        chunk_size=_CHUNK_SIZE,
+        chunk_overlap=_CHUNK_OVERLAP,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""],
+        add_start_index=True,
+    )
+
+
+def _split_whole(text: str) -> list[tuple[str, int]]:
+    chunks = split_document(_text_splitter(), text)
+    return list(zip(chunks, (int(start) for start in chunks.starts)))
+
+
+def _split_streamed(text: str, window: int) -> tuple[list[tuple[str, int]], int]:
+    """Returns chunks and number of them that are final before the end of text."""
+    splitter = StreamingTextSplitter(_text_splitter(), _CHUNK_SIZE, _CHUNK_OVERLAP)
+    chunks = []
+    for start in range(0, len(text), window):
+        chunks.extend(splitter.push(text[start:start + window]))
+    streamed = len(chunks)
+    return chunks + splitter.finish(), streamed
+
+
+def _words(count: int, separator: str = " ") -> str:
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta"]
+    return separator.join(words[i % len(words)] for i in range(count))
+
+
+@pytest.mark.parametrize("window", [1, 97, 499, 500, 501, 700, 999, 1000, 1001, 4096, 100_000])
+def test_streamed_chunks_are_the_same_as_whole_text_chunks(window):
+    chunks, streamed = _split_streamed(_MANUAL, window)
+
+    assert chunks == _split_whole(_MANUAL)
+    if window < len(_MANUAL) // 2:
+        assert streamed > 0
+
+
+@pytest.mark.parametrize("window", [13, 250, 700, 1500])
+def test_large_paragraphs_and_blank_lines(window):
+    # Paragraphs longer than chunk size are split recursively, runs of blank lines give whitespace-only splits
+    text = "\n\n\n\n".join([
+        _words(20),
+        _words(300),
+        _words(30, separator=". "),
+        "\n\n".join(_words(n) for n in (5, 60, 2, 90)),
+        _words(150, separator="\n"),
+    ])
+
+    assert _split_streamed(text, window)[0] == _split_whole(text)
+
+
+@pytest.mark.parametrize("window", [50, 700])
+def test_text_without_paragraphs(window):
+    text = _words(1000, separator="\n")
+
+    assert _split_streamed(text, window)[0] == _split_whole(text)
+
+
+def test_empty_text():
+    splitter = StreamingTextSplitter(_text_splitter(), _CHUNK_SIZE, _CHUNK_OVERLAP)
+
+    assert splitter.push("") == []
+    assert splitter.finish() == []
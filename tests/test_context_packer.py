@@ -0,0 +1,68 @@
+from task.tools.rag.chunks import RetrievedChunk
+from task.tools.rag.context_packer import ContextPacker
+
+
+def _chunk(text: str, score: float, start: int) -> RetrievedChunk:
+    return RetrievedChunk(text, score, start, start + len(text))
+
+
+def test_overlapping_chunks_are_merged():
+    text = "one two three four five six seven eight nine ten"
+    first = _chunk(text[:25], 0.5, 0)
+    second = _chunk(text[15:], 0.9, 15)
+
+    packed = ContextPacker(token_budget=1000).pack({"doc": [second, first]})
+
+    assert packed == {"doc": [RetrievedChunk(text, 0.9, 0, len(text))]}
+
+
+def test_adjacent_chunks_are_merged_with_line_break():
+    first = _chunk("first chunk", 0.5, 0)
+    second = _chunk("second chunk", 0.4, first.end + 1)
+
+    packed = ContextPacker(token_budget=1000).pack({"doc": [first, second]})
+
+    assert [span.text for span in packed["doc"]] == ["first chunk\nsecond chunk"]
+
+
+def test_contained_chunk_is_merged_into_outer_one():
+    outer = _chunk("one two three four five six", 0.3, 0)
+    inner = _chunk("three four", 0.8, 8)
+
+    packed = ContextPacker(token_budget=1000).pack({"doc": [outer, inner]})
+
+    assert packed["doc"] == [RetrievedChunk(outer.text, 0.8, 0, outer.end)]
+
+
+def test_duplicates_of_better_spans_are_dropped():
+    text = "the plate should be cleaned with warm water and mild detergent after each use"
+    packer = ContextPacker(token_budget=1000)
+
+    packed = packer.pack({"a": [_chunk(text, 0.9, 0)], "b": [_chunk(text, 0.7, 100)], "c": []})
+
+    assert [span.score for span in packed["a"]] == [0.9]
+    assert packed["b"] == []
+    assert packed["c"] == []
+    assert packer.stats.dropped_duplicates == 1
+
+
+def test_spans_over_budget_are_dropped():
+    best = _chunk("a" * 40, 0.9, 0)
+    second = _chunk("b" * 40, 0.8, 1000)
+    third = _chunk("c" * 8, 0.7, 2000)
+    packer = ContextPacker(token_budget=14, count_tokens=lambda text: len(text) // 4)
+
+    packed = packer.pack({"doc": [third, second, best]})
+
+    assert [span.text for span in packed["doc"]] == [best.text, third.text]
+    assert packer.stats.dropped_over_budget == 1
+
+
+def test_best_span_is_truncated_to_budget():
+    packer = ContextPacker(token_budget=5, count_tokens=lambda text: len(text) // 4)
+
+    packed = packer.pack({"doc": [_chunk("x" * 100, 0.9, 10)]})
+
+    span = packed["doc"][0]
+    assert len(span.text) // 4 <= 5
+    assert span.end == span.start + len(span.text)
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import faiss
+import numpy as np
+
+from task.tools.rag.chunks import DocumentChunks
+from task.tools.rag.document_cache import DocumentCache
+
+
+def _entry(vectors: int) -> tuple[faiss.Index, DocumentChunks]:
+    index = faiss.IndexFlatIP(4)
+    index.add(np.ones((vectors, 4), dtype='float32'))
+    chunks = DocumentChunks([f"chunk {i}" for i in range(vectors)], list(range(vectors)))
+    return index, chunks
+
+
+def _entry_size(vectors: int) -> int:
+    index, chunks = _entry(vectors)
+    return index.ntotal * index.d * 4 + chunks.size
+
+
+def test_least_recently_used_entries_are_evicted_over_size():
+    cache = DocumentCache(max_size_bytes=_entry_size(10) * 2)
+    cache.set("a", *_entry(10))
+    cache.set("b", *_entry(10))
+    assert cache.get("a") is not None
+    cache.set("c", *_entry(10))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats.evictions == 1
+    assert cache.size_bytes() == _entry_size(10) * 2
+
+
+def test_replaced_entry_is_accounted_once():
+    cache = DocumentCache(max_size_bytes=_entry_size(10) * 2)
+    cache.set("a", *_entry(5))
+    cache.set("a", *_entry(10))
+
+    assert cache.size() == 1
+    assert cache.size_bytes() == _entry_size(10)
+
+
+def test_oversized_entry_is_not_cached():
+    cache = DocumentCache(max_size_bytes=_entry_size(10))
+    cache.set("a", *_entry(5))
+    cache.set("b", *_entry(100))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size_bytes() == _entry_size(5)
+
+
+def test_expired_entries_are_cleaned_up():
+    cache = DocumentCache(ttl=timedelta(0))
+    cache.set("a", *_entry(5))
+
+    assert cache.cleanup_old_entries() == 1
+    assert cache.size() == 0
+    assert cache.size_bytes() == 0
+
+
+def test_references_resolve_to_entry():
+    cache = DocumentCache()
+    cache.set("content", *_entry(5))
+    cache.set_reference("conversation:file", "content")
+
+    assert cache.get_reference("conversation:file") == "content"
+    assert cache.get_reference("other") is None
+
+
+def test_cleanup_thread_stops():
+    cache = DocumentCache.create()
+    cache.stop_cleanup_task()
+
+    assert not cache._cleanup_thread.is_alive()
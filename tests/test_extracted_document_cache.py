@@ -0,0 +1,97 @@
+import time
+
+from task.utils.extracted_document_cache import ExtractedDocumentCache
+
+
+class _Document:
+    """Document with size that can change after it is cached, as lazily parsed one."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+
+def test_least_recently_used_documents_are_evicted_over_size():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    cache.set("a", "1", _Document(40))
+    cache.set("b", "1", _Document(40))
+    assert cache.get("a", "1") is not None
+    cache.set("c", "1", _Document(40))
+
+    assert cache.get("b", "1") is None
+    assert cache.get("a", "1") is not None
+    assert cache.get("c", "1") is not None
+    assert cache.size_bytes() == 80
+
+
+def test_size_is_accounted_as_on_insert():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    document = _Document(10)
+    cache.set("a", "1", document)
+    # Lazily parsed document grows after it is cached
+    document.size = 90
+    cache.set("b", "1", _Document(20))
+    cache.remove("a", "1")
+    cache.remove("b", "1")
+
+    assert cache.size() == 0
+    assert cache.size_bytes() == 0
+
+
+def test_replaced_document_is_accounted_once():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    cache.set("a", "1", _Document(30))
+    cache.set("a", "1", _Document(50))
+
+    assert cache.size() == 1
+    assert cache.size_bytes() == 50
+
+
+def test_remove_keeps_replaced_document():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    failed = _Document(10)
+    complete = _Document(20)
+    cache.set("a", "1", failed)
+    cache.set("a", "1", complete)
+    cache.remove("a", "1", failed)
+
+    assert cache.get("a", "1") is complete
+
+
+def test_oversized_document_is_not_cached():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    cache.set("a", "1", _Document(50))
+    cache.set("b", "1", _Document(200))
+
+    assert cache.get("b", "1") is None
+    assert cache.get("a", "1") is not None
+    assert cache.size_bytes() == 50
+
+
+def test_oversized_document_is_kept_alone_if_allowed():
+    cache = ExtractedDocumentCache(max_size_bytes=100, keep_oversized=True)
+    cache.set("a", "1", _Document(50))
+    cache.set("b", "1", _Document(200))
+
+    assert cache.get("a", "1") is None
+    assert cache.get("b", "1") is not None
+    assert cache.size_bytes() == 200
+
+    cache.set("c", "1", _Document(10))
+    assert cache.get("b", "1") is None
+    assert cache.size_bytes() == 10
+
+
+def test_expired_document_is_removed():
+    cache = ExtractedDocumentCache(max_size_bytes=100, ttl_seconds=0.01)
+    cache.set("a", "1", _Document(10))
+    time.sleep(0.02)
+
+    assert cache.get("a", "1") is None
+    assert cache.size_bytes() == 0
+
+
+def test_documents_are_keyed_by_fingerprint():
+    cache = ExtractedDocumentCache(max_size_bytes=100)
+    cache.set("a", "1", _Document(10))
+
+    assert cache.get("a", "2") is None
@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from task.tools.py_interpreter.kernel_sessions import KernelSessionManager
+
+
+class _FakeInterpreterClient:
+    """Starts a new session on each call, as interpreter MCP server does for calls without session id."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def call_tool(self, tool_name, tool_args, progress_callback=None):
+        self.calls += 1
+        return json.dumps({"session_info": {"session_id": f"session-{self.calls}"}})
+
+
+def _manager(client: _FakeInterpreterClient, **kwargs) -> KernelSessionManager:
+    return KernelSessionManager(client, "execute_code", **kwargs)
+
+
+def test_new_conversation_claims_warm_session_and_keeps_it():
+    async def run():
+        manager = _manager(_FakeInterpreterClient(), warm_sessions=1)
+        manager.acquire("warm-up")
+        await asyncio.sleep(0)
+        first = manager.acquire("conversation")
+        second = manager.acquire("conversation")
+        manager.stop()
+        return first, second, manager.stats
+
+    first, second, stats = asyncio.run(run())
+    assert first == second == "session-1"
+    assert stats.pool_hits == 1
+    assert stats.affinity_hits == 1
+
+
+def test_conversation_without_warm_session_starts_new_one():
+    async def run():
+        manager = _manager(_FakeInterpreterClient(), warm_sessions=0)
+        session_id = manager.acquire("conversation")
+        manager.bind("conversation", "started-by-call")
+        rebound = manager.acquire("conversation")
+        manager.stop()
+        return session_id, rebound, manager.stats
+
+    session_id, rebound, stats = asyncio.run(run())
+    assert session_id is None
+    assert rebound == "started-by-call"
+    assert stats.pool_misses == 1
+
+
+def test_pool_is_refilled_after_claim():
+    async def run():
+        client = _FakeInterpreterClient()
+        manager = _manager(client, warm_sessions=2)
+        manager.acquire("first")
+        await asyncio.sleep(0)
+        manager.acquire("second")
+        await asyncio.sleep(0)
+        manager.stop()
+        return client.calls, len(manager._warm_pool)
+
+    calls, warm_sessions = asyncio.run(run())
+    assert calls == 3
+    assert warm_sessions == 2
+
+
+def test_idle_sessions_are_reaped():
+    async def run():
+        manager = _manager(_FakeInterpreterClient(), warm_sessions=0, session_ttl_seconds=0.01)
+        manager.bind("conversation", "session")
+        await asyncio.sleep(0.02)
+        removed = manager.reap_idle_sessions()
+        session_id = manager.acquire("conversation")
+        manager.stop()
+        return removed, session_id
+
+    removed, session_id = asyncio.run(run())
+    assert removed == 1
+    assert session_id is None
+
+
+def test_lock_is_shared_by_conversation():
+    async def run():
+        manager = _manager(_FakeInterpreterClient())
+        lock = manager.lock("conversation")
+        return lock is manager.lock("conversation"), lock is manager.lock("other")
+
+    assert asyncio.run(run()) == (True, False)
@@ -0,0 +1,52 @@
+import asyncio
+
+from task.tools.mcp.mcp_tool_model import MCPToolModel
+from task.tools.py_interpreter.python_code_interpreter_tool import PythonCodeInterpreterTool
+
+
+class _FakeDialClient:
+    def __init__(self, calls: list[str], api_key: str):
+        self._calls = calls
+        self._api_key = api_key
+
+    async def my_bucket(self) -> str:
+        self._calls.append(self._api_key)
+        return f"bucket-{self._api_key}"
+
+
+class _FakeClientRegistry:
+    def __init__(self):
+        self.calls: list[str] = []
+
+    def async_client(self, endpoint: str, api_key: str) -> _FakeDialClient:
+        return _FakeDialClient(self.calls, api_key)
+
+
+def _tool(registry: _FakeClientRegistry, **kwargs) -> PythonCodeInterpreterTool:
+    tool_model = MCPToolModel(name="execute_code", description="Executes code", parameters={})
+    return PythonCodeInterpreterTool(
+        None, [tool_model], "execute_code", "http://dial", registry, warm_sessions=0, **kwargs  # type: ignore
+    )
+
+
+def test_bucket_is_requested_once_per_api_key():
+    async def run():
+        registry = _FakeClientRegistry()
+        tool = _tool(registry)
+        buckets = [await tool._get_bucket(api_key) for api_key in ("a", "a", "b", "a")]
+        return buckets, registry.calls
+
+    buckets, calls = asyncio.run(run())
+    assert buckets == ["bucket-a", "bucket-a", "bucket-b", "bucket-a"]
+    assert calls == ["a", "b"]
+
+
+def test_expired_bucket_is_requested_again():
+    async def run():
+        registry = _FakeClientRegistry()
+        tool = _tool(registry, bucket_ttl_seconds=0)
+        await tool._get_bucket("a")
+        await tool._get_bucket("a")
+        return registry.calls
+
+    assert asyncio.run(run()) == ["a", "a"]
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from task.utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_the_same_key_share_one_call():
+    async def run():
+        single_flight = SingleFlight()
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(single_flight.do("key", load) for _ in range(5)))
+        return calls, results, single_flight.in_flight("key")
+
+    calls, results, in_flight = asyncio.run(run())
+    assert calls == 1
+    assert results == [1] * 5
+    assert not in_flight
+
+
+def test_key_is_released_after_call():
+    async def run():
+        single_flight = SingleFlight()
+        first = await single_flight.do("key", lambda: asyncio.sleep(0, result="first"))
+        second = await single_flight.do("key", lambda: asyncio.sleep(0, result="second"))
+        return first, second
+
+    assert asyncio.run(run()) == ("first", "second")
+
+
+def test_exception_is_raised_for_all_callers():
+    async def run():
+        single_flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        return await asyncio.gather(*(single_flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_caller_does_not_cancel_call_for_others():
+    async def run():
+        single_flight = SingleFlight()
+
+        async def load():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(single_flight.do("key", load))
+        second = asyncio.ensure_future(single_flight.do("key", load))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
@@ -0,0 +1,133 @@
+import asyncio
+from typing import Optional
+
+import pytest
+from aidial_client.types.chat.response import ToolCallDelta
+
+from task.utils.tool_call_dispatcher import ToolCallDispatcher
+
+
+def _delta(index: int, arguments: str, id: Optional[str] = None, name: Optional[str] = None) -> ToolCallDelta:
+    if id is None:
+        return ToolCallDelta(index=index, function={"arguments": arguments})
+    return ToolCallDelta(index=index, id=id, type="function", function={"name": name, "arguments": arguments})
+
+
+class _Tools:
+    """Launch function that records launched tool calls, each of them waits for its `release` event."""
+
+    def __init__(self):
+        self.launched: list[str] = []
+        self.finished: list[str] = []
+        self.cancelled: list[str] = []
+        self.release: dict[str, asyncio.Event] = {}
+
+    async def launch(self, tool_call) -> dict:
+        self.launched.append(tool_call.id)
+        release = self.release.setdefault(tool_call.id, asyncio.Event())
+        try:
+            await release.wait()
+            if '"fail"' in tool_call.function.arguments:
+                raise ValueError(f"{tool_call.id} failed")
+        except asyncio.CancelledError:
+            self.cancelled.append(tool_call.id)
+            raise
+        self.finished.append(tool_call.id)
+        return {"role": "tool", "tool_call_id": tool_call.id, "content": tool_call.function.arguments}
+
+
+def test_tool_is_launched_as_soon_as_arguments_are_complete():
+    async def run():
+        tools = _Tools()
+        dispatcher = ToolCallDispatcher(tools.launch)
+        dispatcher.add_delta(_delta(0, '{"query": ', id="call_0", name="search"))
+        await asyncio.sleep(0)
+        launched_before = list(tools.launched)
+        dispatcher.add_delta(_delta(0, '"plate"}'))
+        await asyncio.sleep(0)
+        launched_after = list(tools.launched)
+        tools.release["call_0"].set()
+        tool_calls, tool_messages = await dispatcher.finish()
+        return launched_before, launched_after, tool_calls, tool_messages
+
+    launched_before, launched_after, tool_calls, tool_messages = asyncio.run(run())
+    assert launched_before == []
+    assert launched_after == ["call_0"]
+    assert [tool_call.id for tool_call in tool_calls] == ["call_0"]
+    assert tool_messages[0]["content"] == '{"query": "plate"}'
+
+
+def test_previous_tool_call_is_launched_when_next_one_starts():
+    async def run():
+        tools = _Tools()
+        dispatcher = ToolCallDispatcher(tools.launch)
+        # Arguments are not parsable JSON object yet, but model already streams the next tool call
+        dispatcher.add_delta(_delta(0, '{"a": 1', id="call_0", name="first"))
+        dispatcher.add_delta(_delta(1, '{"b": ', id="call_1", name="second"))
+        await asyncio.sleep(0)
+        launched = list(tools.launched)
+        dispatcher.add_delta(_delta(1, '2}'))
+        for event in ("call_0", "call_1"):
+            tools.release.setdefault(event, asyncio.Event()).set()
+        tool_calls, _ = await dispatcher.finish()
+        return launched, [tool_call.id for tool_call in tool_calls]
+
+    launched, tool_call_ids = asyncio.run(run())
+    assert launched == ["call_0"]
+    assert tool_call_ids == ["call_0", "call_1"]
+
+
+def test_finish_returns_results_ordered_by_index():
+    async def run():
+        tools = _Tools()
+        dispatcher = ToolCallDispatcher(tools.launch)
+        dispatcher.add_delta(_delta(0, '{"n": 0}', id="call_0", name="tool"))
+        dispatcher.add_delta(_delta(1, '{"n": 1}', id="call_1", name="tool"))
+        await asyncio.sleep(0)
+        tools.release["call_1"].set()
+        await asyncio.sleep(0)
+        tools.release["call_0"].set()
+        _, tool_messages = await dispatcher.finish()
+        return tools.finished, [message["tool_call_id"] for message in tool_messages]
+
+    finished, tool_call_ids = asyncio.run(run())
+    assert finished == ["call_1", "call_0"]
+    assert tool_call_ids == ["call_0", "call_1"]
+
+
+def test_cancel_cancels_and_awaits_running_tool_calls():
+    async def run():
+        tools = _Tools()
+        dispatcher = ToolCallDispatcher(tools.launch)
+        dispatcher.add_delta(_delta(0, '{}', id="call_0", name="tool"))
+        dispatcher.add_delta(_delta(1, '{}', id="call_1", name="tool"))
+        await asyncio.sleep(0)
+        await dispatcher.cancel()
+        return tools.cancelled
+
+    assert asyncio.run(run()) == ["call_0", "call_1"]
+
+
+def test_failed_tool_call_cancels_the_rest():
+    async def run():
+        tools = _Tools()
+        dispatcher = ToolCallDispatcher(tools.launch)
+        dispatcher.add_delta(_delta(0, '{"fail": true}', id="call_0", name="tool"))
+        dispatcher.add_delta(_delta(1, '{}', id="call_1", name="tool"))
+        await asyncio.sleep(0)
+        tools.release["call_0"].set()
+        with pytest.raises(ValueError):
+            await dispatcher.finish()
+        return tools.cancelled, [task.done() for task in dispatcher._tasks.values()]
+
+    cancelled, done = asyncio.run(run())
+    assert cancelled == ["call_1"]
+    assert all(done)
+
+
+def test_deltas_without_tool_calls():
+    async def run():
+        dispatcher = ToolCallDispatcher(_Tools().launch)
+        return dispatcher.has_tool_calls, await dispatcher.finish()
+
+    assert asyncio.run(run()) == (False, ([], []))